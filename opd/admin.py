@@ -1,12 +1,41 @@
 from django.contrib import admin
+from django.db import transaction
+
 from . import models
+from .counters import write_lock
+from .stock import record_adjustment, stored_quantity
 
 # Register your models here.
 admin.site.register(models.Doctor)
 admin.site.register(models.Address)
 admin.site.register(models.Opd)
 admin.site.register(models.Inventory)
-admin.site.register(models.InventoryItem)
 admin.site.register(models.Appointment)
 admin.site.register(models.Patient)
 admin.site.register(models.MedicalData)
+
+
+@admin.register(models.InventoryItem)
+class InventoryItemAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        # NOTE: a quantity changed here lands in the ledger like a PUT
+        with write_lock, transaction.atomic():
+            previous = stored_quantity(obj.pk) if change else 0
+            super().save_model(request, obj, form, change)
+            record_adjustment(obj, previous, request.user)
+
+
+@admin.register(models.StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    # NOTE: the ledger is append-only, the admin only reads it
+    list_display = ["item", "kind", "delta", "quantity", "user", "created_at"]
+    list_filter = ["kind"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
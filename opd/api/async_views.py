@@ -0,0 +1,170 @@
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from opd.api.authentication import DoctorTokenAuthentication
+from opd.api.pagination import AppointmentPagination, PatientPagination
+from opd.api.serializers import (
+    AppointmentSerializer,
+    DoctorDetailSerializer,
+    OpdSerializer,
+    PatientSerializer,
+)
+from opd.api.sparse import narrow_queryset, sparse_requested
+from opd.metrics import span
+from opd.models import Appointment, Patient
+
+
+"""
+async variants of the hot read endpoints, mounted under api/async/.
+
+under the ASGI application (sih_api/asgi.py) a request waiting on the
+database does not hold a worker thread. they answer like the DRF views in
+views.py: same serializers, same pagination, same 401/403/404, but they only
+accept token authentication.
+
+NOTE: the serializers run inside the event loop, so every relation they read
+must already be loaded by select_related (the async orm raises
+SynchronousOnlyOperation otherwise), narrow_queryset() joins the relations of
+?expand= the same way.
+"""
+
+renderer = JSONRenderer()
+
+
+def json_response(data, status=200):
+    return HttpResponse(
+        renderer.render(data), status=status, content_type=renderer.media_type
+    )
+
+
+def error_response(exc):
+    response = json_response({"detail": exc.detail}, status=exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response["WWW-Authenticate"] = DoctorTokenAuthentication.keyword
+    return response
+
+
+def get_token_key(request):
+    header = request.headers.get("Authorization", "").split()
+    if len(header) == 2 and header[0].lower() == "token":
+        return header[1]
+    return None
+
+
+async def authenticate_doctor(key):
+    # NOTE: the same checks as CustomPermission
+    if not key:
+        raise exceptions.NotAuthenticated()
+
+    user, _ = await DoctorTokenAuthentication().aauthenticate_credentials(key)
+    return doctor_of(user)
+
+
+def doctor_of(user):
+    doctor = getattr(user, "doctor", None)
+    if not getattr(user, "is_doctor", False) or doctor is None:
+        raise exceptions.PermissionDenied()
+    return doctor
+
+
+def doctor_view(view):
+    async def wrapper(request, *args, **kwargs):
+        try:
+            doctor = await authenticate_doctor(get_token_key(request))
+            return await view(Request(request), doctor, *args, **kwargs)
+        except exceptions.APIException as e:
+            return error_response(e)
+
+    wrapper.__name__ = view.__name__
+    return require_GET(wrapper)
+
+
+async def list_response(request, queryset, serializer_class, pagination_class):
+    paginator = pagination_class()
+    if sparse_requested(request):
+        queryset = narrow_queryset(
+            queryset,
+            serializer_class(context={"request": request}),
+            paginator.get_requested_ordering(request),
+        )
+    page = await paginator.apaginate_queryset(queryset, request)
+    serializer = serializer_class(page, many=True, context={"request": request})
+    with span("serializer"):
+        data = serializer.data
+    return json_response(paginator.get_paginated_response(data).data)
+
+
+async def detail_response(request, queryset, serializer_class, pk):
+    if sparse_requested(request):
+        queryset = narrow_queryset(
+            queryset, serializer_class(context={"request": request})
+        )
+    try:
+        instance = await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        name = queryset.model._meta.object_name
+        raise exceptions.NotFound(f"No {name} matches the given query.")
+    serializer = serializer_class(instance, context={"request": request})
+    with span("serializer"):
+        return json_response(serializer.data)
+
+
+@doctor_view
+async def doctor_detail(request, doctor):
+    serializer = DoctorDetailSerializer(doctor, context={"request": request})
+    return json_response(serializer.data)
+
+
+@doctor_view
+async def opd_detail(request, doctor):
+    serializer = OpdSerializer(doctor.opd, context={"request": request})
+    return json_response(serializer.data)
+
+
+def appointment_queryset(request, doctor):
+    queryset = Appointment.objects.filter(doctor=doctor)
+
+    active = request.query_params.get("active")
+    if active is not None:
+        queryset = queryset.filter(active=active.lower() in ("1", "true"))
+    return queryset
+
+
+@doctor_view
+async def appointment_list(request, doctor):
+    return await list_response(
+        request,
+        appointment_queryset(request, doctor),
+        AppointmentSerializer,
+        AppointmentPagination,
+    )
+
+
+@doctor_view
+async def appointment_detail(request, doctor, pk):
+    return await detail_response(
+        request, appointment_queryset(request, doctor), AppointmentSerializer, pk
+    )
+
+
+def patient_queryset(doctor):
+    return Patient.objects.filter(doctor=doctor).select_related(
+        "address", "medical_data"
+    )
+
+
+@doctor_view
+async def patient_list(request, doctor):
+    return await list_response(
+        request, patient_queryset(doctor), PatientSerializer, PatientPagination
+    )
+
+
+@doctor_view
+async def patient_detail(request, doctor, pk):
+    return await detail_response(
+        request, patient_queryset(doctor), PatientSerializer, pk
+    )
@@ -0,0 +1,123 @@
+from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+
+from opd.models import Doctor
+
+
+"""
+the principal is the logged in user together with the doctor profile, the opd
+and the inventory of that doctor.
+
+all of them are loaded with a single joined query inside the authentication
+class, so the permission and the views can use request.doctor,
+request.doctor.opd and request.doctor.inventory without hitting the database
+again.
+"""
+
+DOCTOR_GROUP = "Doctor"
+
+"""
+the token itself is not cached: the key, the user and the principal come
+with the same joined query, a cached key -> user id would still need it.
+a deleted token therefore stops working in every worker at once.
+"""
+
+
+def issue_token(user):
+    # NOTE: only the key column, the INSERT only for a first login. the key is
+    # read every time, a copy kept in a worker would outlive a logout elsewhere
+    key = Token.objects.filter(user=user).values_list("key", flat=True).first()
+    if key is None:
+        key = Token.objects.get_or_create(user=user)[0].key
+    return key
+
+
+PRINCIPAL_RELATED = (
+    "doctor__address",
+    "doctor__opd",
+    "doctor__inventory",
+)
+
+
+def doctor_group_membership(user_ref="pk"):
+    return Exists(
+        User.groups.through.objects.filter(
+            user_id=OuterRef(user_ref), group__name=DOCTOR_GROUP
+        )
+    )
+
+
+def principal_queryset():
+    return User.objects.select_related(*PRINCIPAL_RELATED).annotate(
+        is_doctor=doctor_group_membership()
+    )
+
+
+def token_queryset():
+    return Token.objects.select_related(
+        *("user__" + related for related in PRINCIPAL_RELATED)
+    ).annotate(is_doctor=doctor_group_membership("user_id"))
+
+
+def attach_principal(request, user):
+    # NOTE: reverse one-to-one raise DoesNotExist when the doctor is missing
+    try:
+        doctor = user.doctor
+    except Doctor.DoesNotExist:
+        doctor = None
+
+    request.doctor = doctor
+    return user
+
+
+def load_principal(request, user):
+    """
+    used when the user was authenticated by something else than the classes
+    below (session, force_authenticate in the tests ...)
+    """
+    user = principal_queryset().get(pk=user.pk)
+    return attach_principal(request, user)
+
+
+class DoctorTokenAuthentication(authentication.TokenAuthentication):
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            attach_principal(request, result[0])
+        return result
+
+    def authenticate_credentials(self, key):
+        try:
+            token = token_queryset().get(key=key)
+        except Token.DoesNotExist:
+            token = None
+        return self.token_credentials(token)
+
+    async def aauthenticate_credentials(self, key):
+        # NOTE: same as above with the async orm, for the async views
+        try:
+            token = await token_queryset().aget(key=key)
+        except Token.DoesNotExist:
+            token = None
+        return self.token_credentials(token)
+
+    def token_credentials(self, token):
+        if token is None:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+
+        token.user.is_doctor = token.is_doctor  # type: ignore
+        return (token.user, token)
+
+
+class DoctorSessionAuthentication(authentication.SessionAuthentication):
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            user = load_principal(request, result[0])
+            return (user, result[1])
+        return result
@@ -0,0 +1,174 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import renderers, serializers
+from rest_framework.decorators import action
+
+
+"""
+full dumps of the patients, appointments and inventory of the logged in doctor
+for the hospital reporting, as CSV or NDJSON (one json object per line).
+
+the rows are read with .values_list() and .iterator(): the database cursor is
+consumed one chunk at a time while the response is being sent, so the memory
+does not grow with the number of rows. ?since= and ?until= (a date or a
+datetime, until is exclusive) bound the export on export_date_field.
+
+NOTE: the format is picked with ?output= (or the Accept header), ?format=
+belongs to DRF.
+"""
+
+EXPORT = getattr(settings, "EXPORT", {})
+CHUNK_SIZE = EXPORT.get("CHUNK_SIZE", 2000)
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class Echo:
+    """the csv writer writes into this and gets the line back"""
+
+    def write(self, value):
+        return value
+
+
+def to_json_value(value):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    # NOTE: PhoneNumber and the other field values with a text form
+    return str(value)
+
+
+# NOTE: a cell starting with one of these runs as a formula in a spreadsheet
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def to_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # NOTE: the text typed by the users, kept as text by the quote
+        return "'" + value
+    return to_json_value(value)
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(map(to_csv_value, row))
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        record = dict(zip(columns, map(to_json_value, row)))
+        yield json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def batched(lines, size):
+    # NOTE: one write per batch of lines instead of one per row
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def parse_bound(value, name):
+    bound = parse_datetime(value)
+    if bound is None:
+        day = parse_date(value)
+        if day is None:
+            raise serializers.ValidationError(
+                {name: "Enter a date (YYYY-MM-DD) or a datetime (ISO 8601)."}
+            )
+        bound = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(bound):
+        bound = timezone.make_aware(bound)
+    return bound
+
+
+class ExportRenderer(renderers.BaseRenderer):
+    """
+    lets the content negotiation accept the export media types, the rows are
+    streamed by the view and only the error responses are rendered here.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+
+class ExportMixin:
+    # NOTE: field lookups, the column is the lookup with "_" instead of "__"
+    export_fields = ["id"]
+    export_date_field = "id"
+    export_name = "export"
+
+    def get_export_queryset(self, request):
+        queryset = self.get_queryset()  # type: ignore
+
+        for param, lookup in (("since", "gte"), ("until", "lt")):
+            value = request.query_params.get(param)
+            if value:
+                bound = parse_bound(value, param)
+                field = f"{self.export_date_field}__{lookup}"
+                queryset = queryset.filter(**{field: bound})
+
+        # NOTE: the (doctor, date, id) indexes give this order without a sort
+        return queryset.order_by(self.export_date_field, "id").values_list(
+            *self.export_fields
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        renderer_classes=[renderers.JSONRenderer, CSVRenderer, NDJSONRenderer],
+    )
+    def export(self, request):
+        # NOTE: Accept: text/csv works too, */* gets the csv
+        default = request.accepted_renderer.format
+        output = request.query_params.get(
+            "output", default if default in CONTENT_TYPES else "csv"
+        )
+        if output not in CONTENT_TYPES:
+            raise serializers.ValidationError(
+                {"output": f"Choose one of {sorted(CONTENT_TYPES)}."}
+            )
+
+        columns = [field.replace("__", "_") for field in self.export_fields]
+        rows = self.get_export_queryset(request).iterator(chunk_size=CHUNK_SIZE)
+        lines = (csv_lines if output == "csv" else ndjson_lines)(columns, rows)
+
+        response = StreamingHttpResponse(
+            batched(lines, 500), content_type=CONTENT_TYPES[output]
+        )
+        filename = f"{self.export_name}-{timezone.localdate().isoformat()}.{output}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,194 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+KEYSET_PAGINATION = getattr(settings, "KEYSET_PAGINATION", {})
+
+
+class KeysetPagination(BasePagination):
+    """
+    cursor pagination on a unique ordering, e.g. (date_time, id).
+
+    the cursor stores the ordering values of the last row that was sent, the
+    next page is fetched with a WHERE on those values instead of an OFFSET, so
+    with an index on the ordering every page costs O(page size) however deep
+    the client scrolls.
+    """
+
+    # NOTE: all the fields must have the same direction and the last one must be unique
+    ordering = ("-id",)
+    # NOTE: optional named orderings the client can pick with ?ordering=
+    ordering_options = {}
+    ordering_query_param = "ordering"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = KEYSET_PAGINATION.get("PAGE_SIZE", 50)
+    max_page_size = KEYSET_PAGINATION.get("MAX_PAGE_SIZE", 500)
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page([row async for row in queryset])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_requested_ordering(request)
+        self.current_page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+
+        queryset = queryset.order_by(*self.get_ordering(self.reverse))
+        if self.position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(self.position, self.reverse)
+            )
+
+        # NOTE: one extra row tells us if there is another page after this one
+        return queryset[: self.current_page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.current_page_size
+        rows = rows[: self.current_page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_requested_ordering(self, request):
+        name = request.query_params.get(self.ordering_query_param)
+        if name is None:
+            return self.ordering
+        try:
+            return self.ordering_options[name]
+        except KeyError:
+            raise NotFound(
+                f"Invalid ordering, use one of {sorted(self.ordering_options)}"
+            )
+
+    def get_ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            field[1:] if field.startswith("-") else "-" + field
+            for field in self.ordering
+        )
+
+    def get_keyset_filter(self, position, reverse):
+        descending = self.ordering[0].startswith("-")
+        lookup = "lt" if descending != reverse else "gt"
+        names = [field.lstrip("-") for field in self.ordering]
+
+        condition = Q(**{f"{names[-1]}__{lookup}": position[-1]})
+        for name, value in zip(reversed(names[:-1]), reversed(position[:-1])):
+            condition = Q(**{f"{name}__{lookup}": value}) | (
+                Q(**{name: value}) & condition
+            )
+
+        # NOTE: the inclusive bound on the first field lets the database seek the index
+        return Q(**{f"{names[0]}__{lookup}e": position[0]}) & condition
+
+    def get_position(self, row):
+        names = [field.lstrip("-") for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    def encode_cursor(self, position, reverse):
+        values = [
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in position
+        ]
+        payload = json.dumps({"p": values, "r": int(reverse)}, separators=(",", ":"))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+
+        # NOTE: the cursor comes from the client, every value is checked by the
+        # model field of its ordering before it reaches a lookup
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values, reverse = payload["p"], bool(payload["r"])
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.clean_position_value(model, field.lstrip("-"), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, KeyError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def clean_position_value(self, model, name, value):
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError
+        field = model._meta.get_field(name)
+        value = field.to_python(value)
+        # NOTE: e.g. the integer range of the database
+        field.run_validators(value)
+        return value
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = ("-date_time", "-id")
+
+
+class PatientPagination(KeysetPagination):
+    ordering = ("-created_at", "-id")
+    ordering_options = {
+        "recent": ("-created_at", "-id"),
+        "name": ("last_name", "first_name", "id"),
+    }
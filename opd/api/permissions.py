@@ -1,9 +1,19 @@
 from rest_framework import permissions
 
+from opd.api.authentication import DOCTOR_GROUP, load_principal
+
 
 class CustomPermission(permissions.BasePermission):
     def has_permission(self, request, view):  # type: ignore
         if request.user and request.user.is_authenticated:
-            return request.user.groups.filter(name="Doctor").exists()
+            # NOTE: the principal is normally attached by the authentication class
+            if not hasattr(request, "doctor"):
+                request.user = load_principal(request, request.user)
+
+            is_doctor = getattr(request.user, "is_doctor", None)
+            if is_doctor is None:
+                is_doctor = request.user.groups.filter(name=DOCTOR_GROUP).exists()
+
+            return is_doctor and request.doctor is not None
 
         return False
@@ -0,0 +1,186 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from opd.api.sparse import sparse_requested
+from opd.counters import DeltaBuffer
+
+
+"""
+rendered responses of the per-doctor resources (doctor/, doctor/opd/).
+
+the entries live in the cache alias named by RESPONSE_CACHE["ALIAS"], so the
+backend is picked in CACHES: LocMemCache evicts the least recently used entry
+past MAX_ENTRIES, FileBasedCache shares the entries between the workers of a
+host. an entry is keyed by doctor and resource and is dropped by the model
+signals (see opd/signals.py) once the transaction that changed the data
+commits, the TIMEOUT only bounds the lifetime of entries nobody invalidated.
+
+NOTE: the rendered urls (profile_image) are absolute, built from the scheme
+and Host of the request. an entry therefore holds one response per origin,
+and the invalidation of the entry drops all of them.
+
+a view takes part with CachedResponseMixin and a cache_resource name, the
+resources listed in RESPONSE_CACHE["DISABLED"] are not cached.
+
+the invalidations only reach the cache of the process that made them when
+the backend keeps its entries in memory (LocMemCache): with more than one
+worker (RESPONSE_CACHE["WORKERS"]) the other ones would serve stale
+responses until the TIMEOUT, so the cache is turned off and "manage.py check"
+warns about it.
+"""
+
+RESPONSE_CACHE = getattr(settings, "RESPONSE_CACHE", {})
+ALIAS = RESPONSE_CACHE.get("ALIAS", "default")
+TIMEOUT = RESPONSE_CACHE.get("TIMEOUT", 300)
+DISABLED = set(RESPONSE_CACHE.get("DISABLED", []))
+WORKERS = RESPONSE_CACHE.get("WORKERS", 1)
+
+# NOTE: backends whose entries live in the memory of each process
+PROCESS_LOCAL_BACKENDS = {"django.core.cache.backends.locmem.LocMemCache"}
+
+
+def process_local_cache(alias=ALIAS):
+    return settings.CACHES[alias]["BACKEND"] in PROCESS_LOCAL_BACKENDS
+
+
+ENABLED = WORKERS <= 1 or not process_local_cache()
+
+
+@checks.register(checks.Tags.caches)
+def check_response_cache(app_configs, **kwargs):
+    if WORKERS > 1 and process_local_cache():
+        return [
+            checks.Warning(
+                f"the {ALIAS!r} cache is local to each of the {WORKERS} workers, "
+                "the response cache is disabled.",
+                hint="point RESPONSE_CACHE['ALIAS'] to a shared cache backend.",
+                id="opd.W001",
+            )
+        ]
+    return []
+
+
+# NOTE: only these headers are replayed from a cached response
+CACHED_HEADERS = [
+    "Content-Type",
+    "ETag",
+    "Last-Modified",
+    "Cache-Control",
+    "Vary",
+    "Allow",
+]
+
+# NOTE: resource -> hits/misses of this process
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def count(resource, outcome):
+    with _stats_lock:
+        _stats[(resource, outcome)] += 1
+
+
+def response_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    resources = sorted({resource for resource, _ in stats})
+    return {
+        resource: {
+            "hits": stats.get((resource, "hit"), 0),
+            "misses": stats.get((resource, "miss"), 0),
+        }
+        for resource in resources
+    }
+
+
+def reset_response_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def cache_key(doctor_id, resource):
+    return f"response:{doctor_id}:{resource}"
+
+
+def request_origin(request):
+    return f"{request.scheme}://{request.get_host()}"
+
+
+def apply_invalidations(doctor_id, resources):
+    keys = [cache_key(doctor_id, resource) for resource in resources]
+    caches[ALIAS].delete_many(keys)
+
+
+# NOTE: the signals record the stale resources, they are dropped on commit
+response_invalidations = DeltaBuffer(apply_invalidations, transactional=False)
+
+
+def invalidate_responses(doctor_id, *resources):
+    response_invalidations.add_many(doctor_id, dict.fromkeys(resources, 1))
+
+
+class CachedResponseMixin:
+    cache_resource = None
+
+    def response_cache_enabled(self, request):
+        # NOTE: the browsable api renders the user and the forms, only json is cached
+        return (
+            ENABLED
+            and self.cache_resource is not None
+            and self.cache_resource not in DISABLED
+            and request.accepted_renderer.format == "json"
+            and not sparse_requested(request)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.response_cache_enabled(request):
+            return super().retrieve(request, *args, **kwargs)  # type: ignore
+
+        key = cache_key(request.doctor.pk, self.cache_resource)
+        origin = request_origin(request)
+        entry = caches[ALIAS].get(key, {}).get(origin)
+        if entry is not None:
+            count(self.cache_resource, "hit")
+            return self.cached_response(request, entry)
+
+        count(self.cache_resource, "miss")
+        response = super().retrieve(request, *args, **kwargs)  # type: ignore
+        if response.status_code == 200:
+            response.add_post_render_callback(
+                lambda rendered: self.store_response(key, origin, rendered)
+            )
+        response["X-Cache"] = "MISS"
+        return response
+
+    def store_response(self, key, origin, response):
+        headers = {
+            name: response[name]
+            for name in CACHED_HEADERS
+            if response.has_header(name)
+        }
+        # NOTE: origin -> (headers, content)
+        entries = caches[ALIAS].get(key, {})
+        entries[origin] = (headers, response.content)
+        caches[ALIAS].set(key, entries, TIMEOUT)
+
+    def cached_response(self, request, entry):
+        headers, content = entry
+        response = get_conditional_response(
+            request,
+            etag=headers.get("ETag"),
+            last_modified=parse_http_date_safe(headers.get("Last-Modified")),
+        )
+        if response is None:
+            response = HttpResponse(content)
+        for name, value in headers.items():
+            if not (name == "Content-Type" and response.status_code == 304):
+                response[name] = value
+        response["X-Cache"] = "HIT"
+        return response
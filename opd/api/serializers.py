@@ -1,6 +1,8 @@
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 from django.urls import reverse
+from opd.api.sparse import SparseFieldsMixin
 from opd.models import (
     Appointment,
     Doctor,
@@ -9,8 +11,10 @@ from opd.models import (
     MedicalData,
     Opd,
     Patient,
+    StockMovement,
 )
 from django.contrib.auth.models import User
+from opd.onboarding import onboard_doctor
 
 
 class RegistrationSerializer(serializers.ModelSerializer):
@@ -42,16 +46,15 @@ class RegistrationSerializer(serializers.ModelSerializer):
         return value
 
     def create(self, validated_data):
-        validated_data.pop("password2")
-        user = User.objects.create(
-            username=validated_data["username"], email=validated_data["email"]
+        # NOTE: creates the doctor, opd and inventory too, in one transaction
+        return onboard_doctor(
+            validated_data["username"],
+            validated_data["email"],
+            validated_data["password"],
         )
-        user.set_password(validated_data["password"])
-        user.save()
-        return user
 
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         exclude = [
@@ -59,7 +62,7 @@ class AddressSerializer(serializers.ModelSerializer):
         ]
 
 
-class DoctorSerializer(serializers.HyperlinkedModelSerializer):
+class DoctorSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name="opd:doctor-detail",  # NOTE: don't forget about the name-space
         lookup_field="pk",
@@ -75,16 +78,45 @@ class DoctorSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
 
-class DoctorDetailSerializer(serializers.ModelSerializer):
+class DoctorSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # NOTE: the doctor of ?expand=doctor
+    class Meta:
+        model = Doctor
+        fields = [
+            "id",
+            "name",
+            "speciality",
+            "experience",
+        ]
+
+
+class DoctorDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     address = AddressSerializer()
+    profile_image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Doctor
         exclude = [
             "created_at",
+            "last_updated",
+            "image_variants",
             "user",
         ]
 
+    def get_profile_image_variants(self, obj):
+        # NOTE: empty until opd/images.py made the variants of the current image
+        variants = dict(obj.image_variants)
+        if variants.pop("source", None) != obj.profile_image.name:
+            return {}
+
+        request = self.context.get("request")
+        storage = obj.profile_image.storage
+        urls = {}
+        for variant, name in variants.items():
+            url = storage.url(name)
+            urls[variant] = request.build_absolute_uri(url) if request else url
+        return urls
+
     def update(self, instance, validated_data):
         # handle the address serialization seprately
         doctor_address = validated_data.pop("address", None)
@@ -108,7 +140,7 @@ class DoctorDetailSerializer(serializers.ModelSerializer):
         return instance
 
 
-class OpdSerializer(serializers.ModelSerializer):
+class OpdSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
 
     class Meta:
@@ -120,6 +152,11 @@ class OpdSerializer(serializers.ModelSerializer):
             "max_patient_capacity",
             "active_patient",
             "no_of_appointment",
+            "opening_time",
+            "closing_time",
+            "slot_duration",
+            "slot_capacity",
+            "daily_booking_limit",
             "last_updated",
         ]
 
@@ -127,6 +164,17 @@ class OpdSerializer(serializers.ModelSerializer):
         if "active_patient" in attrs and "max_patient_capacity" in attrs:
             if attrs["active_patient"] > attrs["max_patient_capacity"]:
                 raise serializers.ValidationError({"error": "No capacity Available"})
+
+        opening_time = attrs.get(
+            "opening_time", getattr(self.instance, "opening_time", None)
+        )
+        closing_time = attrs.get(
+            "closing_time", getattr(self.instance, "closing_time", None)
+        )
+        if opening_time and closing_time and closing_time <= opening_time:
+            raise serializers.ValidationError(
+                {"error": "closing time must be after the opening time"}
+            )
         return attrs
 
     def get_url(self, obj):
@@ -135,12 +183,13 @@ class OpdSerializer(serializers.ModelSerializer):
         return reverse("opd:doctor")
 
 
-class InventoryItemSerializer(serializers.ModelSerializer):
+class InventoryItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     total_item = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = InventoryItem
         fields = [
+            "id",
             "item_name",
             "item_quantity",
             "item_price",
@@ -148,14 +197,58 @@ class InventoryItemSerializer(serializers.ModelSerializer):
             "total_item",
         ]
 
+    def validate_item_name(self, value):
+        # NOTE: inventory is not a field of the serializer, so DRF does not check the constraint
+        items = InventoryItem.objects.filter(
+            inventory=self.context["inventory"], item_name=value
+        )
+        if self.instance is not None:
+            items = items.exclude(pk=self.instance.pk)
+        if items.exists():
+            raise serializers.ValidationError("item already exist in the inventory")
+        return value
+
     def get_total_item(self, obj):
-        inventory = self.context["inventory"]
-        return InventoryItem.objects.filter(inventory=inventory)
+        # NOTE: the summary is computed once per request by the view
+        return self.context["inventory_summary"]()["item_count"]
 
     read_only_fields = ["last_updated", "total_item"]
 
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class StockMovementSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ["id", "item", "kind", "delta", "quantity", "user", "created_at"]
+        read_only_fields = fields
+
+
+class StockLineSerializer(serializers.Serializer):
+    item = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class StockBatchSerializer(serializers.Serializer):
+    movements = StockLineSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_movements(self, value):
+        # NOTE: one query for the whole batch, the items must be of this inventory
+        ids = {line["item"] for line in value}
+        known = set(
+            InventoryItem.objects.filter(
+                inventory=self.context["inventory"], pk__in=ids
+            ).values_list("id", flat=True)
+        )
+        unknown = sorted(ids - known)
+        if unknown:
+            raise serializers.ValidationError(
+                f"items {unknown} are not in the inventory"
+            )
+        return [(line["item"], line["quantity"]) for line in value]
+
+
+class AppointmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {"doctor": (DoctorSummarySerializer, {})}
+
     class Meta:
         model = Appointment
         fields = [
@@ -169,7 +262,12 @@ class AppointmentSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "date_time", "last_upated"]
 
 
-class MedicalDataSerializer(serializers.ModelSerializer):
+class BookingSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=256)
+    slot = serializers.DateTimeField()
+
+
+class MedicalDataSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MedicalData
         fields = [
@@ -183,9 +281,36 @@ class MedicalDataSerializer(serializers.ModelSerializer):
         read_only = ["id"]
 
 
-class PatientSerializer(serializers.ModelSerializer):
+class PatientListSerializer(serializers.ListSerializer):
+    """
+    bulk intake: one INSERT per table for the whole list of patients, the
+    post_bulk_create signal then bumps the opd counter once per doctor.
+    """
+
+    def create(self, validated_data):
+        validated_data = [dict(attrs) for attrs in validated_data]
+
+        with transaction.atomic():
+            addresses = Address.objects.bulk_create(
+                [Address(**attrs.pop("address")) for attrs in validated_data]
+            )
+            medical_data = MedicalData.objects.bulk_create(
+                [MedicalData(**attrs.pop("medical_data")) for attrs in validated_data]
+            )
+            return Patient.objects.bulk_create(
+                [
+                    Patient(address=address, medical_data=data, **attrs)
+                    for attrs, address, data in zip(
+                        validated_data, addresses, medical_data
+                    )
+                ]
+            )
+
+
+class PatientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     address = AddressSerializer()
     medical_data = MedicalDataSerializer()
+    expandable_fields = {"doctor": (DoctorSummarySerializer, {})}
 
     class Meta:
         model = Patient
@@ -202,11 +327,13 @@ class PatientSerializer(serializers.ModelSerializer):
         ]
 
         read_only_fields = ["id"]
+        list_serializer_class = PatientListSerializer
 
-        def create(self, validated_data):
-            address = validated_data.pop("address")
-            medical_data = validated_data.pop("medical_data")
+    def create(self, validated_data):
+        address = validated_data.pop("address")
+        medical_data = validated_data.pop("medical_data")
 
+        with transaction.atomic():
             address = Address.objects.create(**address)
             medical_data = MedicalData.objects.create(**medical_data)
 
@@ -216,30 +343,30 @@ class PatientSerializer(serializers.ModelSerializer):
                 **validated_data,
             )
 
-            return patient
+        return patient
 
-        def update(self, instance, validated_data):
-            address = validated_data.pop("address", None)
-            medical_data = validated_data.pop("medical_data", None)
+    def update(self, instance, validated_data):
+        address = validated_data.pop("address", None)
+        medical_data = validated_data.pop("medical_data", None)
 
-            if address:
-                serializer = AddressSerializer(
-                    instance.address, data=address, partial=True
-                )
-                if serializer.is_valid():
-                    serializer.save()
+        if address:
+            serializer = AddressSerializer(
+                instance.address, data=address, partial=True
+            )
+            if serializer.is_valid():
+                serializer.save()
 
-            if medical_data:
-                serializer = MedicalDataSerializer(
-                    instance.medical_data, data=medical_data, partial=True
-                )
-                if serializer.is_valid():
-                    serializer.save()
+        if medical_data:
+            serializer = MedicalDataSerializer(
+                instance.medical_data, data=medical_data, partial=True
+            )
+            if serializer.is_valid():
+                serializer.save()
 
-            return super().update(instance, validated_data)  # type: ignore
+        return super().update(instance, validated_data)  # type: ignore
 
-        def validate_date_of_birth(self, value):
-            if value > timezone.now().date():  # type: ignore
-                raise serializers.ValidationError("date of birth cannot be in future")
+    def validate_date_of_birth(self, value):
+        if value > timezone.now().date():  # type: ignore
+            raise serializers.ValidationError("date of birth cannot be in future")
 
-            return value
+        return value
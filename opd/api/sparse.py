@@ -0,0 +1,181 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+"""
+sparse fieldsets on the read endpoints: ?fields= and ?expand=.
+
+?fields=id,first_name,address.city keeps only these fields, a dotted name
+reaches into a nested serializer and "address" alone keeps all of it.
+?expand=doctor adds a relation the serializer lists in expandable_fields.
+every serializer with SparseFieldsMixin reads both from the request of its
+context, the nested ones look up their own part by their field path.
+
+the fields left also decide the sql. the list fast path (opd/api/fast.py)
+projects .values() on them already; for the paths that build instances
+narrow_queryset() turns them into select_related() and only(), so a nested
+relation that was not asked for is not joined and its columns not read.
+
+NOTE: the writes ignore both parameters, their input needs every field.
+"""
+
+SPARSE_PARAMS = ("fields", "expand")
+
+
+def sparse_requested(request):
+    return (
+        request is not None
+        and request.method in SAFE_METHODS
+        and any(request.query_params.get(param) for param in SPARSE_PARAMS)
+    )
+
+
+def parse_paths(value):
+    # NOTE: "id,address.city" -> {"id": {}, "address": {"city": {}}}
+    tree = {}
+    for path in value.split(","):
+        node = tree
+        for name in path.strip().split("."):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class SparseFieldsMixin:
+    # NOTE: name -> (serializer class, field kwargs), added only by ?expand=
+    expandable_fields = {}
+
+    def get_sparse_tree(self, param):
+        path = []
+        node = self
+        while node.parent is not None:  # type: ignore
+            # NOTE: the child of a ListSerializer is bound with an empty name
+            if node.field_name:  # type: ignore
+                path.append(node.field_name)  # type: ignore
+            node = node.parent  # type: ignore
+
+        request = self.context.get("request")  # type: ignore
+        if not sparse_requested(request):
+            return None
+        value = request.query_params.get(param)
+        if not value:
+            return None
+
+        tree = parse_paths(value)
+        for name in reversed(path):
+            tree = tree.get(name)
+            # NOTE: a relation named without subfields keeps all of them
+            if not tree:
+                return None
+        return tree
+
+    def get_fields(self):
+        fields = super().get_fields()  # type: ignore
+        expand = self.get_sparse_tree("expand") or {}
+        only = self.get_sparse_tree("fields")
+
+        unknown = set(expand) - set(self.expandable_fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {
+                    "expand": f"Unknown relations {sorted(unknown)}, "
+                    f"choose from {sorted(self.expandable_fields)}."
+                }
+            )
+        for name in expand:
+            serializer_class, kwargs = self.expandable_fields[name]
+            fields[name] = serializer_class(read_only=True, **kwargs)
+
+        if only is not None:
+            unknown = set(only) - set(fields)
+            if unknown:
+                raise serializers.ValidationError(
+                    {
+                        "fields": f"Unknown fields {sorted(unknown)}, "
+                        f"choose from {sorted(fields)}."
+                    }
+                )
+            fields = {
+                name: field
+                for name, field in fields.items()
+                if name in only or name in expand
+            }
+        return fields
+
+
+class NotNarrowable(Exception):
+    pass
+
+
+def is_column(model, lookup):
+    for name in lookup.split("__"):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        if field.many_to_many or field.one_to_many:
+            return False
+        model = field.related_model
+    return True
+
+
+def serializer_lookups(model, serializer, prefix=""):
+    columns, relations = [], []
+    for field in serializer._readable_fields:
+        # NOTE: these read the instance itself, the pk is always loaded
+        if isinstance(field, serializers.SerializerMethodField) or field.source == "*":
+            continue
+
+        lookup = prefix + "__".join(field.source_attrs)
+        if not is_column(model, lookup):
+            raise NotNarrowable(lookup)
+        columns.append(lookup)
+        # NOTE: a dotted source goes through a relation, it has to be joined
+        if len(field.source_attrs) > 1:
+            relations.append(lookup.rsplit("__", 1)[0])
+
+        if isinstance(field, serializers.BaseSerializer):
+            relations.append(lookup)
+            nested_columns, nested_relations = serializer_lookups(
+                model, field, prefix=lookup + "__"
+            )
+            columns.extend(nested_columns)
+            relations.extend(nested_relations)
+    return columns, relations
+
+
+def narrow_queryset(queryset, serializer, extra=()):
+    """
+    select_related() and only() on what the serializer reads, plus the extra
+    columns the caller needs (ordering, timestamps ...). a serializer whose
+    sources are not all columns leaves the queryset as it is.
+    """
+    try:
+        columns, relations = serializer_lookups(queryset.model, serializer)
+    except NotNarrowable:
+        return queryset
+
+    queryset = queryset.select_related(None)
+    if relations:
+        queryset = queryset.select_related(*dict.fromkeys(relations))
+    extra = [field.lstrip("-") for field in extra if field]
+    return queryset.only(*dict.fromkeys(columns + extra))
+
+
+class SparseQuerysetMixin:
+    def get_sparse_extra(self):
+        # NOTE: the columns the view reads besides the serializer
+        extra = [getattr(self, "last_modified_field", None)]
+        paginator = self.paginator  # type: ignore
+        if paginator is not None and hasattr(paginator, "get_requested_ordering"):
+            extra.extend(paginator.get_requested_ordering(self.request))  # type: ignore
+        return extra
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)  # type: ignore
+        if not sparse_requested(self.request):  # type: ignore
+            return queryset
+        return narrow_queryset(
+            queryset, self.get_serializer(), self.get_sparse_extra()  # type: ignore
+        )
@@ -0,0 +1,158 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions, status
+from rest_framework.authtoken.models import Token
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from opd.api import async_views
+from opd.api.authentication import (
+    DoctorTokenAuthentication,
+    issue_token,
+    token_queryset,
+)
+from opd.api.permissions import CustomPermission
+from opd.broker import OCCUPANCY_FIELDS, broker, occupancy_snapshot, opd_channel
+from opd.models import Opd
+
+
+"""
+server-sent events for the front desk screens: instead of polling
+doctor/opd/ every few seconds a screen keeps one connection open and receives
+
+    event: snapshot   the occupancy when the stream starts, after a resync and
+                      every time the counters or the opd settings change
+
+the browser EventSource can not send an Authorization header, and a token in
+the url would end up in the access logs. the screen first POSTs to
+doctor/opd/stream/ticket/ with its token and opens the stream with the
+returned ?ticket=, a signed doctor id bound to that token. the EventSource
+reconnects with the same url, so the ticket lives as long as a working day
+(OPD_STREAM_TICKET_MAX_AGE seconds, "expires_in" of the answer) and stops
+working as soon as its token is deleted by a logout. once the stream answers
+401 the EventSource gives up (readyState CLOSED): the screen POSTs for a new
+ticket and opens a new EventSource. the other clients can send their token
+in the header.
+
+like the views of async_views.py the stream needs the ASGI application
+(sih_api/asgi.py). WSGI would buffer the endless stream in a worker thread
+forever, so a WSGI request is refused with a 503.
+"""
+
+HEARTBEAT_SECONDS = getattr(settings, "OPD_STREAM_HEARTBEAT", 15)
+TICKET_MAX_AGE = getattr(settings, "OPD_STREAM_TICKET_MAX_AGE", 12 * 60 * 60)
+TICKET_SALT = "opd.api.streams.ticket"
+
+
+def event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def token_digest(key):
+    # NOTE: ties the ticket to the token without putting the key in the url
+    return salted_hmac(TICKET_SALT, key).hexdigest()[:16]
+
+
+def issue_ticket(token):
+    value = f"{token.user_id}:{token_digest(token.key)}"
+    return signing.TimestampSigner(salt=TICKET_SALT).sign(value)
+
+
+async def ticket_doctor(ticket):
+    try:
+        value = signing.TimestampSigner(salt=TICKET_SALT).unsign(
+            ticket, max_age=TICKET_MAX_AGE
+        )
+        user_id, digest = value.split(":")
+        token = await token_queryset().aget(user_id=user_id)
+    except (signing.BadSignature, ValueError, Token.DoesNotExist):
+        raise exceptions.AuthenticationFailed("Invalid or expired ticket.")
+    if not constant_time_compare(digest, token_digest(token.key)):
+        # NOTE: the token of the ticket was deleted, this is a newer one
+        raise exceptions.AuthenticationFailed("Invalid or expired ticket.")
+
+    user, _ = DoctorTokenAuthentication().token_credentials(token)
+    return async_views.doctor_of(user)
+
+
+async def stream_doctor(request):
+    ticket = request.GET.get("ticket")
+    if ticket:
+        return await ticket_doctor(ticket)
+    return await async_views.authenticate_doctor(async_views.get_token_key(request))
+
+
+@sync_to_async
+def occupancy(doctor_id):
+    opds = Opd.objects.filter(doctor_profile_id=doctor_id)
+    return opds.values(*OCCUPANCY_FIELDS).get()
+
+
+async def occupancy_events(doctor_id, snapshot):
+    subscription = broker.subscribe(opd_channel(doctor_id))
+    try:
+        yield event("snapshot", snapshot)
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    subscription.queue.get(), HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # NOTE: a comment line keeps the proxies from closing the connection
+                yield ": heartbeat\n\n"
+                continue
+
+            if subscription.overflowed:
+                subscription.overflowed = False
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                yield event("snapshot", await occupancy(doctor_id))
+                continue
+
+            yield event(message.pop("type", "snapshot"), message)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@api_view(["POST"])
+@permission_classes([CustomPermission])
+def opd_stream_ticket(request):
+    token = request.auth
+    if not isinstance(token, Token):
+        # NOTE: a session of the browsable api, the ticket follows the user token
+        token = Token.objects.get(key=issue_token(request.user))
+    return Response(
+        {"ticket": issue_ticket(token), "expires_in": TICKET_MAX_AGE},
+        status=status.HTTP_200_OK,
+    )
+
+
+@require_GET
+async def opd_stream(request):
+    if not isinstance(request, ASGIRequest):
+        return async_views.json_response(
+            {"detail": "the opd stream is only served by the ASGI application"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+    try:
+        doctor = await stream_doctor(request)
+    except exceptions.APIException as e:
+        return async_views.error_response(e)
+
+    snapshot = occupancy_snapshot(doctor.opd)
+    response = StreamingHttpResponse(
+        occupancy_events(doctor.pk, snapshot), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,112 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import throttling
+
+from opd.cache import LRUCache
+
+
+"""
+token buckets for login/ and register/, kept in the memory of the process.
+
+every client IP and every username has a bucket per scope that holds up to
+N tokens and refills at N per period ("10/minute"). a request takes one
+token from each of its buckets, or none when one of them is empty and the
+answer is 429 with Retry-After. a burst of retries therefore never reaches
+the PBKDF2 of authenticate().
+
+NOTE: each worker process has its own buckets, the effective limit is the
+configured one times the number of workers.
+"""
+
+AUTH_THROTTLE = getattr(settings, "AUTH_THROTTLE", {})
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    # NOTE: "10/minute" -> (10 tokens, 10 / 60 tokens a second)
+    count, period = rate.split("/")
+    capacity = int(count)
+    if capacity < 1:
+        # NOTE: an empty bucket never refills, take() would divide by 0
+        raise ImproperlyConfigured(f"AUTH_THROTTLE rate {rate!r} holds no token")
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class TokenBuckets:
+    def __init__(self, max_size):
+        # NOTE: key -> (tokens, time of the last update), the idle keys are evicted
+        self.buckets = LRUCache(max_size=max_size)
+        self.lock = threading.Lock()
+
+    def take(self, limits):
+        """
+        limits: [(key, capacity, refill per second)]. takes one token from
+        every bucket and returns 0, or returns the seconds until all of them
+        have one again.
+        """
+        now = time.monotonic()
+        with self.lock:
+            levels = []
+            for key, capacity, refill in limits:
+                tokens, updated = self.buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * refill))
+
+            wait = max(
+                (1 - tokens) / refill
+                for tokens, (_, _, refill) in zip(levels, limits)
+            )
+            taken = 1 if wait <= 0 else 0
+            for tokens, (key, _, _) in zip(levels, limits):
+                self.buckets.set(key, (tokens - taken, now))
+            return max(wait, 0.0)
+
+    def clear(self):
+        self.buckets.clear()
+
+
+buckets = TokenBuckets(AUTH_THROTTLE.get("MAX_KEYS", 100000))
+
+
+class AuthRateThrottle(throttling.BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        rates = AUTH_THROTTLE.get(self.scope, {})
+        self.limits = {name: parse_rate(rate) for name, rate in rates.items()}
+        self.wait_seconds = None
+
+    def get_idents(self, request):
+        # NOTE: REMOTE_ADDR, or the X-Forwarded-For entry of the last of the
+        # REST_FRAMEWORK["NUM_PROXIES"] proxies
+        idents = {"ip": self.get_ident(request)}
+        data = request.data
+        username = data.get("username") if hasattr(data, "get") else None
+        if isinstance(username, str) and username:
+            # NOTE: "Doctor" and "doctor" share the bucket
+            idents["username"] = username.lower()
+        return idents
+
+    def allow_request(self, request, view):
+        limits = [
+            (f"{self.scope}:{name}:{ident}", *self.limits[name])
+            for name, ident in self.get_idents(request).items()
+            if name in self.limits
+        ]
+        if not limits:
+            return True
+        self.wait_seconds = buckets.take(limits)
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginRateThrottle(AuthRateThrottle):
+    scope = "login"
+
+
+class RegisterRateThrottle(AuthRateThrottle):
+    scope = "register"
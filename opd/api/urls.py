@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, streams, views
 
 
 app_name = "opd"
@@ -34,9 +34,43 @@ urlpatterns = [
     path("login/", views.doctor_login, name="login"),
     path("logout/", views.doctor_logout, name="logout"),
     path("register/", views.doctor_registration, name="register"),
+    path("metrics/", views.metrics, name="metrics"),
+    path("analytics/", views.analytics, name="analytics"),
     path("doctor/", views.DoctorDetail.as_view(), name="doctor"),
     path("doctor/opd/", views.OpdDetail.as_view(), name="opd"),
+    path("doctor/opd/stream/", streams.opd_stream, name="opd-stream"),
+    path(
+        "doctor/opd/stream/ticket/",
+        streams.opd_stream_ticket,
+        name="opd-stream-ticket",
+    ),
 ]
 
 
 urlpatterns += router.urls
+
+# NOTE: async read paths, serve them with the ASGI application
+urlpatterns += [
+    path("async/doctor/", async_views.doctor_detail, name="async-doctor"),
+    path("async/doctor/opd/", async_views.opd_detail, name="async-opd"),
+    path(
+        "async/doctor/appointment/",
+        async_views.appointment_list,
+        name="async-appointment-list",
+    ),
+    path(
+        "async/doctor/appointment/<int:pk>/",
+        async_views.appointment_detail,
+        name="async-appointment-detail",
+    ),
+    path(
+        "async/doctor/patient/",
+        async_views.patient_list,
+        name="async-patient-list",
+    ),
+    path(
+        "async/doctor/patient/<int:pk>/",
+        async_views.patient_detail,
+        name="async-patient-detail",
+    ),
+]
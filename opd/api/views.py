@@ -1,15 +1,40 @@
+from datetime import timedelta
+
 from django.contrib.auth import authenticate
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.http.response import Http404
 from rest_framework import serializers
 from rest_framework import generics
 from rest_framework import viewsets
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    action,
+    api_view,
+    permission_classes,
+    throttle_classes,
+)
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated
-
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+
+from opd.api.authentication import issue_token
+from opd.api.conditional import ConditionalGetMixin
+from opd.api.export import ExportMixin
+from opd.api.fast import FastListMixin
+from opd.api.response_cache import (
+    CachedResponseMixin,
+    reset_response_cache_stats,
+    response_cache_stats,
+)
+from opd.api.pagination import (
+    AppointmentPagination,
+    KeysetPagination,
+    PatientPagination,
+)
+from opd.api.sparse import SparseQuerysetMixin
+from opd.api.throttling import LoginRateThrottle, RegisterRateThrottle
 from opd.api.permissions import CustomPermission
 
 
@@ -67,17 +92,41 @@ from opd.api.permissions import CustomPermission
 
 from .serializers import (
     AppointmentSerializer,
+    BookingSerializer,
     DoctorSerializer,
     DoctorDetailSerializer,
     InventoryItemSerializer,
     OpdSerializer,
     PatientSerializer,
     RegistrationSerializer,
+    StockBatchSerializer,
+    StockMovementSerializer,
+)
+from opd.counters import write_lock
+from opd.metrics import request_metrics
+from opd.rollups import PERIODS, rollup_summary
+from opd.models import (
+    Appointment,
+    Doctor,
+    Inventory,
+    InventoryItem,
+    Opd,
+    Patient,
+    StockMovement,
+)
+from opd.scheduling import SlotUnavailable, book_appointment, next_free_slots
+from opd.search import search_patient_ids
+from opd.stock import (
+    InsufficientStock,
+    UnknownItems,
+    move_stock,
+    record_adjustment,
+    stored_quantity,
 )
-from opd.models import Appointment, Doctor, Inventory, InventoryItem, Opd, Patient
 
 
 @api_view(["POST"])
+@throttle_classes([LoginRateThrottle])
 def doctor_login(request):
     if request.method == "POST":
         username = request.data.get("username")
@@ -86,8 +135,8 @@ def doctor_login(request):
         user = authenticate(request, username=username, password=password)
 
         if user is not None:
-            token, created = Token.objects.get_or_create(user=user)
-            return Response({"token": token.key}, status=status.HTTP_200_OK)
+            # NOTE: the existing token is returned as it is, no write
+            return Response({"token": issue_token(user)}, status=status.HTTP_200_OK)
         return Response({"error": "Invalid credential"}, status.HTTP_401_UNAUTHORIZED)
 
 
@@ -103,6 +152,7 @@ def doctor_logout(request):
 
 
 @api_view(["POST"])
+@throttle_classes([RegisterRateThrottle])
 def doctor_registration(request):
     data = {}
     if request.method == "POST":
@@ -115,10 +165,75 @@ def doctor_registration(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class DoctorDetail(generics.RetrieveUpdateDestroyAPIView):
+@api_view(["GET", "DELETE"])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """
+    the request histograms of this process (see opd/metrics.py) and the hits
+    and misses of the response cache. DELETE starts them over.
+    """
+    if request.method == "DELETE":
+        request_metrics.reset()
+        reset_response_cache_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    return Response(
+        {
+            "requests": request_metrics.snapshot(),
+            "response_cache": response_cache_stats(),
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+def parse_day(request, name, default):
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    day = parse_date(value)
+    if day is None:
+        raise serializers.ValidationError({name: "Enter a date (YYYY-MM-DD)."})
+    return day
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def analytics(request):
+    """
+    appointment counts, active vs inactive and new patients per doctor and
+    per day or week (?period=), from the daily rollups of opd/rollups.py.
+    ?since= and ?until= are included, the last 30 days by default, and
+    ?doctor= (repeatable) picks the doctors.
+    """
+    period = request.query_params.get("period", "day")
+    if period not in PERIODS:
+        raise serializers.ValidationError({"period": f"Choose one of {list(PERIODS)}."})
+
+    until = parse_day(request, "until", timezone.localdate())
+    since = parse_day(request, "since", until - timedelta(days=29))
+    try:
+        doctor_ids = [int(pk) for pk in request.query_params.getlist("doctor")]
+    except ValueError:
+        raise serializers.ValidationError({"doctor": "Enter doctor ids."})
+
+    return Response(
+        {
+            "period": period,
+            "since": since,
+            "until": until,
+            "results": rollup_summary(since, until, period, doctor_ids or None),
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+class DoctorDetail(
+    CachedResponseMixin, ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView
+):
     queryset = Doctor.objects.all()
     serializer_class = DoctorDetailSerializer
     permission_classes = [CustomPermission]
+    cache_resource = "doctor"
 
     """ 
         get_object() method return the single object for the retrieveupdatedelete class
@@ -134,17 +249,19 @@ class DoctorDetail(generics.RetrieveUpdateDestroyAPIView):
     """
 
     def get_object(self):
-        return Doctor.objects.get(user=self.request.user)
+        return self.request.doctor
 
 
-class OpdDetail(generics.RetrieveUpdateDestroyAPIView):
+class OpdDetail(
+    CachedResponseMixin, ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView
+):
     queryset = Opd.objects.all()
     serializer_class = OpdSerializer
     permission_classes = [CustomPermission]
+    cache_resource = "opd"
 
     def get_object(self):
-        doctor = Doctor.objects.get(user=self.request.user)
-        return Opd.objects.get(doctor_profile=doctor)
+        return self.request.doctor.opd
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -168,10 +285,25 @@ class OpdDetail(generics.RetrieveUpdateDestroyAPIView):
 #         opd = Opd.objects.get(doctor_profile=doctor)
 #         inventory = Inventory.objects.get(opd=opd)
 #         serializer.save(inventory=inventory)
-class InventoryItemViewSet(viewsets.ModelViewSet):
+class InventoryItemViewSet(
+    ConditionalGetMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Inventory.objects.all()
     serializer_class = InventoryItemSerializer
     permission_classes = [CustomPermission]
+    export_name = "inventory"
+    export_date_field = "last_updated"
+    export_fields = [
+        "id",
+        "item_name",
+        "item_quantity",
+        "item_price",
+        "last_updated",
+    ]
 
     """
     first we have to overwrite the queryset method.
@@ -180,8 +312,8 @@ class InventoryItemViewSet(viewsets.ModelViewSet):
     """
 
     def get_inventory(self):
-        doctor = Doctor.objects.get(user=self.request.user)
-        return Inventory.objects.get(doctor=doctor)
+        # NOTE: doctor, opd and inventory are loaded once by the authentication class
+        return self.request.doctor.inventory
 
     def get_queryset(self):  # type: ignore
         inventory = self.get_inventory()
@@ -189,43 +321,259 @@ class InventoryItemViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         inventory = self.get_inventory()
-        serializer.save(inventory=inventory)
+        with transaction.atomic():
+            item = serializer.save(inventory=inventory)
+            record_adjustment(item, 0, self.request.user)
+
+    def perform_update(self, serializer):
+        # NOTE: a PUT overwrites the quantity, consume/ and restock/ do not race.
+        # the delta is taken against the quantity stored when the PUT is applied
+        with write_lock, transaction.atomic():
+            previous = stored_quantity(serializer.instance.pk)
+            item = serializer.save()
+            record_adjustment(item, previous, self.request.user)
+
+    def get_inventory_summary(self):
+        if not hasattr(self, "_inventory_summary"):
+            self._inventory_summary = self.get_inventory().get_summary()
+        return self._inventory_summary
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["inventory"] = self.get_inventory()
+        # NOTE: passed as a callable so it is evaluated after a create/update is saved
+        context["inventory_summary"] = self.get_inventory_summary
         return context
 
+    @action(detail=False, methods=["get"])
+    def summary(self, request):
+        return Response(self.get_inventory_summary(), status=status.HTTP_200_OK)
+
+    """
+    consume/ and restock/ take {"movements": [{"item": 7, "quantity": 3}, ...]}
+    and apply all of them or none of them (opd/stock.py). movements/ of an
+    item is its ledger, newest first.
+    """
+
+    def apply_movements(self, request, kind):
+        inventory = self.get_inventory()
+        serializer = StockBatchSerializer(
+            data=request.data, context={"inventory": inventory}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            movements = move_stock(
+                inventory,
+                serializer.validated_data["movements"],  # type: ignore
+                kind,
+                request.user,
+            )
+        except InsufficientStock as e:
+            return Response(
+                {"error": str(e), "shortages": e.shortages},
+                status=status.HTTP_409_CONFLICT,
+            )
+        except UnknownItems as e:
+            # NOTE: deleted after the validation of the batch
+            return Response(
+                {"error": str(e), "items": e.items}, status=status.HTTP_404_NOT_FOUND
+            )
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+        data = StockMovementSerializer(movements, many=True).data
+        return Response({"movements": data}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"])
+    def consume(self, request):
+        return self.apply_movements(request, StockMovement.CONSUME)
+
+    @action(detail=False, methods=["post"])
+    def restock(self, request):
+        return self.apply_movements(request, StockMovement.RESTOCK)
+
+    @action(detail=True, methods=["get"])
+    def movements(self, request, pk=None):
+        item = self.get_object()
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(item.movements.all(), request, view=self)
+        serializer = StockMovementSerializer(
+            page, many=True, context={"request": request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+
+class AppointmentViewSet(
+    ConditionalGetMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     permission_classes = [CustomPermission]
+    pagination_class = AppointmentPagination
+    export_name = "appointments"
+    export_date_field = "date_time"
+    export_fields = ["id", "name", "active", "date_time", "last_updated"]
 
     def get_doctor(self):
-        return Doctor.objects.get(user=self.request.user)
+        return self.request.doctor
 
     def get_queryset(self):  # type: ignore
         doctor = self.get_doctor()
-        return Appointment.objects.filter(doctor=doctor)
+        queryset = Appointment.objects.filter(doctor=doctor)
+
+        active = self.request.query_params.get("active")
+        if active is not None:
+            queryset = queryset.filter(active=active.lower() in ("1", "true"))
+        return queryset
 
     def perform_create(self, serializer):
         doctor = self.get_doctor()
         serializer.save(doctor=doctor)
 
+    """
+    slot booking: slots/ lists the next free slots of the opd from the
+    in-memory availability index, book/ books one of them.
+    """
+
+    max_slots = 100
+
+    @action(detail=False, methods=["get"])
+    def slots(self, request):
+        try:
+            count = min(int(request.query_params.get("count", 10)), self.max_slots)
+        except ValueError:
+            count = 10
+
+        opd = self.get_doctor().opd
+        duration = timedelta(minutes=opd.slot_duration)
+        slots = [
+            {"start": start, "end": start + duration, "available": available}
+            for start, available in next_free_slots(opd, max(count, 1))
+        ]
+        return Response(slots, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"])
+    def book(self, request):
+        serializer = BookingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            appointment = book_appointment(
+                self.get_doctor().opd,
+                serializer.validated_data["name"],  # type: ignore
+                serializer.validated_data["slot"],  # type: ignore
+            )
+        except SlotUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
 
-class PatientViewSet(viewsets.ModelViewSet):
+        return Response(
+            self.get_serializer(appointment).data, status=status.HTTP_201_CREATED
+        )
+
+
+class PatientViewSet(
+    ConditionalGetMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Patient.objects.all()
-    serializer_class = PatientSerializer()
+    serializer_class = PatientSerializer
     permission_classes = [CustomPermission]
+    pagination_class = PatientPagination
+    last_modified_field = "updated_at"
+    export_name = "patients"
+    export_date_field = "created_at"
+    export_fields = [
+        "id",
+        "first_name",
+        "last_name",
+        "date_of_birth",
+        "gender",
+        "contact",
+        "email",
+        "created_at",
+        "updated_at",
+        "address__house_number",
+        "address__street_name",
+        "address__city",
+        "address__state",
+        "address__pincode",
+        "medical_data__blood_group",
+        "medical_data__height",
+        "medical_data__weight",
+        "medical_data__medical_history",
+    ]
 
     def get_doctor(self):
-        return Doctor.objects.get(user=self.request.user)
+        return self.request.doctor
 
     def get_queryset(self):  # type: ignore
+        # NOTE: address and medical_data are nested in the serializer, join them here
         doctor = self.get_doctor()
-        return Patient.objects.filter(doctor=doctor)
+        return Patient.objects.filter(doctor=doctor).select_related(
+            "address", "medical_data"
+        )
 
     def perform_create(self, serializer):
         doctor = self.get_doctor()
         serializer.save(doctor=doctor)
+
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        query = request.query_params.get("q", "")
+        limit = self.paginator.get_page_size(request)  # type: ignore
+
+        ids = search_patient_ids(self.get_doctor().pk, query, limit)
+        patients = self.get_queryset().in_bulk(ids)
+        # NOTE: in_bulk loses the rank order of the ids
+        results = [patients[pk] for pk in ids if pk in patients]
+
+        serializer = self.get_serializer(results, many=True)
+        return Response({"results": serializer.data}, status=status.HTTP_200_OK)
+
+    """
+    bulk intake for camp days: POST a list of patient payloads.
+    every row is validated on its own, the valid ones are inserted together
+    and the invalid ones come back with their index and errors.
+    """
+
+    bulk_max_size = 1000
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        if not isinstance(request.data, list):
+            return Response(
+                {"error": "expected a list of patients"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(request.data) > self.bulk_max_size:
+            return Response(
+                {"error": f"at most {self.bulk_max_size} patients per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        doctor = self.get_doctor()
+        valid, errors = [], []
+        for index, payload in enumerate(request.data):
+            serializer = self.get_serializer(data=payload)
+            if serializer.is_valid():
+                valid.append({**serializer.validated_data, "doctor": doctor})
+            else:
+                errors.append({"index": index, "errors": serializer.errors})
+
+        created = []
+        if valid:
+            created = self.get_serializer(many=True).create(valid)
+
+        return Response(
+            {
+                "created": self.get_serializer(created, many=True).data,
+                "errors": errors,
+            },
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
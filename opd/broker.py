@@ -0,0 +1,84 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+"""
+publish/subscribe of small json messages between the code that changes the
+data (signals, counters) and the long lived streaming connections.
+
+LocalBroker only reaches the subscribers of its own process: it is the local
+stand-in for a cross-worker broker (redis pub/sub, postgres LISTEN/NOTIFY)
+that would implement the same three methods. the class is picked with the
+OPD_BROKER setting.
+"""
+
+
+class Subscription:
+    def __init__(self, channel, max_size):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+        # NOTE: set when messages were dropped, the reader must resync
+        self.overflowed = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class LocalBroker:
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        # NOTE: must be called from the event loop that reads the subscription
+        subscription = Subscription(channel, self.max_queue_size)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        # NOTE: safe from any thread, the delivery runs on the loop of the subscriber
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # the loop of the subscriber is closed
+                self.unsubscribe(subscription)
+        return len(subscriptions)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscriptions.get(channel, ()))
+
+
+broker = import_string(getattr(settings, "OPD_BROKER", "opd.broker.LocalBroker"))()
+
+
+def opd_channel(doctor_id):
+    return f"opd:{doctor_id}"
+
+
+OCCUPANCY_FIELDS = ["active_patient", "no_of_appointment", "max_patient_capacity"]
+
+
+def occupancy_snapshot(opd):
+    return {field: getattr(opd, field) for field in OCCUPANCY_FIELDS}
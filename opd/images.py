@@ -0,0 +1,142 @@
+import logging
+import posixpath
+import queue
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from opd.models import Doctor
+
+
+"""
+the variants of the profile images: square thumbnails and a WebP copy of the
+original, made with Pillow outside of the request.
+
+DoctorDetail PUT only stores the upload (opd/storage.py). the post_save
+signal queues the doctor once the transaction commits, and a worker thread of
+the process writes the variants next to the content hashed original
+("profile/ab/<hash>/thumbnail_64.webp") and records them in
+Doctor.image_variants. a variant that already exists (the same image of
+another doctor) is not made again.
+
+the queue lives in memory: the process_profile_images command catches up on
+the doctors whose variants were lost with a restart. IMAGE_VARIANTS["EAGER"]
+makes the variants on commit inside the caller, for the tests.
+"""
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANTS = getattr(settings, "IMAGE_VARIANTS", {})
+# NOTE: variant name -> (width, height) of the square crop, None keeps the size
+SIZES = IMAGE_VARIANTS.get(
+    "SIZES",
+    {
+        "thumbnail_64": (64, 64),
+        "thumbnail_256": (256, 256),
+        "webp": None,
+    },
+)
+# NOTE: the full size webp is bounded, an avatar never needs more
+MAX_SIZE = IMAGE_VARIANTS.get("MAX_SIZE", (1024, 1024))
+QUALITY = IMAGE_VARIANTS.get("QUALITY", 80)
+EAGER = IMAGE_VARIANTS.get("EAGER", False)
+
+
+def variant_name(source, variant):
+    return posixpath.join(posixpath.splitext(source)[0], f"{variant}.webp")
+
+
+def render_variant(image, size):
+    if size is None:
+        image = image.copy()
+        image.thumbnail(MAX_SIZE)
+    else:
+        image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+
+    output = BytesIO()
+    image.save(output, "WEBP", quality=QUALITY, method=4)
+    return ContentFile(output.getvalue())
+
+
+def make_variants(storage, source):
+    names = {variant: variant_name(source, variant) for variant in SIZES}
+    missing = [
+        variant for variant, name in names.items() if not storage.exists(name)
+    ]
+    if missing:
+        with storage.open(source) as file, Image.open(file) as image:
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            for variant in missing:
+                variant_file = render_variant(image, SIZES[variant])
+                storage.save_as(names[variant], variant_file)
+    return names
+
+
+def process_doctor_image(doctor_id):
+    doctor = Doctor.objects.filter(pk=doctor_id).first()
+    if doctor is None or not doctor.profile_image:
+        return
+
+    source = doctor.profile_image.name
+    if doctor.image_variants.get("source") == source:
+        return
+
+    storage = doctor.profile_image.storage
+    if not storage.exists(source):
+        logger.warning("profile image %s of doctor %s is missing", source, doctor_id)
+        return
+
+    variants = make_variants(storage, source)
+
+    with transaction.atomic():
+        doctor = Doctor.objects.select_for_update().get(pk=doctor_id)
+        # NOTE: a newer upload has its own job queued
+        if doctor.profile_image.name == source:
+            doctor.image_variants = {"source": source, **variants}
+            doctor.save(update_fields=["image_variants", "last_updated"])
+
+
+class VariantWorker:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, doctor_id):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="profile-image-variants", daemon=True
+                )
+                self.thread.start()
+        self.queue.put(doctor_id)
+
+    def run(self):
+        while True:
+            doctor_id = self.queue.get()
+            try:
+                process_doctor_image(doctor_id)
+            except Exception:
+                logger.exception("profile image variants of doctor %s", doctor_id)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def join(self):
+        self.queue.join()
+
+
+worker = VariantWorker()
+
+
+def schedule_variants(doctor_id):
+    # NOTE: on commit, the worker must see the new profile_image
+    if EAGER:
+        transaction.on_commit(lambda: process_doctor_image(doctor_id))
+    else:
+        transaction.on_commit(lambda: worker.submit(doctor_id))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from opd.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily appointment and patient rollups from the "
+        "appointment and patient tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--doctor",
+            type=int,
+            action="append",
+            dest="doctors",
+            help="Only this doctor id, can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        days = rebuild_rollups(options["doctors"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {days} doctor day(s)"))
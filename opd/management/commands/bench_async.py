@@ -0,0 +1,225 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from rest_framework.authtoken.models import Token
+
+from opd.bench import benchmark_database, format_table, percentile
+from opd.models import Address, Appointment, MedicalData, Patient
+from opd.onboarding import onboard_doctor
+
+
+"""
+concurrent-connection throughput of the read endpoints through the threaded
+WSGI application (sih_api/wsgi.py, the DRF views) and through the ASGI
+application (sih_api/asgi.py, the views of opd/api/async_views.py).
+
+both applications are called in process, without a server in front. every
+client sends its requests back to back; the WSGI side only runs --threads
+requests at the same time like a threaded worker, the ASGI side runs all the
+clients on one event loop.
+
+sqlite answers in microseconds, --latency adds a sleep to every query to
+emulate the round trip to a database server.
+"""
+
+PATHS = ["doctor/", "doctor/opd/", "doctor/appointment/", "doctor/patient/"]
+
+
+def seed(rows):
+    user = onboard_doctor("benchmark", "", None)
+    doctor = user.doctor
+    addresses = Address.objects.bulk_create(Address() for _ in range(rows))
+    medical_data = MedicalData.objects.bulk_create(MedicalData() for _ in range(rows))
+    Patient.objects.bulk_create(
+        Patient(
+            doctor=doctor,
+            first_name=f"first{index}",
+            last_name=f"last{index}",
+            email=f"patient{index}@example.com",
+            date_of_birth="1990-01-01",
+            address=address,
+            medical_data=data,
+        )
+        for index, (address, data) in enumerate(zip(addresses, medical_data))
+    )
+    Appointment.objects.bulk_create(
+        Appointment(doctor=doctor, name=f"appointment {index}") for index in range(rows)
+    )
+    return Token.objects.get_or_create(user=user)[0].key
+
+
+def add_latency(seconds):
+    def sleep(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        if sleep not in connection.execute_wrappers:
+            connection.execute_wrappers.append(sleep)
+
+    # NOTE: the connections are per thread, the wrapper is added to each new one
+    connection_created.connect(install, weak=False)
+
+
+class WSGIClient:
+    def __init__(self, token, threads):
+        from sih_api.wsgi import application
+
+        self.application = application
+        self.token = token
+        self.workers = threading.Semaphore(threads)
+
+    def request(self, path):
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": f"/api/{path}",
+            "QUERY_STRING": "",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "HTTP_HOST": "localhost",
+            "HTTP_AUTHORIZATION": f"Token {self.token}",
+            "wsgi.url_scheme": "http",
+            "wsgi.input": BytesIO(),
+            "wsgi.errors": BytesIO(),
+        }
+        statuses = []
+        with self.workers:
+            body = self.application(
+                environ, lambda status, headers: statuses.append(status)
+            )
+            b"".join(body)
+            body.close()
+        return int(statuses[0].split()[0])
+
+    def run(self, clients, requests):
+        def client(index):
+            latencies = []
+            for number in range(requests):
+                start = time.perf_counter()
+                status = self.request(PATHS[(index + number) % len(PATHS)])
+                latencies.append((time.perf_counter() - start, status))
+            return latencies
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            results = executor.map(client, range(clients))
+            return [latency for latencies in results for latency in latencies]
+
+
+class ASGIClient:
+    def __init__(self, token):
+        from sih_api.asgi import application
+
+        self.application = application
+        self.token = token
+
+    async def request(self, path):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": f"/api/async/{path}",
+            "raw_path": f"/api/async/{path}".encode(),
+            "query_string": b"",
+            "headers": [
+                (b"host", b"localhost"),
+                (b"authorization", f"Token {self.token}".encode()),
+            ],
+            "server": ("localhost", 80),
+        }
+        messages = []
+        requests = [{"type": "http.request", "body": b"", "more_body": False}]
+        disconnected = asyncio.Event()
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            # NOTE: like a server, the client stays connected until the response is sent
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.application(scope, receive, send)
+        return messages[0]["status"]
+
+    def run(self, clients, requests):
+        async def client(index):
+            latencies = []
+            for number in range(requests):
+                start = time.perf_counter()
+                status = await self.request(PATHS[(index + number) % len(PATHS)])
+                latencies.append((time.perf_counter() - start, status))
+            return latencies
+
+        async def main():
+            results = await asyncio.gather(*(client(index) for index in range(clients)))
+            return [latency for latencies in results for latency in latencies]
+
+        return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = "Compare the read endpoints under WSGI threads and under ASGI."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients",
+            default="1,10,50",
+            help="comma separated numbers of concurrent clients",
+        )
+        parser.add_argument("--requests", type=int, default=40, help="per client")
+        parser.add_argument("--threads", type=int, default=8, help="WSGI threads")
+        parser.add_argument("--latency", type=float, default=0.0, help="ms per query")
+        parser.add_argument("--rows", type=int, default=200)
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options["clients"].split(",")]
+        results = []
+
+        with benchmark_database():
+            token = seed(options["rows"])
+            if options["latency"]:
+                add_latency(options["latency"] / 1000)
+
+            threads = options["threads"]
+            servers = [
+                (f"wsgi ({threads} threads)", WSGIClient(token, threads)),
+                ("asgi", ASGIClient(token)),
+            ]
+            for clients in levels:
+                for name, server in servers:
+                    # NOTE: warm up, fills the token cache and the url resolver
+                    server.run(1, len(PATHS))
+
+                    start = time.perf_counter()
+                    latencies = server.run(clients, options["requests"])
+                    seconds = time.perf_counter() - start
+
+                    errors = sum(1 for _, status in latencies if status != 200)
+                    latencies = sorted(latency for latency, _ in latencies)
+                    results.append(
+                        (
+                            name,
+                            clients,
+                            len(latencies),
+                            f"{len(latencies) / seconds:.0f}",
+                            f"{percentile(latencies, 0.5) * 1000:.1f}",
+                            f"{percentile(latencies, 0.99) * 1000:.1f}",
+                            errors,
+                        )
+                    )
+
+        self.stdout.write(
+            format_table(
+                ["app", "clients", "requests", "req/s", "p50 ms", "p99 ms", "errors"],
+                results,
+            )
+        )
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from opd.bench import benchmark_database, format_table, timer
+from opd.onboarding import bulk_onboard_doctors, onboard_doctor
+
+
+class Command(BaseCommand):
+    help = "Compare doctor onboarding one by one with the bulk roster import."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=500)
+        parser.add_argument(
+            "--with-passwords",
+            action="store_true",
+            help="hash real passwords, PBKDF2 then dominates both paths",
+        )
+
+    def handle(self, *args, **options):
+        count = options["doctors"]
+        password = "benchmark-password" if options["with_passwords"] else None
+        results = []
+
+        with benchmark_database():
+            with CaptureQueriesContext(connection) as queries, timer() as elapsed:
+                for index in range(count):
+                    onboard_doctor(f"single{index}", "", password)
+            results.append(("one by one", elapsed, len(queries)))
+
+            rows = [
+                {"username": f"bulk{index}", "email": "", "password": password}
+                for index in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries, timer() as elapsed:
+                bulk_onboard_doctors(rows)
+            results.append(("bulk", elapsed, len(queries)))
+
+        self.stdout.write(
+            format_table(
+                ["path", "doctors", "seconds", "doctors/s", "queries/doctor"],
+                [
+                    (
+                        name,
+                        count,
+                        f"{elapsed['seconds']:.3f}",
+                        f"{count / elapsed['seconds']:.0f}",
+                        f"{queries / count:.2f}",
+                    )
+                    for name, elapsed, queries in results
+                ],
+            )
+        )
@@ -0,0 +1,153 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from opd.api.fast import compile_serializer
+from opd.api.serializers import (
+    AppointmentSerializer,
+    InventoryItemSerializer,
+    PatientSerializer,
+)
+from opd.bench import benchmark_database, format_table, timer
+from opd.models import (
+    Address,
+    Appointment,
+    Doctor,
+    InventoryItem,
+    MedicalData,
+    Patient,
+)
+from opd.onboarding import onboard_doctor
+
+
+class Command(BaseCommand):
+    help = "Compare the DRF list serializers with the compiled fast path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        count = options["rows"]
+        results = []
+
+        with benchmark_database():
+            doctor = self.create_rows(count)
+            context = {
+                "inventory": doctor.inventory,
+                "inventory_summary": lambda: {"item_count": count},
+            }
+            cases = [
+                (
+                    "appointment",
+                    AppointmentSerializer,
+                    Appointment.objects.filter(doctor=doctor),
+                ),
+                (
+                    "inventory",
+                    InventoryItemSerializer,
+                    InventoryItem.objects.filter(inventory=doctor.inventory),
+                ),
+                (
+                    "patient",
+                    PatientSerializer,
+                    Patient.objects.filter(doctor=doctor).select_related(
+                        "address", "medical_data"
+                    ),
+                ),
+            ]
+            for name, serializer_class, queryset in cases:
+                compiled = compile_serializer(serializer_class(context=context))
+                rows = list(queryset.values(*compiled.lookups))
+                instances = list(queryset)
+
+                # NOTE: serializer only, the rows are already in memory
+                drf = self.best(
+                    lambda: serializer_class(
+                        instances, many=True, context=context
+                    ).data,
+                    options["repeat"],
+                )
+                fast = self.best(lambda: compiled.serialize(rows), options["repeat"])
+                results.append((name, "serialize", drf, fast))
+
+                # NOTE: the query, the row building and the serializer
+                drf = self.best(
+                    lambda: serializer_class(
+                        queryset.all(), many=True, context=context
+                    ).data,
+                    options["repeat"],
+                )
+                fast = self.best(
+                    lambda: compiled.serialize(queryset.values(*compiled.lookups)),
+                    options["repeat"],
+                )
+                results.append((name, "query + serialize", drf, fast))
+
+        self.stdout.write(
+            format_table(
+                ["serializer", "measure", "rows", "drf rows/s", "fast rows/s", "gain"],
+                [
+                    (
+                        name,
+                        measure,
+                        count,
+                        f"{count / drf:.0f}",
+                        f"{count / fast:.0f}",
+                        f"{drf / fast:.1f}x",
+                    )
+                    for name, measure, drf, fast in results
+                ],
+            )
+        )
+
+    def best(self, function, repeat):
+        seconds = []
+        for _ in range(repeat):
+            with timer() as elapsed:
+                function()
+            seconds.append(elapsed["seconds"])
+        return min(seconds)
+
+    def create_rows(self, count):
+        onboard_doctor("benchmark", "", None)
+        doctor = Doctor.objects.select_related("inventory").get(
+            user__username="benchmark"
+        )
+
+        Appointment.objects.bulk_create(
+            Appointment(doctor=doctor, name=f"appointment {index}")
+            for index in range(count)
+        )
+        InventoryItem.objects.bulk_create(
+            InventoryItem(
+                inventory=doctor.inventory,
+                item_name=f"item {index}",
+                item_quantity=index,
+                item_price=index * 1.5,
+            )
+            for index in range(count)
+        )
+        addresses = Address.objects.bulk_create(
+            Address(street_name="street", city="city", state="state", pincode="123456")
+            for _ in range(count)
+        )
+        medical_data = MedicalData.objects.bulk_create(
+            MedicalData(blood_group="O+", height="170", weight="70")
+            for _ in range(count)
+        )
+        Patient.objects.bulk_create(
+            Patient(
+                doctor=doctor,
+                address=address,
+                medical_data=data,
+                first_name=f"first {index}",
+                last_name=f"last {index}",
+                date_of_birth=datetime.date(1990, 1, 1),
+                gender="other",
+                contact="+919876543210",
+                email=f"patient{index}@example.com",
+            )
+            for index, (address, data) in enumerate(zip(addresses, medical_data))
+        )
+        return doctor
@@ -0,0 +1,150 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+
+from opd.bench import benchmark_database, format_table
+from opd.models import Opd
+from opd.onboarding import bulk_onboard_doctors
+
+
+"""
+read/write throughput of the sqlite file with the stock configuration and with
+the tuned one from settings.SQLITE_PRAGMAS.
+
+the workload is the shape of the api, through the django connections and the
+orm: readers select an opd by doctor (the polling endpoints) and writers bump
+its counters in a transaction (the signal handlers). stock mode opens a
+connection per request and uses deferred transactions like CONN_MAX_AGE=0
+does, tuned mode keeps one connection per thread and begins every write with
+BEGIN IMMEDIATE.
+"""
+
+ROWS = 1000
+
+# NOTE: the connection settings of each mode, the tuned ones as in settings.py
+MODES = {
+    "stock": {"CONN_MAX_AGE": 0, "OPTIONS": {}},
+    "tuned": {
+        "CONN_MAX_AGE": None,
+        "OPTIONS": {
+            "init_command": ";".join(
+                f"PRAGMA {name}={value}"
+                for name, value in settings.SQLITE_PRAGMAS.items()
+            ),
+            "transaction_mode": "IMMEDIATE",
+        },
+    },
+}
+
+
+class Workload:
+    def __init__(self, mode, doctor_ids, seconds):
+        self.persistent = MODES[mode]["CONN_MAX_AGE"] != 0
+        self.doctor_ids = doctor_ids
+        self.seconds = seconds
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def run(self, readers, writers):
+        threads = [
+            threading.Thread(target=self.worker, args=(self.read,))
+            for _ in range(readers)
+        ] + [
+            threading.Thread(target=self.worker, args=(self.write,))
+            for _ in range(writers)
+        ]
+        self.deadline = time.monotonic() + self.seconds
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def worker(self, operation):
+        done = errors = 0
+        try:
+            while time.monotonic() < self.deadline:
+                try:
+                    operation(random.choice(self.doctor_ids))
+                    done += 1
+                except OperationalError:
+                    errors += 1
+                finally:
+                    # NOTE: what the end of a request does with CONN_MAX_AGE=0
+                    if not self.persistent:
+                        connections.close_all()
+        finally:
+            connections.close_all()
+
+        with self.lock:
+            self.errors += errors
+            if operation == self.read:
+                self.reads += done
+            else:
+                self.writes += done
+
+    def read(self, doctor_id):
+        Opd.objects.filter(doctor_profile_id=doctor_id).values(
+            "id", "name", "active_patient", "no_of_appointment"
+        ).first()
+
+    def write(self, doctor_id):
+        opds = Opd.objects.filter(doctor_profile_id=doctor_id)
+        with transaction.atomic():
+            opds.values_list("id", flat=True).first()
+            opds.update(no_of_appointment=F("no_of_appointment") + 1)
+
+
+class Command(BaseCommand):
+    help = "Compare sqlite read/write throughput with and without the tuned pragmas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--rows", type=int, default=ROWS)
+
+    def handle(self, *args, **options):
+        connection = connections["default"]
+        if connection.vendor != "sqlite":
+            self.stderr.write("bench_sqlite needs the sqlite backend")
+            return
+
+        # NOTE: the threads open their connections with these settings
+        original = {name: connection.settings_dict[name] for name in MODES["stock"]}
+        rows = []
+        try:
+            for mode in MODES:
+                connection.close()
+                connection.settings_dict.update(MODES[mode])
+                with benchmark_database():
+                    bulk_onboard_doctors(
+                        {"username": f"doctor{index}"}
+                        for index in range(options["rows"])
+                    )
+                    doctor_ids = list(
+                        Opd.objects.values_list("doctor_profile_id", flat=True)
+                    )
+                    workload = Workload(mode, doctor_ids, options["seconds"])
+                    workload.run(options["readers"], options["writers"])
+                rows.append(
+                    (
+                        mode,
+                        f"{workload.reads / options['seconds']:.0f}",
+                        f"{workload.writes / options['seconds']:.0f}",
+                        workload.errors,
+                    )
+                )
+        finally:
+            connection.close()
+            connection.settings_dict.update(original)
+
+        self.stdout.write(
+            format_table(["mode", "reads/s", "writes/s", "lock errors"], rows)
+        )
@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+from django.db.models import Sum
+
+from opd.bench import benchmark_database, format_table, percentile, timer
+from opd.models import InventoryItem, StockMovement
+from opd.onboarding import onboard_doctor
+from opd.stock import InsufficientStock, move_stock
+
+
+"""
+--writers threads dispense from and restock the same few inventory items at
+once, first the way a client does it with the viewset (GET the item, PUT the
+new quantity) and then through opd.stock.move_stock.
+
+the report compares the stock the writers were told they left with the
+stock in the database: every update the read-modify-write loses shows up as
+"lost", the conditional updates must lose none and their ledger must add up
+to the final quantities.
+"""
+
+# NOTE: one in five batches is a restock
+RESTOCK_SHARE = 0.2
+
+
+class Writers:
+    def __init__(self, mode, item_ids, options):
+        self.mode = mode
+        self.item_ids = item_ids
+        self.options = options
+        self.inventory = InventoryItem.objects.get(pk=item_ids[0]).inventory
+        self.lock = threading.Lock()
+        self.deltas = Counter()
+        self.latencies = []
+        self.applied = self.refused = self.errors = 0
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.writer, args=(index,))
+            for index in range(self.options["writers"])
+        ]
+        with timer() as elapsed:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.seconds = elapsed["seconds"]
+
+    def writer(self, index):
+        rng = random.Random(index)
+        try:
+            for _ in range(self.options["operations"]):
+                restock = rng.random() < RESTOCK_SHARE
+                movements = [
+                    (rng.choice(self.item_ids), rng.randint(1, 3))
+                    for _ in range(self.options["batch"])
+                ]
+                with timer() as elapsed:
+                    outcome, deltas = self.send(movements, restock)
+                with self.lock:
+                    self.latencies.append(elapsed["seconds"])
+                    self.deltas.update(deltas)
+                    if outcome == "applied":
+                        self.applied += 1
+                    elif outcome == "refused":
+                        self.refused += 1
+                    else:
+                        self.errors += 1
+        finally:
+            connections.close_all()
+
+    def send(self, movements, restock):
+        sign = 1 if restock else -1
+        try:
+            if self.mode == "ledger":
+                kind = StockMovement.RESTOCK if restock else StockMovement.CONSUME
+                move_stock(self.inventory, movements, kind)
+                deltas = Counter()
+                for item_id, quantity in movements:
+                    deltas[item_id] += sign * quantity
+                return "applied", deltas
+            return self.read_modify_write(movements, sign)
+        except InsufficientStock:
+            return "refused", {}
+        except DatabaseError:
+            return "error", {}
+
+    def read_modify_write(self, movements, sign):
+        # NOTE: what a client of the PUT does, one item after the other
+        deltas = Counter()
+        for item_id, quantity in movements:
+            item = InventoryItem.objects.get(pk=item_id)
+            if item.item_quantity + sign * quantity < 0:
+                return "refused", deltas
+            # NOTE: the round trip between the GET and the PUT
+            time.sleep(self.options["think"])
+            item.item_quantity += sign * quantity
+            item.save(update_fields=["item_quantity", "last_updated"])
+            deltas[item_id] += sign * quantity
+        return "applied", deltas
+
+
+class Command(BaseCommand):
+    help = "Race concurrent writers on the same inventory items."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=50)
+        parser.add_argument("--operations", type=int, default=20)
+        parser.add_argument("--items", type=int, default=5)
+        parser.add_argument("--batch", type=int, default=3)
+        parser.add_argument("--stock", type=int, default=1000)
+        parser.add_argument(
+            "--think",
+            type=float,
+            default=0.001,
+            help="seconds between the GET and the PUT of the read-modify-write",
+        )
+
+    def handle(self, *args, **options):
+        rows = []
+        with benchmark_database():
+            inventory = onboard_doctor("bench", "", None).doctor.inventory
+            for mode in ("put", "ledger"):
+                items = InventoryItem.objects.bulk_create(
+                    InventoryItem(
+                        inventory=inventory,
+                        item_name=f"{mode} item {index}",
+                        item_quantity=options["stock"],
+                    )
+                    for index in range(options["items"])
+                )
+                writers = Writers(mode, [item.pk for item in items], options)
+                writers.run()
+                rows.append(self.row(writers, options))
+
+        self.stdout.write(
+            format_table(
+                [
+                    "mode",
+                    "batches",
+                    "applied",
+                    "refused",
+                    "errors",
+                    "batches/s",
+                    "p50 ms",
+                    "p99 ms",
+                    "expected",
+                    "stock",
+                    "lost",
+                    "ledger",
+                ],
+                rows,
+            )
+        )
+
+    def row(self, writers, options):
+        items = InventoryItem.objects.filter(pk__in=writers.item_ids)
+        stock = items.aggregate(total=Sum("item_quantity"))["total"]
+        expected = options["stock"] * len(writers.item_ids) + sum(
+            writers.deltas.values()
+        )
+
+        ledger = "-"
+        if writers.mode == "ledger":
+            movements = dict(
+                StockMovement.objects.filter(item__in=items)
+                .values_list("item")
+                .annotate(total=Sum("delta"))
+            )
+            ledger = "ok"
+            for item_id, quantity in items.values_list("id", "item_quantity"):
+                if options["stock"] + movements.get(item_id, 0) != quantity:
+                    ledger = "mismatch"
+
+        latencies = sorted(writers.latencies)
+        return [
+            writers.mode,
+            len(latencies),
+            writers.applied,
+            writers.refused,
+            writers.errors,
+            f"{len(latencies) / writers.seconds:.0f}",
+            f"{percentile(latencies, 0.50) * 1000:.1f}",
+            f"{percentile(latencies, 0.99) * 1000:.1f}",
+            expected,
+            stock,
+            # NOTE: the quantity the lost updates added or removed
+            abs(expected - stock),
+            ledger,
+        ]
@@ -0,0 +1,32 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from opd.onboarding import bulk_onboard_doctors
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a hospital roster. The CSV file needs a username column, "
+        "email and password are optional."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("roster", help="path of the CSV file")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["roster"], newline="") as roster:
+                rows = list(csv.DictReader(roster))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if rows and "username" not in rows[0]:
+            raise CommandError("the roster has no username column")
+
+        users, skipped = bulk_onboard_doctors(rows, batch_size=options["batch_size"])
+
+        for username in skipped:
+            self.stderr.write(f"skipped {username}: username already exists")
+        self.stdout.write(self.style.SUCCESS(f"Onboarded {len(users)} doctor(s)"))
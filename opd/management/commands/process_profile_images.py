@@ -0,0 +1,63 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from opd.images import process_doctor_image
+from opd.models import Doctor
+
+
+CONTENT_HASHED = re.compile(r"/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the missing profile image variants, e.g. after a restart dropped "
+        "the queue of the worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rehash",
+            action="store_true",
+            help="move the images uploaded before the content hashed storage",
+        )
+
+    def handle(self, *args, **options):
+        default = Doctor._meta.get_field("profile_image").get_default()
+        doctors = Doctor.objects.exclude(Q(profile_image="") | Q(profile_image=default))
+
+        if options["rehash"]:
+            self.rehash(doctors)
+
+        processed = 0
+        for doctor in doctors.iterator():
+            if doctor.image_variants.get("source") != doctor.profile_image.name:
+                process_doctor_image(doctor.pk)
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} image(s)"))
+
+    def rehash(self, doctors):
+        moved, legacy = 0, set()
+        for doctor in doctors.iterator():
+            image = doctor.profile_image
+            if CONTENT_HASHED.search(image.name):
+                continue
+            if not image.storage.exists(image.name):
+                continue
+
+            legacy.add(image.name)
+            with image.open("rb") as file:
+                name = image.storage.save(image.name, file)
+            # NOTE: the variants are made below, they save the doctor again
+            Doctor.objects.filter(pk=doctor.pk).update(profile_image=name)
+            moved += 1
+
+        # NOTE: the duplicates (john.jpg, john_9S43r4T.jpg ...) now share one file
+        storage = Doctor._meta.get_field("profile_image").storage
+        removed = 0
+        for name in legacy:
+            if not Doctor.objects.filter(profile_image=name).exists():
+                storage.delete(name)
+                removed += 1
+        self.stdout.write(f"Moved {moved} image(s), removed {removed} file(s)")
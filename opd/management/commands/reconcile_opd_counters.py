@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from opd.api.response_cache import invalidate_responses
+from opd.models import Appointment, Opd, Patient
+
+
+def count_for_opd(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(doctor=OuterRef("doctor_profile"))
+            .order_by()
+            .values("doctor")
+            .annotate(count=Count("id"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Opd.no_of_appointment and Opd.active_patient from the "
+        "appointment and patient tables in a single aggregate pass."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many OPDs have drifted counters.",
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            "no_of_appointment": count_for_opd(Appointment),
+            "active_patient": count_for_opd(Patient),
+        }
+
+        # NOTE: only the drifted rows are written, in one UPDATE statement
+        drifted = Opd.objects.alias(
+            expected_appointment=expected["no_of_appointment"],
+            expected_patient=expected["active_patient"],
+        ).filter(
+            ~Q(no_of_appointment=F("expected_appointment"))
+            | ~Q(active_patient=F("expected_patient"))
+        )
+
+        if options["dry_run"]:
+            self.stdout.write(f"{drifted.count()} OPD(s) have drifted counters")
+            return
+
+        doctor_ids = list(drifted.values_list("doctor_profile_id", flat=True))
+        updated = drifted.update(last_updated=timezone.now(), **expected)
+        for doctor_id in doctor_ids:
+            invalidate_responses(doctor_id, "opd")
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {updated} OPD(s)"))
@@ -0,0 +1,218 @@
+import datetime
+import json
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import Resolver404
+
+from opd.bench import benchmark_database, format_table, percentile, timer
+from opd.middleware import UNRESOLVED
+from opd.models import Address, Appointment, InventoryItem, MedicalData, Patient
+from opd.onboarding import onboard_doctor
+from opd.replay import entry_client, log_aliases, read_log, unredact
+
+
+"""
+replays a traffic log (format in opd/replay.py) through the whole sih_api
+url conf and middleware stack, in process, against a fresh database.
+
+every token alias of the log becomes a doctor with --rows patients,
+appointments and inventory items. the log is split by client (entry_client
+of opd/replay.py): a client is replayed by one thread, its requests in log
+order, each after its own think time (scaled by --speed, 0 sends back to
+back). --concurrency threads replay that many clients at once, the next
+client starts when a thread is free. the report gives the latency
+percentiles and the queries of every endpoint.
+
+NOTE: the ids in the recorded urls are the ids of the recorded database,
+in the seeded one they may not exist and answer 404.
+"""
+
+PASSWORD = "replay-password"
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def seed_doctor(alias, rows):
+    user = onboard_doctor(alias, f"{alias}@example.com", PASSWORD)
+    doctor = user.doctor
+    addresses = Address.objects.bulk_create(
+        Address(street_name="street", city="city", state="state", pincode="123456")
+        for _ in range(rows)
+    )
+    medical_data = MedicalData.objects.bulk_create(
+        MedicalData(blood_group="O+", height="170", weight="70") for _ in range(rows)
+    )
+    Patient.objects.bulk_create(
+        Patient(
+            doctor=doctor,
+            address=address,
+            medical_data=data,
+            first_name=f"first {index}",
+            last_name=f"last {index}",
+            date_of_birth=datetime.date(1990, 1, 1),
+            gender="other",
+            contact="+919876543210",
+            email=f"{alias}.patient{index}@example.com",
+        )
+        for index, (address, data) in enumerate(zip(addresses, medical_data))
+    )
+    Appointment.objects.bulk_create(
+        Appointment(doctor=doctor, name=f"appointment {index}") for index in range(rows)
+    )
+    InventoryItem.objects.bulk_create(
+        InventoryItem(
+            inventory=doctor.inventory,
+            item_name=f"item {index}",
+            item_quantity=index,
+            item_price=10,
+        )
+        for index in range(rows)
+    )
+    return user.auth_token.key
+
+
+def endpoint(response):
+    try:
+        return response.resolver_match.view_name
+    except Resolver404:
+        return UNRESOLVED
+
+
+class Command(BaseCommand):
+    help = "Replay a recorded traffic log against a seeded database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("log", help="a traffic log, see opd/replay.py")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=1.0,
+            help="divides the think times, 0 sends the requests back to back",
+        )
+        parser.add_argument("--rows", type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            entries = list(read_log(options["log"]))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not entries:
+            raise CommandError(f"{options['log']} has no requests")
+
+        with benchmark_database():
+            tokens = {
+                alias: seed_doctor(alias, options["rows"])
+                for alias in log_aliases(entries)
+            }
+
+            # NOTE: one ordered sequence per client, a create never runs
+            # before the login it follows
+            sequences = defaultdict(list)
+            for entry in entries:
+                sequences[entry_client(entry["token"], entry["body"])].append(entry)
+            pending = queue.Queue()
+            for sequence in sequences.values():
+                pending.put(sequence)
+            results = []
+
+            threads = [
+                threading.Thread(
+                    target=self.client, args=(pending, tokens, options, results)
+                )
+                for _ in range(max(1, options["concurrency"]))
+            ]
+            with timer() as elapsed:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+        self.report(results, elapsed["seconds"], options["concurrency"])
+
+    def client(self, pending, tokens, options, results):
+        # NOTE: localhost passes the empty ALLOWED_HOSTS of DEBUG
+        client = Client(raise_request_exception=False, HTTP_HOST="localhost")
+        try:
+            while True:
+                try:
+                    sequence = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for entry in sequence:
+                    if options["speed"] > 0 and entry["think"]:
+                        time.sleep(entry["think"] / options["speed"])
+                    results.append(self.send(client, entry, tokens))
+        finally:
+            connections.close_all()
+
+    def send(self, client, entry, tokens):
+        headers = {}
+        if entry["token"]:
+            headers["Authorization"] = f"Token {tokens[entry['token']]}"
+        data = ""
+        if entry["body"] is not None:
+            data = json.dumps(unredact(entry["body"], PASSWORD))
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter), timer() as elapsed:
+            response = client.generic(
+                entry["method"],
+                entry["url"],
+                data,
+                content_type="application/json",
+                headers=headers,
+            )
+            if response.streaming:
+                # NOTE: an event stream never ends, only its headers are timed
+                if response["Content-Type"].startswith("text/event-stream"):
+                    response.close()
+                else:
+                    for _ in response.streaming_content:
+                        pass
+        return (
+            f"{entry['method']} {endpoint(response)}",
+            response.status_code,
+            elapsed["seconds"],
+            counter.count,
+        )
+
+    def report(self, results, seconds, concurrency):
+        by_endpoint = defaultdict(list)
+        for name, status, latency, queries in results:
+            by_endpoint[name].append((status, latency, queries))
+
+        rows = []
+        for name in sorted(by_endpoint, key=lambda name: -len(by_endpoint[name])):
+            samples = by_endpoint[name]
+            latencies = sorted(latency for _, latency, _ in samples)
+            statuses = sorted(Counter(status for status, _, _ in samples).items())
+            queries = sum(queries for _, _, queries in samples) / len(samples)
+            rows.append(
+                [name, len(samples), " ".join(f"{code}:{n}" for code, n in statuses)]
+                + [
+                    f"{percentile(latencies, fraction) * 1000:.1f}"
+                    for fraction in (0.50, 0.95, 0.99)
+                ]
+                + [f"{queries:.1f}"]
+            )
+
+        headers = ["endpoint", "requests", "statuses", "p50 ms", "p95 ms", "p99 ms"]
+        self.stdout.write(format_table(headers + ["queries"], rows))
+        self.stdout.write(
+            f"\n{len(results)} requests in {seconds:.2f}s at concurrency "
+            f"{concurrency}: {len(results) / seconds:.1f} requests/s"
+        )
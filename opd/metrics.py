@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+"""
+in-process request metrics: latency, database time, serializer time and
+query count of every request, aggregated per url name.
+
+the middleware (opd/middleware.py) opens a RequestStats for the request and
+keeps it in a context variable. every database connection gets
+record_query() as a permanent execute wrapper when it connects (see
+opd/signals.py), and the serializer call sites open a span("serializer").
+both only add to the RequestStats of the current request, when there is one.
+the context variable is copied into the sync_to_async threads, so the
+queries of the async views are counted too.
+
+the values go into HDR style histograms: a fixed error bound (~1.6%) instead
+of a list of samples, so the memory stays flat however long the process runs.
+"""
+
+METRICS = getattr(settings, "METRICS", {})
+ENABLED = METRICS.get("ENABLED", True)
+
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+
+def bucket_index(value):
+    # NOTE: exact below 2 * SUB_BUCKETS, then SUB_BUCKETS buckets per power of two
+    shift = max(0, value.bit_length() - SUB_BUCKET_BITS - 1)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_upper(index):
+    # NOTE: the highest value that falls into the bucket
+    shift = max(0, index // SUB_BUCKETS - 1)
+    sub_bucket = index - shift * SUB_BUCKETS
+    return ((sub_bucket + 1) << shift) - 1
+
+
+class Histogram:
+    """
+    histogram of non negative integers (microseconds, query counts). not
+    thread safe, RequestMetrics records under its lock.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = max(0, int(value))
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    def summary(self, scale=1):
+        if not self.count:
+            return {"count": 0}
+        summary = {"count": self.count, "mean": self.total / self.count / scale}
+        for name, fraction in PERCENTILES.items():
+            summary[name] = self.percentile(fraction) / scale
+        summary["max"] = self.max / scale
+        return summary
+
+
+class RequestStats:
+    __slots__ = ("start", "queries", "db_time", "serializer_time")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+
+current = ContextVar("request_stats", default=None)
+
+
+def elapsed(start):
+    return time.perf_counter() - start
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += elapsed(start)
+        stats.queries += 1
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@contextmanager
+def span(name):
+    stats = current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = name + "_time"
+        setattr(stats, attribute, getattr(stats, attribute) + elapsed(start))
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency = Histogram()
+        self.db = Histogram()
+        self.serializer = Histogram()
+        self.queries = Histogram()
+        self.statuses = {}
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, status_code, stats, latency):
+        status_class = f"{status_code // 100}xx"
+        with self.lock:
+            view = self.views.get(name)
+            if view is None:
+                view = self.views[name] = ViewMetrics()
+            view.latency.record(latency * 1e6)
+            view.db.record(stats.db_time * 1e6)
+            view.serializer.record(stats.serializer_time * 1e6)
+            view.queries.record(stats.queries)
+            view.statuses[status_class] = view.statuses.get(status_class, 0) + 1
+
+    def snapshot(self):
+        # NOTE: the times are recorded in microseconds and reported in ms
+        with self.lock:
+            return {
+                name: {
+                    "statuses": dict(sorted(view.statuses.items())),
+                    "latency_ms": view.latency.summary(1000),
+                    "db_ms": view.db.summary(1000),
+                    "serializer_ms": view.serializer.summary(1000),
+                    "queries": view.queries.summary(),
+                }
+                for name, view in sorted(self.views.items())
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+request_metrics = RequestMetrics()
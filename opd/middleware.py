@@ -0,0 +1,139 @@
+import json
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from opd.metrics import (
+    ENABLED,
+    METRICS,
+    RequestStats,
+    current,
+    elapsed,
+    request_metrics,
+)
+from opd.replay import (
+    TRAFFIC_LOG,
+    TrafficRecorder,
+    client_alias,
+    redact,
+    redact_url,
+)
+
+
+"""
+InstrumentationMiddleware is the first middleware of the stack: it times the
+whole request and records it in opd.metrics under the url name
+(opd:patient-list, opd:opd ...). the Server-Timing header tells how long the
+database and the serializers took, METRICS["SERVER_TIMING"] sends it to
+nobody (False), to the staff users ("staff") or to every client (True).
+
+TrafficRecorderMiddleware writes the requests into the traffic log of
+opd/replay.py when TRAFFIC_LOG["PATH"] is set.
+"""
+
+SERVER_TIMING = METRICS.get("SERVER_TIMING", False)
+UNRESOLVED = "<unresolved>"
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else UNRESOLVED
+
+
+def server_timing_allowed(request):
+    if SERVER_TIMING == "staff":
+        # NOTE: the user authenticated by DRF, the async views do not set one
+        user = getattr(request, "user", None)
+        return user is not None and user.is_staff
+    return bool(SERVER_TIMING)
+
+
+def server_timing(stats, latency):
+    return ", ".join(
+        [
+            f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"',
+            f"serializer;dur={stats.serializer_time * 1000:.2f}",
+            f"total;dur={latency * 1000:.2f}",
+        ]
+    )
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        # NOTE: a streaming response is timed up to its headers
+        latency = elapsed(stats.start)
+        request_metrics.record(
+            view_name(request), response.status_code, stats, latency
+        )
+        if server_timing_allowed(request):
+            response["Server-Timing"] = server_timing(stats, latency)
+        return response
+
+
+def request_body(request):
+    # NOTE: only json, the uploads are not recorded
+    if request.content_type != "application/json" or not request.body:
+        return None
+    try:
+        return redact(json.loads(request.body))
+    except ValueError:
+        return None
+
+
+class TrafficRecorderMiddleware:
+    def __init__(self, get_response):
+        path = TRAFFIC_LOG.get("PATH")
+        if not path:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = TRAFFIC_LOG.get("PREFIX", "/api/")
+        self.recorder = TrafficRecorder(path)
+
+    def __call__(self, request):
+        if not request.path.startswith(self.prefix):
+            return self.get_response(request)
+
+        # NOTE: read before the view, a parsed stream can not be read again
+        body = request_body(request)
+        response = self.get_response(request)
+        # NOTE: the authentication of the view sets request.user
+        self.recorder.record(
+            request.method,
+            redact_url(request.get_full_path()),
+            client_alias(getattr(request, "user", None)),
+            body,
+            response.status_code,
+        )
+        return response
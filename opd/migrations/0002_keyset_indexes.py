@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patient',
+            name='last_name',
+            field=models.CharField(max_length=100, verbose_name='Last Name'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'date_time', 'id'], name='appointment_doctor_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['doctor', 'created_at', 'id'], name='patient_doctor_keyset_idx'),
+        ),
+    ]
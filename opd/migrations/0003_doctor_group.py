@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def create_doctor_group(apps, schema_editor):
+    Group = apps.get_model("auth", "Group")
+    Group.objects.get_or_create(name="Doctor")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("opd", "0002_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_doctor_group, migrations.RunPython.noop),
+    ]
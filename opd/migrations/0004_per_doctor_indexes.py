@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0003_doctor_group'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'active'], name='appointment_doctor_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['doctor', 'last_name', 'first_name'], name='patient_doctor_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inventoryitem',
+            constraint=models.UniqueConstraint(fields=('inventory', 'item_name'), name='inventory_item_unique_name'),
+        ),
+    ]
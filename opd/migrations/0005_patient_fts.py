@@ -0,0 +1,111 @@
+from django.db import migrations
+
+
+"""
+FTS5 index of the patients, see opd/search.py. sqlite only: on the other
+databases the search falls back to icontains lookups.
+"""
+
+INDEXED_ROW = """
+    'd' || new.doctor_id,
+    new.first_name,
+    new.last_name,
+    new.email,
+    COALESCE(
+        (SELECT medical_history FROM opd_medicaldata WHERE id = new.medical_data_id),
+        ''
+    )
+"""
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE opd_patient_fts USING fts5(
+        doctor,
+        first_name,
+        last_name,
+        email,
+        medical_history,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER opd_patient_fts_insert AFTER INSERT ON opd_patient
+    BEGIN
+        INSERT INTO opd_patient_fts (
+            rowid, doctor, first_name, last_name, email, medical_history
+        )
+        VALUES (new.id, {INDEXED_ROW});
+    END
+    """,
+    f"""
+    CREATE TRIGGER opd_patient_fts_update
+    AFTER UPDATE OF doctor_id, first_name, last_name, email, medical_data_id
+    ON opd_patient
+    BEGIN
+        DELETE FROM opd_patient_fts WHERE rowid = old.id;
+        INSERT INTO opd_patient_fts (
+            rowid, doctor, first_name, last_name, email, medical_history
+        )
+        VALUES (new.id, {INDEXED_ROW});
+    END
+    """,
+    """
+    CREATE TRIGGER opd_patient_fts_delete AFTER DELETE ON opd_patient
+    BEGIN
+        DELETE FROM opd_patient_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER opd_medicaldata_fts_update
+    AFTER UPDATE OF medical_history ON opd_medicaldata
+    BEGIN
+        UPDATE opd_patient_fts SET medical_history = new.medical_history
+        WHERE rowid IN (SELECT id FROM opd_patient WHERE medical_data_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO opd_patient_fts (
+        rowid, doctor, first_name, last_name, email, medical_history
+    )
+    SELECT
+        patient.id,
+        'd' || patient.doctor_id,
+        patient.first_name,
+        patient.last_name,
+        patient.email,
+        COALESCE(medical_data.medical_history, '')
+    FROM opd_patient AS patient
+    LEFT JOIN opd_medicaldata AS medical_data
+        ON medical_data.id = patient.medical_data_id
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS opd_medicaldata_fts_update",
+    "DROP TRIGGER IF EXISTS opd_patient_fts_delete",
+    "DROP TRIGGER IF EXISTS opd_patient_fts_update",
+    "DROP TRIGGER IF EXISTS opd_patient_fts_insert",
+    "DROP TABLE IF EXISTS opd_patient_fts",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("opd", "0004_per_doctor_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:31
+
+import datetime
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0005_patient_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='opd',
+            name='closing_time',
+            field=models.TimeField(default=datetime.time(17, 0), verbose_name='Closing Time'),
+        ),
+        migrations.AddField(
+            model_name='opd',
+            name='opening_time',
+            field=models.TimeField(default=datetime.time(9, 0), verbose_name='Opening Time'),
+        ),
+        migrations.AddField(
+            model_name='opd',
+            name='slot_capacity',
+            field=models.PositiveIntegerField(default=1, verbose_name='Patients per Slot'),
+        ),
+        migrations.AddField(
+            model_name='opd',
+            name='slot_duration',
+            field=models.PositiveIntegerField(default=15, verbose_name='Slot Duration (minutes)'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='date_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date of appointment'),
+        ),
+    ]
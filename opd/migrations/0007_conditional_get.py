@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0006_appointment_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'last_updated'], name='appointment_doctor_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryitem',
+            index=models.Index(fields=['inventory', 'last_updated'], name='inventory_item_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['doctor', 'updated_at'], name='patient_doctor_updated_idx'),
+        ),
+    ]
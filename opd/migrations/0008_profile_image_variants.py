@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:42
+
+import opd.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0007_conditional_get'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='doctor',
+            name='profile_image',
+            field=models.ImageField(default='profile/default-profile.png', storage=opd.storage.profile_image_storage, upload_to='profile/', verbose_name='Image'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:13
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    # NOTE: a copy of opd.rollups.rebuild_rollups() at this point of the schema,
+    # with the historical models only
+    DailyRollup = apps.get_model("opd", "DailyRollup")
+    Appointment = apps.get_model("opd", "Appointment")
+    Patient = apps.get_model("opd", "Patient")
+
+    rows = defaultdict(dict)
+    for row in (
+        Appointment.objects.annotate(day=TruncDate("date_time"))
+        .values("doctor_id", "day")
+        .annotate(
+            appointments=Count("id"),
+            active_appointments=Count("id", filter=Q(active=True)),
+        )
+        .order_by()
+    ):
+        rows[(row.pop("doctor_id"), row.pop("day"))].update(row)
+    for row in (
+        Patient.objects.annotate(day=TruncDate("created_at"))
+        .values("doctor_id", "day")
+        .annotate(new_patients=Count("id"))
+        .order_by()
+    ):
+        rows[(row.pop("doctor_id"), row.pop("day"))].update(row)
+
+    DailyRollup.objects.bulk_create(
+        [
+            DailyRollup(doctor_id=doctor_id, day=day, **counts)
+            for (doctor_id, day), counts in rows.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0008_profile_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('active_appointments', models.PositiveIntegerField(default=0)),
+                ('new_patients', models.PositiveIntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='opd.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day'), name='rollup_doctor_day')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
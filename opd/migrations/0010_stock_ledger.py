@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0009_daily_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('consume', 'Consume'), ('restock', 'Restock'), ('adjust', 'Adjust')], max_length=16, verbose_name='Kind of Movement')),
+                ('delta', models.IntegerField(verbose_name='Change of Quantity')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity after the Movement')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='opd.inventoryitem')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'id'], name='stock_movement_item_idx')],
+            },
+        ),
+    ]
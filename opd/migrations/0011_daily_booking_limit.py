@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opd', '0010_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='opd',
+            name='daily_booking_limit',
+            field=models.PositiveIntegerField(default=0, verbose_name='Bookings per Day'),
+        ),
+    ]
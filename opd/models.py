@@ -1,10 +1,31 @@
+import datetime
+
 from django.db import models
+from django.utils import timezone
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.dispatch import Signal
 from phonenumber_field.modelfields import PhoneNumberField
 from django.core.exceptions import ValidationError
+
+from opd.storage import profile_image_storage
 # Create your models here.
 
 
+"""
+bulk_create() does not send post_save, the managers of the models that feed
+the opd counters send this signal instead with the created instances.
+"""
+post_bulk_create = Signal()
+
+
+class BulkSignalQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        post_bulk_create.send(sender=self.model, instances=objs, using=self.db)
+        return objs
+
+
 class Address(models.Model):
     house_number = models.CharField(
         "House Number", max_length=60, null=True, blank=True
@@ -29,7 +50,10 @@ class Doctor(models.Model):
         "Image",
         upload_to="profile/",
         default="profile/default-profile.png",
+        storage=profile_image_storage,
     )
+    # NOTE: {"source": profile_image name, variant name: file name}, see opd/images.py
+    image_variants = models.JSONField(default=dict, blank=True)
     speciality = models.CharField("Speciality", max_length=200)
     phone_number = PhoneNumberField("Phone Number", region="IN")
     experience = models.PositiveIntegerField("Year of Experience", default=0)
@@ -39,6 +63,7 @@ class Doctor(models.Model):
         Address, on_delete=models.SET_NULL, null=True, related_name="doctor"
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    last_updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return "Dr. " + self.name
@@ -55,6 +80,13 @@ class Opd(models.Model):
     )
     active_patient = models.PositiveIntegerField("No. of Active_Patient", default=0)
     no_of_appointment = models.PositiveIntegerField("No. of Appointment", default=0)
+    # NOTE: used by opd.scheduling to cut the days of operation into slots
+    opening_time = models.TimeField("Opening Time", default=datetime.time(9, 0))
+    closing_time = models.TimeField("Closing Time", default=datetime.time(17, 0))
+    slot_duration = models.PositiveIntegerField("Slot Duration (minutes)", default=15)
+    slot_capacity = models.PositiveIntegerField("Patients per Slot", default=1)
+    # NOTE: bookings per day, 0 is no limit. max_patient_capacity is the beds
+    daily_booking_limit = models.PositiveIntegerField("Bookings per Day", default=0)
     last_updated = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -83,9 +115,14 @@ class Opd(models.Model):
         if self.active_patient > self.max_patient_capacity:
             raise ValidationError("No beds are available")
 
+    def clean_closing_time(self):
+        if self.closing_time <= self.opening_time:
+            raise ValidationError("Closing time must be after the opening time")
+
     def clean(self):
         super().clean()
         self.clean_active_patient()
+        self.clean_closing_time()
 
 
 class Inventory(models.Model):
@@ -98,6 +135,20 @@ class Inventory(models.Model):
             return "Inventory of Dr." + self.doctor.name
         return "Inventory"
 
+    def get_summary(self):
+        # NOTE: one aggregate query, it does not depend on the number of items
+        return self.inventory_items.aggregate(  # type: ignore
+            item_count=models.Count("id"),
+            total_quantity=Coalesce(models.Sum("item_quantity"), 0),
+            total_value=Coalesce(
+                models.Sum(
+                    models.F("item_quantity") * models.F("item_price"),
+                    output_field=models.FloatField(),
+                ),
+                0.0,
+            ),
+        )
+
 
 class InventoryItem(models.Model):
     inventory = models.ForeignKey(
@@ -110,6 +161,22 @@ class InventoryItem(models.Model):
     last_updated = models.DateTimeField(auto_now=True)
     created_id = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # NOTE: also serves as the index of the inventory_id lookups
+        constraints = [
+            models.UniqueConstraint(
+                fields=["inventory", "item_name"],
+                name="inventory_item_unique_name",
+            ),
+        ]
+        # NOTE: covers the MAX(last_updated) of the conditional GET
+        indexes = [
+            models.Index(
+                fields=["inventory", "last_updated"],
+                name="inventory_item_updated_idx",
+            ),
+        ]
+
     def __str__(self):
         return "Inventory of " + self.inventory.doctor.name + " | " + self.item_name
 
@@ -118,15 +185,65 @@ class InventoryItem(models.Model):
             raise ValidationError("Item price cannot be negative")
 
 
+class StockMovement(models.Model):
+    """
+    append-only ledger of the inventory items, one row per change of
+    item_quantity. written by opd/stock.py, never updated.
+    """
+
+    CONSUME = "consume"
+    RESTOCK = "restock"
+    ADJUST = "adjust"
+    KINDS = [(CONSUME, "Consume"), (RESTOCK, "Restock"), (ADJUST, "Adjust")]
+
+    item = models.ForeignKey(
+        InventoryItem, on_delete=models.CASCADE, related_name="movements"
+    )
+    kind = models.CharField("Kind of Movement", max_length=16, choices=KINDS)
+    delta = models.IntegerField("Change of Quantity")
+    # NOTE: item_quantity right after the movement
+    quantity = models.PositiveIntegerField("Quantity after the Movement")
+    user = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # NOTE: the history of an item, newest first
+        indexes = [models.Index(fields=["item", "id"], name="stock_movement_item_idx")]
+
+    def __str__(self):
+        return f"Movement | {self.item_id} | {self.kind} {self.delta:+d}"
+
+
 class Appointment(models.Model):
     doctor = models.ForeignKey(
         Doctor, on_delete=models.CASCADE, related_name="appointments"
     )
     name = models.CharField("Name of Patient", max_length=256)
-    date_time = models.DateTimeField("Date of appointment", auto_now_add=True)
+    date_time = models.DateTimeField("Date of appointment", default=timezone.now)
     active = models.BooleanField(default=False)
     last_updated = models.DateTimeField("Last Updated", auto_now=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
+    class Meta:
+        # NOTE: keyset pagination walks this index, see opd/api/pagination.py
+        indexes = [
+            models.Index(
+                fields=["doctor", "date_time", "id"],
+                name="appointment_doctor_keyset_idx",
+            ),
+            models.Index(
+                fields=["doctor", "active"],
+                name="appointment_doctor_active_idx",
+            ),
+            models.Index(
+                fields=["doctor", "last_updated"],
+                name="appointment_doctor_updated_idx",
+            ),
+        ]
+
     def __str__(self):
         return "Appointment | " + self.name + " | " + self.doctor.name
 
@@ -180,5 +297,48 @@ class Patient(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["doctor", "created_at", "id"],
+                name="patient_doctor_keyset_idx",
+            ),
+            models.Index(
+                fields=["doctor", "last_name", "first_name"],
+                name="patient_doctor_name_idx",
+            ),
+            models.Index(
+                fields=["doctor", "updated_at"],
+                name="patient_doctor_updated_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.first_name + " | " + self.doctor.name
+
+
+class DailyRollup(models.Model):
+    """
+    appointments and new patients of a doctor per day, kept up to date by
+    opd/rollups.py so the analytics read one row per day.
+    """
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="rollups")
+    day = models.DateField("Day")
+    # NOTE: by the day of the appointment, active is its current state
+    appointments = models.PositiveIntegerField(default=0)
+    active_appointments = models.PositiveIntegerField(default=0)
+    # NOTE: by the day the patient was created
+    new_patients = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "day"], name="rollup_doctor_day")
+        ]
+        indexes = [models.Index(fields=["day"], name="rollup_day_idx")]
+
+    def __str__(self):
+        return f"Rollup | {self.doctor_id} | {self.day}"
+
@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from opd.api.authentication import DOCTOR_GROUP
+from opd.models import Address, Doctor, Inventory, Opd
+
+
+"""
+a new doctor needs: the user, its token, the Doctor group, an address, the
+doctor profile, the opd and the inventory.
+
+this used to be a chain of post_save handlers, each one with its own implicit
+transaction and a Group lookup on every signup. here everything is created in
+one atomic block, the group id is looked up once per process, and the bulk
+variant creates a whole roster with one INSERT per table. a single post_save
+handler remains as the fallback for the users created some other way.
+"""
+
+NOT_SPECIFIED = "Not Specified"
+
+_doctor_group_id = None
+
+
+def get_doctor_group_id():
+    global _doctor_group_id
+    if _doctor_group_id is None:
+        group, _ = Group.objects.get_or_create(name=DOCTOR_GROUP)
+        _doctor_group_id = group.pk
+    return _doctor_group_id
+
+
+def clear_doctor_group_cache():
+    global _doctor_group_id
+    _doctor_group_id = None
+
+
+def default_address():
+    return Address(
+        house_number=NOT_SPECIFIED,
+        street_name=NOT_SPECIFIED,
+        city=NOT_SPECIFIED,
+        state=NOT_SPECIFIED,
+        pincode=NOT_SPECIFIED,
+    )
+
+
+def default_doctor(user, address):
+    return Doctor(
+        user=user,
+        name=NOT_SPECIFIED,
+        speciality=NOT_SPECIFIED,
+        phone_number="000-000-0000",
+        about=NOT_SPECIFIED,
+        education=NOT_SPECIFIED,
+        address=address,
+    )
+
+
+def default_opd(doctor):
+    return Opd(
+        doctor_profile=doctor,
+        name=NOT_SPECIFIED,
+        days_of_operation=NOT_SPECIFIED,
+    )
+
+
+@transaction.atomic
+def onboard_doctor(username, email, password):
+    user = User(username=username, email=email)
+    user.set_password(password)
+    # NOTE: tells the post_save fallback of opd/signals.py to stay out
+    user.onboarding = True  # type: ignore
+    user.save()
+    return complete_onboarding(user)
+
+
+@transaction.atomic
+def complete_onboarding(user):
+    """
+    everything but the user itself. also called by the post_save fallback for
+    the users created outside this module (admin, createsuperuser,
+    User.objects.create_user ...).
+    """
+    Token.objects.create(user=user)
+    # NOTE: the through model skips the SELECT that groups.add() does first
+    User.groups.through.objects.create(user=user, group_id=get_doctor_group_id())
+
+    address = default_address()
+    address.save()
+    doctor = default_doctor(user, address)
+    doctor.save()
+    default_opd(doctor).save()
+    Inventory.objects.create(doctor=doctor)
+    return user
+
+
+def hash_passwords(passwords, workers=4):
+    # NOTE: PBKDF2 releases the GIL, so the hashing of a roster runs in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda password: make_password(password) if password else None,
+                passwords,
+            )
+        )
+
+
+@transaction.atomic
+def bulk_onboard_doctors(rows, batch_size=500):
+    """
+    rows is an iterable of dicts with username, email and password (the
+    password can be empty, the user then gets an unusable password).
+
+    returns (created users, skipped usernames). usernames that already exist
+    or appear twice in the roster are skipped instead of failing the import.
+    """
+    rows = list(rows)
+    usernames = [row["username"] for row in rows]
+    taken = set(
+        User.objects.filter(username__in=usernames).values_list("username", flat=True)
+    )
+
+    accepted, skipped = [], []
+    for row in rows:
+        if row["username"] in taken:
+            skipped.append(row["username"])
+            continue
+        taken.add(row["username"])
+        accepted.append(row)
+
+    passwords = hash_passwords([row.get("password") for row in accepted])
+    users = [
+        User(
+            username=row["username"],
+            email=row.get("email", ""),
+            password=password or make_password(None),
+        )
+        for row, password in zip(accepted, passwords)
+    ]
+    users = User.objects.bulk_create(users, batch_size=batch_size)
+
+    group_id = get_doctor_group_id()
+    Token.objects.bulk_create(
+        [Token(user=user, key=Token.generate_key()) for user in users],
+        batch_size=batch_size,
+    )
+    User.groups.through.objects.bulk_create(
+        [User.groups.through(user=user, group_id=group_id) for user in users],
+        batch_size=batch_size,
+    )
+
+    addresses = Address.objects.bulk_create(
+        [default_address() for _ in users], batch_size=batch_size
+    )
+    doctors = Doctor.objects.bulk_create(
+        [default_doctor(user, address) for user, address in zip(users, addresses)],
+        batch_size=batch_size,
+    )
+    Opd.objects.bulk_create(
+        [default_opd(doctor) for doctor in doctors], batch_size=batch_size
+    )
+    Inventory.objects.bulk_create(
+        [Inventory(doctor=doctor) for doctor in doctors], batch_size=batch_size
+    )
+    return users, skipped
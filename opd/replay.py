@@ -0,0 +1,211 @@
+import atexit
+import hashlib
+import hmac
+import json
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+
+"""
+the traffic log: one json object per line, recorded from real traffic by
+TrafficRecorderMiddleware (opd/middleware.py) and replayed by the
+replay_traffic command against a seeded database.
+
+    {"method": "GET", "url": "/api/doctor/patient/?page_size=20",
+     "token": "user7", "body": null, "think": 0.25}
+
+method  the http method
+url     the path with its query string, the personal parameters (?q=) are
+        pseudonymized like the body
+token   alias of the client that sent it, null when anonymous. the replay
+        seeds one doctor per alias and sends its token instead, the real
+        tokens are never written down
+body    the json body or null. the passwords are replaced by REDACTED and
+        the replay sends its own password in their place. a username of an
+        existing user becomes its alias (login/ of the seeded doctor), the
+        names, addresses, contacts and medical history become pseudonyms
+        that still pass the validation of the serializers
+think   seconds the client waited since its previous request, a login/ is
+        counted with the requests of the doctor that logs in (entry_client)
+
+the responses are not recorded, only their status.
+
+a recorded line may carry more keys ("status" is the answer that was sent),
+the replay ignores them. see opd/fixtures/traffic.jsonl for an example.
+"""
+
+TRAFFIC_LOG = getattr(settings, "TRAFFIC_LOG", {})
+
+REDACTED = "<password>"
+SECRET_KEYS = {"password", "password2"}
+ALIAS = re.compile(r"^user\d+$")
+PHONE = "+919876543210"
+SECRET_PARAMS = {"ticket", "token"}
+# NOTE: think times past this are the client going away, not thinking
+MAX_THINK = 60.0
+
+
+def read_log(path):
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: {e}") from None
+            if "method" not in entry or "url" not in entry:
+                raise ValueError(f"{path}:{number}: method and url are required")
+            yield {
+                "method": entry["method"].upper(),
+                "url": entry["url"],
+                "token": entry.get("token"),
+                "body": entry.get("body"),
+                "think": float(entry.get("think") or 0),
+            }
+
+
+def pseudonym(value):
+    # NOTE: keyed, the same value gets the same pseudonym within a deployment
+    digest = hmac.new(
+        settings.SECRET_KEY.encode(), str(value).encode(), hashlib.sha256
+    ).hexdigest()
+    return "p" + digest[:10]
+
+
+def username_alias(username):
+    user_id = User.objects.filter(username=username).values_list("pk", flat=True)
+    user_id = user_id.first()
+    return pseudonym(username) if user_id is None else f"user{user_id}"
+
+
+PSEUDONYMS = {
+    "username": username_alias,
+    "email": lambda value: f"{pseudonym(value)}@example.com",
+    "contact": lambda value: PHONE,
+    "phone_number": lambda value: PHONE,
+    "pincode": lambda value: "000000",
+    "date_of_birth": lambda value: "1990-01-01",
+    **{
+        key: pseudonym
+        for key in (
+            "q",
+            "name",
+            "first_name",
+            "last_name",
+            "about",
+            "education",
+            "house_number",
+            "street_name",
+            "city",
+            "state",
+            "medical_history",
+        )
+    },
+}
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {key: redact_item(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def redact_item(key, value):
+    if key in SECRET_KEYS:
+        return REDACTED
+    if key in PSEUDONYMS and isinstance(value, str) and value:
+        return PSEUDONYMS[key](value)
+    return redact(value)
+
+
+def redact_url(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    # NOTE: a stream ticket is a credential, it is left out of the log
+    query = [
+        (key, redact_item(key, value))
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in SECRET_PARAMS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def unredact(value, password):
+    if isinstance(value, dict):
+        return {key: unredact(item, password) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unredact(item, password) for item in value]
+    return password if value == REDACTED else value
+
+
+def entry_client(token, body):
+    """
+    the client a request belongs to: its token alias, or the doctor of a
+    login/ (the username of the body is an alias) that has no token yet.
+    None for the other anonymous requests.
+    """
+    if token:
+        return token
+    username = body.get("username") if isinstance(body, dict) else None
+    if isinstance(username, str) and ALIAS.match(username):
+        return username
+    return None
+
+
+def log_aliases(entries):
+    # NOTE: the clients with a token and the doctors that log in
+    aliases = {entry_client(entry["token"], entry["body"]) for entry in entries}
+    return sorted(aliases - {None})
+
+
+def client_alias(user):
+    if user is None or not user.is_authenticated:
+        return None
+    return f"user{user.pk}"
+
+
+class TrafficRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # NOTE: client -> time of its last request, for the think time
+        self.last_seen = {}
+        self.file = None
+
+    def record(self, method, url, alias, body, status):
+        now = time.monotonic()
+        client = entry_client(alias, body)
+        with self.lock:
+            last = self.last_seen.get(client)
+            self.last_seen[client] = now
+            think = 0.0 if last is None else min(now - last, MAX_THINK)
+
+            line = {
+                "method": method,
+                "url": url,
+                "token": alias,
+                "body": body,
+                "think": round(think, 3),
+                "status": status,
+            }
+            if self.file is None:
+                # NOTE: line buffered, every request reaches the file at once
+                self.file = open(self.path, "a", encoding="utf-8", buffering=1)
+                atexit.register(self.close)
+            self.file.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
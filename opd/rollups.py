@@ -0,0 +1,166 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Greatest, TruncDate, TruncWeek
+from django.utils import timezone
+
+from opd.counters import DeltaBuffer, write_lock
+from opd.models import Appointment, DailyRollup, Patient
+
+
+"""
+per doctor and per day rollups of the appointments and the new patients
+(DailyRollup), for the analytics endpoint.
+
+the signal handlers of opd/signals.py turn every created, changed or deleted
+row into deltas on its (doctor, day) key, the deltas go through a DeltaBuffer
+like the opd counters: one UPDATE per key when the transaction commits. the
+first delta of a day creates its row.
+
+an appointment counts on the day of its date_time, a patient on the day of
+its created_at, both in TIME_ZONE. rebuild_rollups() recomputes the rows from
+the tables, see the backfill_rollups command.
+"""
+
+# NOTE: the fields that decide the key and the counts of an appointment
+APPOINTMENT_STATE = ("doctor_id", "date_time", "active")
+
+
+def day_of(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def appointment_state(appointment):
+    return tuple(getattr(appointment, field) for field in APPOINTMENT_STATE)
+
+
+def appointment_deltas(state, sign):
+    doctor_id, date_time, active = state
+    return (doctor_id, day_of(date_time)), {
+        "appointments": sign,
+        "active_appointments": sign if active else 0,
+    }
+
+
+def patient_deltas(doctor_id, created_at, sign):
+    return (doctor_id, day_of(created_at)), {"new_patients": sign}
+
+
+def apply_rollup_deltas(key, deltas):
+    doctor_id, day = key
+    # NOTE: clamped, a row removed before the backfill must not go below zero
+    updates = {
+        field: Greatest(F(field) + delta, Value(0)) for field, delta in deltas.items()
+    }
+    rollups = DailyRollup.objects.filter(doctor_id=doctor_id, day=day)
+    # NOTE: only additions open a day, the deletes of a doctor being deleted do not
+    if rollups.update(**updates) or not any(delta > 0 for delta in deltas.values()):
+        return
+    try:
+        with transaction.atomic():
+            DailyRollup.objects.create(
+                doctor_id=doctor_id,
+                day=day,
+                **{field: max(delta, 0) for field, delta in deltas.items()},
+            )
+    except IntegrityError:
+        # NOTE: another process opened the day first
+        rollups.update(**updates)
+
+
+rollup_deltas = DeltaBuffer(apply_rollup_deltas)
+
+
+def add_deltas(entries):
+    # NOTE: entries of (key, deltas), summed so a bulk create adds once per key
+    totals = defaultdict(Counter)
+    for key, deltas in entries:
+        totals[key].update(deltas)
+    for key, deltas in totals.items():
+        rollup_deltas.add_many(key, deltas)
+
+
+def rebuild_rollups(doctor_ids=None):
+    """
+    recomputes the rollups of the given doctors (all of them by default) with
+    two GROUP BY queries.
+    """
+    appointments = Appointment.objects.all()
+    patients = Patient.objects.all()
+    rollups = DailyRollup.objects.all()
+    if doctor_ids is not None:
+        appointments = appointments.filter(doctor_id__in=doctor_ids)
+        patients = patients.filter(doctor_id__in=doctor_ids)
+        rollups = rollups.filter(doctor_id__in=doctor_ids)
+
+    # NOTE: read and written in one transaction, a row saved in between would
+    # be counted twice (the table and its delta) or not at all
+    with write_lock, transaction.atomic():
+        rows = defaultdict(dict)
+        for row in (
+            appointments.annotate(day=TruncDate("date_time"))
+            .values("doctor_id", "day")
+            .annotate(
+                appointments=Count("id"),
+                active_appointments=Count("id", filter=Q(active=True)),
+            )
+            .order_by()
+        ):
+            rows[(row.pop("doctor_id"), row.pop("day"))].update(row)
+        for row in (
+            patients.annotate(day=TruncDate("created_at"))
+            .values("doctor_id", "day")
+            .annotate(new_patients=Count("id"))
+            .order_by()
+        ):
+            rows[(row.pop("doctor_id"), row.pop("day"))].update(row)
+
+        rollups.delete()
+        DailyRollup.objects.bulk_create(
+            [
+                DailyRollup(doctor_id=doctor_id, day=day, **counts)
+                for (doctor_id, day), counts in rows.items()
+            ],
+            batch_size=1000,
+        )
+    return len(rows)
+
+
+PERIODS = {"day": F("day"), "week": TruncWeek("day")}
+
+
+def rollup_summary(since, until, period="day", doctor_ids=None):
+    """
+    the rollups between since and until (both included) per doctor and per
+    day or week (starting on monday). reads one row per doctor and day.
+    """
+    rollups = DailyRollup.objects.filter(day__gte=since, day__lte=until)
+    if doctor_ids is not None:
+        rollups = rollups.filter(doctor_id__in=doctor_ids)
+
+    rows = (
+        rollups.values("doctor_id", period=PERIODS[period])
+        .annotate(
+            total_appointments=Sum("appointments"),
+            total_active=Sum("active_appointments"),
+            total_new_patients=Sum("new_patients"),
+        )
+        .order_by("doctor_id", "period")
+    )
+    return [
+        {
+            "doctor": row["doctor_id"],
+            "period": row["period"],
+            "appointments": row["total_appointments"],
+            "active_appointments": row["total_active"],
+            "inactive_appointments": row["total_appointments"] - row["total_active"],
+            "active_ratio": (
+                round(row["total_active"] / row["total_appointments"], 4)
+                if row["total_appointments"]
+                else None
+            ),
+            "new_patients": row["total_new_patients"],
+        }
+        for row in rows
+    ]
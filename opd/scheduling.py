@@ -0,0 +1,221 @@
+import datetime
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from opd.cache import LRUCache
+from opd.counters import DeltaBuffer
+from opd.models import Appointment, Opd
+
+
+"""
+slot based booking.
+
+an opd is open on the days of days_of_operation ("Mon-Fri", "Monday, Thursday",
+"daily" ...) from opening_time to closing_time, and the day is cut in slots
+of slot_duration minutes. a slot takes slot_capacity appointments and the
+whole day takes daily_booking_limit appointments (0 means no daily limit).
+
+"next free slots" is answered from an in-memory availability index per doctor
+(booked count per slot and per day over the booking horizon), built with one
+query and then kept up to date by the appointment signals. the index is only
+advisory: a booking re-checks the capacity in the database inside the
+transaction that inserts the appointment.
+"""
+
+SCHEDULING = getattr(settings, "SCHEDULING", {})
+HORIZON_DAYS = SCHEDULING.get("HORIZON_DAYS", 30)
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+EVERY_DAY = {"daily", "all", "everyday", "every day", "all days"}
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+def weekday_index(name):
+    name = name.strip()[:3]
+    return WEEKDAYS.index(name) if name in WEEKDAYS else None
+
+
+def parse_days_of_operation(text):
+    text = text.lower().strip()
+    if text in EVERY_DAY:
+        return set(range(7))
+
+    days = set()
+    for part in re.split(r"[,;/&]|\band\b", text):
+        bounds = [weekday_index(bound) for bound in re.split(r"-|\bto\b", part)]
+        bounds = [bound for bound in bounds if bound is not None]
+        if len(bounds) == 2:
+            first, last = bounds
+            # NOTE: "Sat-Mon" wraps around the end of the week
+            span = (last - first) % 7 + 1
+            days.update((first + offset) % 7 for offset in range(span))
+        else:
+            days.update(bounds)
+    return days
+
+
+class Schedule:
+    def __init__(self, opd):
+        self.days = parse_days_of_operation(opd.days_of_operation)
+        self.opening_time = opd.opening_time
+        self.closing_time = opd.closing_time
+        self.duration = datetime.timedelta(minutes=max(opd.slot_duration, 1))
+        self.slot_capacity = opd.slot_capacity
+        self.daily_capacity = opd.daily_booking_limit or None
+
+    def slots_of_day(self, day):
+        if day.weekday() not in self.days:
+            return
+        tz = timezone.get_current_timezone()
+        start = timezone.make_aware(
+            datetime.datetime.combine(day, self.opening_time), tz
+        )
+        closing = timezone.make_aware(
+            datetime.datetime.combine(day, self.closing_time), tz
+        )
+        while start + self.duration <= closing:
+            yield start
+            start += self.duration
+
+    def slots(self, after, until):
+        day = timezone.localtime(after).date()
+        while day < until.date() + datetime.timedelta(days=1):
+            for start in self.slots_of_day(day):
+                if after <= start < until:
+                    yield start
+            day += datetime.timedelta(days=1)
+
+    def is_slot(self, start):
+        day = timezone.localtime(start).date()
+        return start in set(self.slots_of_day(day))
+
+
+class AvailabilityIndex:
+    def __init__(self, schedule, start, end, booked_times):
+        self.schedule = schedule
+        self.start = start
+        self.end = end
+        self.per_slot = Counter(booked_times)
+        self.per_day = Counter(timezone.localtime(time).date() for time in booked_times)
+        self.lock = threading.Lock()
+
+    def covers(self, time):
+        return self.start <= time < self.end
+
+    def available(self, start):
+        free = self.schedule.slot_capacity - self.per_slot[start]
+        if self.schedule.daily_capacity is not None:
+            day = timezone.localtime(start).date()
+            free = min(free, self.schedule.daily_capacity - self.per_day[day])
+        return max(free, 0)
+
+    def next_free(self, after, count):
+        free = []
+        for start in self.schedule.slots(max(after, self.start), self.end):
+            available = self.available(start)
+            if available:
+                free.append((start, available))
+                if len(free) == count:
+                    break
+        return free
+
+    def add(self, time, delta):
+        if self.covers(time):
+            with self.lock:
+                self.per_slot[time] += delta
+                self.per_day[timezone.localtime(time).date()] += delta
+
+
+# NOTE: doctor id -> AvailabilityIndex, the ttl bounds the drift between processes
+indexes = LRUCache(max_size=1024, ttl=SCHEDULING.get("INDEX_TTL", 60))
+
+
+def start_of_day(time):
+    day = timezone.localtime(time).date()
+    return timezone.make_aware(
+        datetime.datetime.combine(day, datetime.time()),
+        timezone.get_current_timezone(),
+    )
+
+
+def build_index(opd):
+    # NOTE: from midnight, the bookings of the morning count for the daily capacity
+    start = start_of_day(timezone.now())
+    end = start + datetime.timedelta(days=HORIZON_DAYS)
+    booked = Appointment.objects.filter(
+        doctor_id=opd.doctor_profile_id, date_time__gte=start, date_time__lt=end
+    ).values_list("date_time", flat=True)
+    return AvailabilityIndex(Schedule(opd), start, end, list(booked))
+
+
+def get_index(opd):
+    index = indexes.get(opd.doctor_profile_id)
+    if index is None or index.end - timezone.now() < datetime.timedelta(days=1):
+        index = build_index(opd)
+        indexes.set(opd.doctor_profile_id, index)
+    return index
+
+
+def next_free_slots(opd, count=10):
+    return get_index(opd).next_free(timezone.now(), count)
+
+
+"""
+the signals record their changes in index_updates, which applies them to the
+cached index once the transaction commits. a FORGET drops the cached index of
+the doctor, it is rebuilt on the next read.
+"""
+FORGET = "forget"
+
+
+def apply_index_deltas(doctor_id, deltas):
+    if deltas.pop(FORGET, 0):
+        indexes.pop(doctor_id)
+        return
+
+    index = indexes.get(doctor_id)
+    if index is not None:
+        for time, delta in deltas.items():
+            index.add(time, delta)
+
+
+index_updates = DeltaBuffer(apply_index_deltas, transactional=False)
+
+
+def book_appointment(opd, name, start):
+    if start < timezone.now():
+        raise SlotUnavailable("slot is in the past")
+
+    day_start = start_of_day(start)
+    day_end = day_start + datetime.timedelta(days=1)
+
+    with transaction.atomic():
+        # NOTE: the row lock serializes the bookings of an opd, on sqlite the
+        # BEGIN IMMEDIATE of the transaction already holds the write lock
+        opd = Opd.objects.select_for_update().get(pk=opd.pk)
+        schedule = Schedule(opd)
+        if not schedule.is_slot(start):
+            raise SlotUnavailable("opd is not open at that time")
+
+        appointments = Appointment.objects.filter(doctor_id=opd.doctor_profile_id)
+
+        if appointments.filter(date_time=start).count() >= schedule.slot_capacity:
+            raise SlotUnavailable("slot is full")
+        if schedule.daily_capacity is not None:
+            booked_today = appointments.filter(
+                date_time__gte=day_start, date_time__lt=day_end
+            ).count()
+            if booked_today >= schedule.daily_capacity:
+                raise SlotUnavailable("opd is fully booked that day")
+
+        return Appointment.objects.create(
+            doctor_id=opd.doctor_profile_id, name=name, date_time=start
+        )
@@ -0,0 +1,68 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from opd.models import Patient
+
+
+"""
+full text search of the patients of a doctor.
+
+on sqlite the search runs on the opd_patient_fts FTS5 table created in
+migration 0005. the table is kept in sync by triggers on opd_patient and
+opd_medicaldata, so bulk_create() and queryset updates are indexed as well.
+the doctor is stored as a token ("d<id>") so the scoping to the logged in
+doctor happens inside the index and not after the match.
+"""
+
+FTS_TABLE = "opd_patient_fts"
+SEARCH_COLUMNS = "{first_name last_name email medical_history}"
+# NOTE: bm25 weights for doctor, first_name, last_name, email, medical_history
+RANK = f"bm25({FTS_TABLE}, 0.0, 10.0, 10.0, 5.0, 1.0)"
+
+TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match(doctor_id, text):
+    terms = TERM.findall(text)
+    if not terms:
+        return None
+    # NOTE: every term is quoted, so the user can not inject FTS5 operators
+    prefixes = " ".join(f'"{term}"*' for term in terms)
+    return f'doctor : "d{doctor_id}" AND {SEARCH_COLUMNS} : ({prefixes})'
+
+
+def search_patient_ids(doctor_id, text, limit=20):
+    if connection.vendor != "sqlite":
+        return fallback_search_ids(doctor_id, text, limit)
+
+    match = build_match(doctor_id, text)
+    if match is None:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY {RANK} LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fallback_search_ids(doctor_id, text, limit):
+    condition = Q()
+    for term in TERM.findall(text):
+        condition &= (
+            Q(first_name__icontains=term)
+            | Q(last_name__icontains=term)
+            | Q(email__icontains=term)
+            | Q(medical_data__medical_history__icontains=term)
+        )
+    if not condition:
+        return []
+    return list(
+        Patient.objects.filter(condition, doctor_id=doctor_id).values_list(
+            "id", flat=True
+        )[:limit]
+    )
@@ -1,57 +1,56 @@
-from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from django.db import transaction, models
+from django.db import transaction
 from django.contrib.auth.models import Group, User
-from rest_framework.authtoken.models import Token
-from rest_framework.exceptions import status
-from rest_framework.serializers import ValidationError
 
-from opd.models import Address, Appointment, Doctor, Inventory, Opd, Patient
+from opd.api.response_cache import invalidate_responses
+from opd.broker import broker, occupancy_snapshot, opd_channel
+from opd.counters import count_by_doctor, opd_counters
+from opd.images import schedule_variants
+from opd.metrics import install_query_recorder
+from opd.models import (
+    Address,
+    Appointment,
+    Doctor,
+    Opd,
+    Patient,
+    post_bulk_create,
+)
+from opd.onboarding import clear_doctor_group_cache, complete_onboarding
+from opd.rollups import (
+    APPOINTMENT_STATE,
+    add_deltas,
+    appointment_deltas,
+    appointment_state,
+    patient_deltas,
+)
+from opd.scheduling import FORGET, index_updates
 
 
-@receiver(post_save, sender=User)
-def create_token_and_add_group(sender, created, instance, **kwargs):
-    if created:
-        Token.objects.create(user=instance)
-        group = Group.objects.get(name="Doctor")
-        instance.groups.add(group)
+"""
+the user, token, group, address, doctor, opd and inventory of a new doctor are
+created by opd.onboarding in one transaction, not by post_save handlers.
+"""
 
 
 @receiver(post_save, sender=User)
-def create_doctor_object(sender, created, instance, **kwargs):
-    if created:
-        address = Address.objects.create(
-            house_number="Not Specified",
-            street_name="Not Specified",
-            city="Not Specified",
-            state="Not Specified",
-            pincode="Not Specified",
-        )
-        Doctor.objects.create(
-            user=instance,
-            name="Not Specified",
-            speciality="Not Specified",
-            phone_number="000-000-0000",
-            about="Not Specified",
-            education="Not Specified",
-            address=address,
-        )
+def onboard_created_user(sender, created, instance, raw=False, **kwargs):
+    # NOTE: the users of admin, createsuperuser or create_user get the rest of
+    # the profile too, onboard_doctor() does it itself
+    if created and not raw and not getattr(instance, "onboarding", False):
+        complete_onboarding(instance)
 
 
-@receiver(post_save, sender=Doctor)
-def create_opd_object(sender, created, instance, **kwargs):
-    if created:
-        Opd.objects.create(
-            doctor_profile=instance,
-            name="Not Specified",
-            days_of_operation="Not Specified",
-        )
+@receiver(connection_created)
+def record_connection_queries(sender, connection, **kwargs):
+    # NOTE: counts the queries and their time for opd/middleware.py
+    install_query_recorder(connection)
 
 
-@receiver(post_save, sender=Doctor)
-def create_opd_inventory(sender, created, instance, **kwargs):
-    if created:
-        Inventory.objects.create(doctor=instance)
+@receiver(post_delete, sender=Group)
+def clear_cached_doctor_group(sender, instance, **kwargs):
+    clear_doctor_group_cache()
 
 
 @receiver(pre_delete, sender=User)
@@ -71,71 +70,206 @@ def delete_related_object(sender, instance, **kwargs):
         print(f"Some error occurs {e}")
 
 
+"""
+the opd counters are batched per transaction by opd.counters, see the module
+docstring there. queryset.delete() still sends post_delete for every row and
+bulk_create() sends post_bulk_create.
+"""
+
+
 @receiver(post_save, sender=Appointment)
 def opd_appointment_increment(sender, created, instance, **kwargs):
     if created:
-        try:
-            with transaction.atomic():
-                try:
-                    doctor = instance.doctor
-                    opd = Opd.objects.get(doctor_profile=doctor)
-                    opd.no_of_appointment = models.F("no_of_appointment") + 1
-                    opd.save()
-
-                except Doctor.DoesNotExist:
-                    raise ValidationError("Doctor does not exist")
-
-        except Exception as e:
-            print(f"some error occurs {e}")
+        opd_counters.add(instance.doctor_id, no_of_appointment=1)
 
 
 @receiver(post_delete, sender=Appointment)
 def opd_appointment_decrement(sender, instance, **kwargs):
-    try:
-        with transaction.atomic():
-            try:
-                doctor = instance.doctor
-                opd = Opd.objects.get(doctor_profile=doctor)
-                opd.no_of_appointment = models.F("no_of_appointment") - 1
-                opd.save()
+    opd_counters.add(instance.doctor_id, no_of_appointment=-1)
 
-            except Doctor.DoesNotExist:
-                raise ValidationError("Doctor does not exist")
 
-    except Exception as e:
-        print(f"some error occurs {e}")
+@receiver(post_bulk_create, sender=Appointment)
+def opd_appointment_bulk_increment(sender, instances, **kwargs):
+    for doctor_id, count in count_by_doctor(instances).items():
+        opd_counters.add(doctor_id, no_of_appointment=count)
 
 
 @receiver(post_save, sender=Patient)
 def opd_active_patient_increment(sender, created, instance, **kwargs):
     if created:
-        try:
-            with transaction.atomic():
-                try:
-                    doctor = instance.doctor
-                    opd = Opd.objects.get(doctor_profile=doctor)
-                    opd.active_patient = models.F("active_patient") + 1
-                    opd.save()
+        opd_counters.add(instance.doctor_id, active_patient=1)
+
+
+@receiver(post_delete, sender=Patient)
+def opd_active_patient_decrement(sender, instance, **kwargs):
+    opd_counters.add(instance.doctor_id, active_patient=-1)
+
+
+@receiver(post_bulk_create, sender=Patient)
+def opd_active_patient_bulk_increment(sender, instances, **kwargs):
+    for doctor_id, count in count_by_doctor(instances).items():
+        opd_counters.add(doctor_id, active_patient=count)
+
+
+"""
+keep the in-memory availability index of opd.scheduling in step with the
+appointments. a changed appointment (or opd schedule) drops the index.
+"""
+
+
+@receiver(post_save, sender=Appointment)
+def availability_appointment_saved(sender, created, instance, **kwargs):
+    change = {instance.date_time: 1} if created else {FORGET: 1}
+    index_updates.add_many(instance.doctor_id, change)
+
+
+@receiver(post_delete, sender=Appointment)
+def availability_appointment_deleted(sender, instance, **kwargs):
+    index_updates.add_many(instance.doctor_id, {instance.date_time: -1})
+
+
+@receiver(post_bulk_create, sender=Appointment)
+def availability_appointment_bulk_created(sender, instances, **kwargs):
+    for instance in instances:
+        index_updates.add_many(instance.doctor_id, {instance.date_time: 1})
+
+
+@receiver(post_save, sender=Opd)
+def availability_schedule_changed(sender, instance, **kwargs):
+    index_updates.add_many(instance.doctor_profile_id, {FORGET: 1})
+
+
+@receiver(post_save, sender=Opd)
+def occupancy_schedule_changed(sender, instance, **kwargs):
+    # NOTE: e.g. a new max_patient_capacity, the screens get a fresh snapshot
+    message = {"type": "snapshot", **occupancy_snapshot(instance)}
+    transaction.on_commit(
+        lambda: broker.publish(opd_channel(instance.doctor_profile_id), message)
+    )
+
+
+"""
+drop the cached doctor/ and doctor/opd/ responses (opd.api.response_cache)
+when their data changes. the appointments and patients only change the opd
+response through its counters, so their updates do not drop anything.
+"""
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def response_cache_doctor_changed(sender, instance, **kwargs):
+    invalidate_responses(instance.pk, "doctor")
 
-                except Doctor.DoesNotExist:
-                    raise ValidationError("Doctor does not exist")
 
-        except Exception as e:
-            print(f"some error occurs {e}")
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+def response_cache_address_changed(sender, instance, **kwargs):
+    # NOTE: most addresses belong to patients, the lookup is on a unique column
+    for doctor_id in Doctor.objects.filter(address_id=instance.pk).values_list(
+        "id", flat=True
+    ):
+        invalidate_responses(doctor_id, "doctor")
 
 
+@receiver(post_save, sender=Opd)
+@receiver(post_delete, sender=Opd)
+def response_cache_opd_changed(sender, instance, **kwargs):
+    invalidate_responses(instance.doctor_profile_id, "opd")
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=Patient)
+def response_cache_counted_saved(sender, created, instance, **kwargs):
+    if created:
+        invalidate_responses(instance.doctor_id, "opd")
+
+
+@receiver(post_delete, sender=Appointment)
 @receiver(post_delete, sender=Patient)
-def opd_active_patient_decrement(sender, instance, **kwargs):
-    try:
-        with transaction.atomic():
-            try:
-                doctor = instance.doctor
-                opd = Opd.objects.get(doctor_profile=doctor)
-                opd.active_patient = models.F("active_patient") - 1
-                opd.save()
+def response_cache_counted_deleted(sender, instance, **kwargs):
+    invalidate_responses(instance.doctor_id, "opd")
 
-            except Doctor.DoesNotExist:
-                raise ValidationError("Doctor does not exist")
 
-    except Exception as e:
-        print(f"some error occurs {e}")
+@receiver(post_bulk_create, sender=Appointment)
+@receiver(post_bulk_create, sender=Patient)
+def response_cache_counted_bulk_created(sender, instances, **kwargs):
+    for doctor_id in count_by_doctor(instances):
+        invalidate_responses(doctor_id, "opd")
+
+
+@receiver(post_save, sender=Doctor)
+def profile_image_changed(sender, instance, **kwargs):
+    image = instance.profile_image
+    default = Doctor._meta.get_field("profile_image").get_default()
+    if image and image.name != default:
+        if instance.image_variants.get("source") != image.name:
+            schedule_variants(instance.pk)
+
+
+"""
+the daily rollups of opd.rollups. an appointment that changes doctor, day or
+active state moves from its old key to the new one, the old state is read in
+pre_save: a save() without update_fields (or with one of APPOINTMENT_STATE)
+of an existing appointment costs one more SELECT by primary key.
+"""
+
+# NOTE: update_fields may name the foreign key or its column
+STATE_FIELDS = {*APPOINTMENT_STATE, "doctor"}
+
+
+@receiver(pre_save, sender=Appointment)
+def rollup_appointment_previous_state(sender, instance, update_fields, **kwargs):
+    instance._rollup_state = None
+    if instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & STATE_FIELDS:
+        return
+    instance._rollup_state = (
+        Appointment.objects.filter(pk=instance.pk)
+        .values_list(*APPOINTMENT_STATE)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Appointment)
+def rollup_appointment_saved(sender, instance, created, **kwargs):
+    state = appointment_state(instance)
+    previous = None if created else getattr(instance, "_rollup_state", None)
+    if previous == state:
+        return
+
+    entries = [appointment_deltas(state, 1)]
+    if previous is not None:
+        entries.append(appointment_deltas(previous, -1))
+    add_deltas(entries)
+
+
+@receiver(post_delete, sender=Appointment)
+def rollup_appointment_deleted(sender, instance, **kwargs):
+    add_deltas([appointment_deltas(appointment_state(instance), -1)])
+
+
+@receiver(post_bulk_create, sender=Appointment)
+def rollup_appointment_bulk_created(sender, instances, **kwargs):
+    add_deltas(
+        appointment_deltas(appointment_state(instance), 1) for instance in instances
+    )
+
+
+@receiver(post_save, sender=Patient)
+def rollup_patient_created(sender, instance, created, **kwargs):
+    if created:
+        add_deltas([patient_deltas(instance.doctor_id, instance.created_at, 1)])
+
+
+@receiver(post_delete, sender=Patient)
+def rollup_patient_deleted(sender, instance, **kwargs):
+    add_deltas([patient_deltas(instance.doctor_id, instance.created_at, -1)])
+
+
+@receiver(post_bulk_create, sender=Patient)
+def rollup_patient_bulk_created(sender, instances, **kwargs):
+    add_deltas(
+        patient_deltas(instance.doctor_id, instance.created_at, 1)
+        for instance in instances
+    )
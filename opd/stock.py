@@ -0,0 +1,124 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from opd.counters import write_lock
+from opd.models import InventoryItem, StockMovement
+
+
+"""
+stock movements of the inventory items.
+
+move_stock() takes many (item id, quantity) pairs and applies them in one
+transaction, every item with a single conditional UPDATE:
+
+    UPDATE opd_inventoryitem SET item_quantity = item_quantity - 3
+    WHERE id = 7 AND inventory_id = 2 AND item_quantity >= 3
+
+the database reads and writes the quantity in the same statement, so two
+nurses dispensing from one item both get counted, where two PUTs of the
+whole item keep only the last one. when an item of the batch has not enough
+stock nothing is applied and InsufficientStock lists the shortages. an item
+deleted since the request was validated raises UnknownItems instead.
+
+every applied change is appended to the StockMovement ledger with the
+quantity it left, the PUTs of the viewset and the changes made in the admin
+as "adjust" movements. InventoryItem.objects.bulk_create() and
+queryset.update() write no movement: the code that uses them (the benchmarks,
+the fixtures) must record its own or live with a ledger that starts later.
+"""
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        super().__init__("not enough stock")
+        # NOTE: [{"item", "requested", "available"}]
+        self.shortages = shortages
+
+
+class UnknownItems(Exception):
+    def __init__(self, items):
+        super().__init__(f"items {items} are not in the inventory")
+        self.items = items
+
+
+def merge_movements(movements):
+    # NOTE: one UPDATE per item, taken in id order
+    totals = Counter()
+    for item_id, quantity in movements:
+        totals[item_id] += quantity
+    return sorted(totals.items())
+
+
+def move_stock(inventory, movements, kind, user=None):
+    """
+    movements: [(item id, quantity > 0)] of the items of inventory. kind is
+    StockMovement.CONSUME or StockMovement.RESTOCK. returns the ledger rows.
+    """
+    sign = -1 if kind == StockMovement.CONSUME else 1
+    totals = merge_movements(movements)
+    items = InventoryItem.objects.filter(inventory=inventory)
+    now = timezone.now()
+
+    with write_lock, transaction.atomic():
+        refused = []
+        for item_id, quantity in totals:
+            rows = items.filter(pk=item_id)
+            if sign < 0:
+                rows = rows.filter(item_quantity__gte=quantity)
+            # NOTE: update() skips auto_now, last_updated feeds the conditional GET
+            updated = rows.update(
+                item_quantity=F("item_quantity") + sign * quantity, last_updated=now
+            )
+            if not updated:
+                refused.append((item_id, quantity))
+
+        ids = [item_id for item_id, _ in refused or totals]
+        quantities = dict(items.filter(pk__in=ids).values_list("id", "item_quantity"))
+        # NOTE: raised inside the atomic block, the applied updates roll back
+        unknown = [item_id for item_id in ids if item_id not in quantities]
+        if unknown:
+            raise UnknownItems(unknown)
+        if refused:
+            raise InsufficientStock(
+                [
+                    {
+                        "item": item_id,
+                        "requested": quantity,
+                        "available": quantities[item_id],
+                    }
+                    for item_id, quantity in refused
+                ]
+            )
+
+        return StockMovement.objects.bulk_create(
+            StockMovement(
+                item_id=item_id,
+                kind=kind,
+                delta=sign * quantity,
+                quantity=quantities[item_id],
+                user=user,
+            )
+            for item_id, quantity in totals
+        )
+
+
+def stored_quantity(item_id):
+    # NOTE: to be called in the transaction that overwrites the quantity
+    items = InventoryItem.objects.select_for_update().filter(pk=item_id)
+    return items.values_list("item_quantity", flat=True).first() or 0
+
+
+def record_adjustment(item, previous, user=None):
+    # NOTE: a create or a PUT of the viewset, previous is the quantity it replaced
+    delta = item.item_quantity - previous
+    if delta:
+        StockMovement.objects.create(
+            item=item,
+            kind=StockMovement.ADJUST,
+            delta=delta,
+            quantity=item.item_quantity,
+            user=user,
+        )
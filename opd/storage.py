@@ -0,0 +1,48 @@
+import hashlib
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentHashStorage(FileSystemStorage):
+    """
+    stores a file under the sha256 of its content, "profile/ab/ab12...ef.jpg"
+    instead of "profile/john_9S43r4T.jpg": the same image uploaded twice (or
+    by two doctors) is written once and both rows point at the same name.
+
+    the files are never overwritten, so a name always means the same bytes
+    and the derived variants (opd/images.py) can be cached forever.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        digest = digest.hexdigest()
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+
+        return self.save_as(name, content, max_length)
+
+    def save_as(self, name, content, max_length=None):
+        # NOTE: for files named after a content hashed file, e.g. its variants
+        saved = super().save(name, content, max_length)
+        if saved != name:
+            # NOTE: a concurrent upload of the same image won the race
+            self.delete(saved)
+        return name
+
+
+def profile_image_storage():
+    return ContentHashStorage()
@@ -1,3 +1,1969 @@
-from django.test import TestCase
+import base64
+import contextlib
+import csv
+import datetime
+import json
+import os
+import re
+import tempfile
+import time
+import unittest
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from opd import images, replay, scheduling
+from opd.api import export, response_cache, throttling
+from opd.api.authentication import issue_token
+from opd.api.serializers import PatientSerializer
+from opd.api.views import AppointmentViewSet, InventoryItemViewSet, PatientViewSet
+from opd.broker import broker, opd_channel
+from opd.counters import DeltaBuffer, apply_opd_deltas
+from opd.metrics import Histogram, request_metrics
+from opd.models import (
+    Address,
+    Appointment,
+    DailyRollup,
+    Doctor,
+    InventoryItem,
+    MedicalData,
+    Opd,
+    Patient,
+    StockMovement,
+)
+from opd.onboarding import bulk_onboard_doctors, onboard_doctor
+from opd.rollups import rebuild_rollups
+from opd.search import fallback_search_ids
+from opd.stock import UnknownItems, move_stock
+
+
+def create_doctor(username):
+    user = onboard_doctor(username, f"{username}@example.com", "password")
+    return user.doctor  # type: ignore
+
+
+def create_patients(doctor, count):
+    addresses = Address.objects.bulk_create(
+        Address(street_name="street", city="city", state="state", pincode="123456")
+        for _ in range(count)
+    )
+    medical_data = MedicalData.objects.bulk_create(
+        MedicalData(blood_group="O+", height="170", weight="70", medical_history="-")
+        for _ in range(count)
+    )
+    return Patient.objects.bulk_create(
+        Patient(
+            doctor=doctor,
+            address=address,
+            medical_data=data,
+            first_name=f"first {index}",
+            last_name=f"last {index}",
+            date_of_birth=datetime.date(1990, 1, 1),
+            gender="other",
+            contact="+919876543210",
+            email=f"patient{index}@example.com",
+        )
+        for index, (address, data) in enumerate(zip(addresses, medical_data))
+    )
+
+
+class TokenAuthenticationTest(APITestCase):
+    """
+    the token, the user and the principal come with one query, and a deleted
+    token stops authenticating at once. the counts hold after a logout and a
+    new login, nothing is kept per process between the requests.
+    """
+
+    def setUp(self):
+        caches[response_cache.ALIAS].clear()
+        self.doctor = create_doctor("doctor")
+        self.key = self.doctor.user.auth_token.key
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.key)
+
+    def test_one_query(self):
+        # NOTE: doctor/ is served from the principal, only the auth query runs
+        self.client.get(reverse("opd:doctor"))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("opd:doctor"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout(self):
+        # NOTE: the token of the header, the user and the existing key
+        with self.assertNumQueries(3):
+            response = self.client.post(
+                reverse("opd:login"), {"username": "doctor", "password": "password"}
+            )
+        self.assertEqual(response.data["token"], self.key)
+
+        self.assertEqual(self.client.post(reverse("opd:logout")).status_code, 200)
+        self.assertEqual(self.client.get(reverse("opd:doctor")).status_code, 401)
+
+        # NOTE: the next login issues a new key
+        self.client.credentials()
+        # NOTE: the user, the deleted key, and the get_or_create of the new one
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                reverse("opd:login"), {"username": "doctor", "password": "password"}
+            )
+        self.assertNotEqual(response.data["token"], self.key)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + response.data["token"])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse("opd:doctor")).status_code, 200)
+
+    def test_token_deleted_elsewhere(self):
+        # NOTE: e.g. a logout served by another worker, or the admin
+        Token.objects.filter(user=self.doctor.user).delete()
+        self.assertEqual(self.client.get(reverse("opd:doctor")).status_code, 401)
+
+        key = issue_token(self.doctor.user)
+        self.assertNotEqual(key, self.key)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + key)
+        self.assertEqual(self.client.get(reverse("opd:doctor")).status_code, 200)
+
+    def test_user_deleted(self):
+        self.doctor.user.delete()
+        self.assertEqual(self.client.get(reverse("opd:doctor")).status_code, 401)
+
+
+class OnboardingTest(APITestCase):
+    """
+    every way of creating a user ends with one complete doctor profile.
+    """
+
+    def assertOnboarded(self, user):
+        self.assertTrue(Token.objects.filter(user=user).exists())
+        self.assertTrue(user.groups.filter(name="Doctor").exists())
+        doctor = Doctor.objects.select_related("address", "opd", "inventory").get(
+            user=user
+        )
+        self.assertIsNotNone(doctor.address)
+        self.assertIsNotNone(doctor.opd)
+        self.assertIsNotNone(doctor.inventory)
+
+    def test_onboard_doctor(self):
+        user = onboard_doctor("doctor", "doctor@example.com", "password")
+        self.assertOnboarded(user)
+        self.assertEqual(Doctor.objects.count(), 1)
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_users_created_elsewhere(self):
+        for user in (
+            User.objects.create_user("nurse", "nurse@example.com", "password"),
+            User.objects.create_superuser("admin", "admin@example.com", "admin"),
+        ):
+            self.assertOnboarded(user)
+
+        token = Token.objects.get(user__username="nurse").key
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token)
+        self.assertEqual(self.client.get(reverse("opd:opd")).status_code, 200)
+
+    def test_bulk_onboard_doctors(self):
+        onboard_doctor("taken", "", "password")
+        users, skipped = bulk_onboard_doctors(
+            [
+                {"username": "first", "email": "first@example.com", "password": "pw"},
+                {"username": "taken"},
+                {"username": "second"},
+                {"username": "second"},
+            ]
+        )
+        self.assertEqual([user.username for user in users], ["first", "second"])
+        self.assertEqual(skipped, ["taken", "second"])
+        for user in users:
+            self.assertOnboarded(user)
+        self.assertTrue(User.objects.get(username="first").check_password("pw"))
+        self.assertFalse(User.objects.get(username="second").has_usable_password())
+
+    def test_onboard_doctors_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as roster:
+            roster.write("username,email,password\nfirst,,pw\nsecond,,\n")
+        self.addCleanup(os.remove, roster.name)
+
+        stdout = StringIO()
+        call_command("onboard_doctors", roster.name, stdout=stdout)
+        self.assertIn("Onboarded 2 doctor(s)", stdout.getvalue())
+        self.assertEqual(Doctor.objects.count(), 2)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as roster:
+            roster.write("name\nfirst\n")
+        self.addCleanup(os.remove, roster.name)
+        with self.assertRaises(CommandError):
+            call_command("onboard_doctors", roster.name)
+
+
+class OpdCounterTest(APITestCase):
+    """
+    the counter deltas of a transaction are applied once it commits, and are
+    dropped with the rows when it (or a savepoint of it) rolls back.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+
+    def counters(self):
+        return Opd.objects.values("active_patient", "no_of_appointment").get(
+            doctor_profile=self.doctor
+        )
+
+    def test_bulk_create(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                Appointment.objects.bulk_create(
+                    Appointment(doctor=self.doctor, name=f"patient {index}")
+                    for index in range(10)
+                )
+                create_patients(self.doctor, 3)
+        self.assertEqual(
+            self.counters(), {"active_patient": 3, "no_of_appointment": 10}
+        )
+        # NOTE: one UPDATE of the opd for the whole transaction
+        updates = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "opd_opd"')
+        ]
+        self.assertEqual(len(updates), 1)
+
+    def test_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with contextlib.suppress(RuntimeError), transaction.atomic():
+                create_patients(self.doctor, 3)
+                raise RuntimeError
+        self.assertEqual(self.counters()["active_patient"], 0)
+
+    def test_savepoint_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                create_patients(self.doctor, 2)
+                with contextlib.suppress(RuntimeError), transaction.atomic():
+                    create_patients(self.doctor, 3)
+                    raise RuntimeError
+                # NOTE: goes to the batch of the outer block again
+                create_patients(self.doctor, 1)
+        self.assertEqual(self.counters()["active_patient"], 3)
+
+    def test_queryset_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patients(self.doctor, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Patient.objects.exclude(first_name="first 0").delete()
+        self.assertEqual(self.counters()["active_patient"], 1)
+
+    def test_reconcile_opd_counters(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patients(self.doctor, 2)
+            Appointment.objects.create(doctor=self.doctor, name="patient")
+        other = create_doctor("other")
+        Opd.objects.update(active_patient=7, no_of_appointment=0)
+
+        out = StringIO()
+        call_command("reconcile_opd_counters", "--dry-run", stdout=out)
+        self.assertIn("2 OPD(s) have drifted counters", out.getvalue())
+        self.assertEqual(self.counters()["active_patient"], 7)
+
+        out = StringIO()
+        call_command("reconcile_opd_counters", stdout=out)
+        self.assertIn("Reconciled 2 OPD(s)", out.getvalue())
+        self.assertEqual(self.counters(), {"active_patient": 2, "no_of_appointment": 1})
+        other.opd.refresh_from_db()
+        self.assertEqual(other.opd.active_patient, 0)
+
+
+@unittest.skipUnless(settings.SQLITE_TUNED, "the stock sqlite configuration")
+class SqliteTuningTest(APITestCase):
+    """
+    the connections django opens run the SQLITE_PRAGMAS of the settings.
+    """
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma(connection, "busy_timeout"), 5000)
+        # NOTE: 1 is NORMAL
+        self.assertEqual(self.pragma(connection, "synchronous"), 1)
+        self.assertEqual(self.pragma(connection, "temp_store"), 2)
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+    def test_wal(self):
+        # NOTE: the test database lives in memory, WAL needs a file
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {
+                **connection.settings_dict,
+                "NAME": os.path.join(directory, "wal.sqlite3"),
+            }
+            wal = type(connections["default"])(settings_dict, alias="wal")
+            try:
+                self.assertEqual(self.pragma(wal, "journal_mode"), "wal")
+            finally:
+                wal.close()
+
+
+class KeysetPaginationTest(APITestCase):
+    """
+    the cursors walk the lists without gaps or repeats on tied timestamps,
+    and a cursor changed by the client is a 404.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+        date_time = datetime.datetime(2026, 3, 2, 9, tzinfo=datetime.timezone.utc)
+        Appointment.objects.bulk_create(
+            # NOTE: pairs of appointments at the same time
+            Appointment(
+                doctor=self.doctor,
+                name=f"patient {index}",
+                date_time=date_time + datetime.timedelta(hours=index // 2),
+            )
+            for index in range(7)
+        )
+        create_patients(self.doctor, 5)
+        Patient.objects.update(created_at=date_time)
+
+    def walk(self, url, params):
+        pages, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([row["id"] for row in response.data["results"]])
+            if response.data["next"] is None:
+                return pages, response
+            response = self.client.get(response.data["next"])
+
+    def test_ties(self):
+        url = reverse("opd:appointment-list")
+        pages, last = self.walk(url, {"page_size": 2})
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        expected = list(
+            Appointment.objects.order_by("-date_time", "-id").values_list(
+                "id", flat=True
+            )
+        )
+        self.assertEqual(sum(pages, []), expected)
+
+        # NOTE: back from the last page
+        previous = self.client.get(last.data["previous"])
+        self.assertEqual([row["id"] for row in previous.data["results"]], pages[-2])
+        self.assertEqual(previous.data["next"].count("cursor="), 1)
+
+        pages, _ = self.walk(reverse("opd:patient-list"), {"page_size": 2})
+        expected = list(Patient.objects.order_by("-id").values_list("id", flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_first_page(self):
+        response = self.client.get(reverse("opd:appointment-list"))
+        self.assertIsNone(response.data["next"])
+        self.assertIsNone(response.data["previous"])
+        self.assertEqual(len(response.data["results"]), 7)
+
+    def test_invalid_cursor(self):
+        url = reverse("opd:appointment-list")
+        cursors = [
+            "not base64!",
+            base64.urlsafe_b64encode(b"[1, 2]").decode(),
+        ] + [
+            base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            for payload in (
+                {"p": ["abc", "x"], "r": 0},
+                {"p": [None, None], "r": 0},
+                {"p": [[1], {}], "r": 0},
+                {"p": "ab", "r": 0},
+                {"p": ["2026-03-02T09:00:00+00:00", 10**30], "r": 0},
+                {"p": ["2026-03-02T09:00:00+00:00"], "r": 0},
+            )
+        ]
+        for cursor in cursors:
+            response = self.client.get(url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data["detail"], "Invalid cursor")
+
+
+class PatientQueryBudgetTest(APITestCase):
+    """
+    the nested address and medical_data must not cost a query per patient.
+    auth is one query and the patient page (or object) is one more, the list
+    also runs the MAX/COUNT of its conditional GET validators.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def assertBudget(self, count):
+        patients = create_patients(self.doctor, count)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse("opd:patient-list"), {"page_size": count}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), min(count, 500))
+        self.assertIsNotNone(response.data["results"][0]["address"])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("opd:patient-detail", args=[patients[-1].pk])
+            )
+        self.assertEqual(response.status_code, 200)
+
+        # NOTE: the whole queryset, past the page size cap
+        view = PatientViewSet()
+        view.request = response.wsgi_request
+        view.request.doctor = self.doctor  # type: ignore
+        with self.assertNumQueries(1):
+            data = PatientSerializer(view.get_queryset(), many=True).data
+        self.assertEqual(len(data), count)
+
+    def test_one_patient(self):
+        self.assertBudget(1)
+
+    def test_hundred_patients(self):
+        self.assertBudget(100)
+
+    def test_ten_thousand_patients(self):
+        self.assertBudget(10000)
+
+
+class PatientBulkTest(APITestCase):
+    """
+    bulk/ creates the valid rows of the list and reports the others by index.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+        self.url = reverse("opd:patient-bulk")
+
+    def payload(self, index):
+        return {
+            "first_name": f"first {index}",
+            "last_name": f"last {index}",
+            "date_of_birth": "1990-01-01",
+            "gender": "other",
+            "contact": "+919876543210",
+            "email": f"patient{index}@example.com",
+            "address": {
+                "street_name": "street",
+                "city": "city",
+                "state": "state",
+                "pincode": "123456",
+            },
+            "medical_data": {
+                "blood_group": "O+",
+                "height": "170",
+                "weight": "70",
+                "medical_history": "-",
+            },
+        }
+
+    def test_bulk(self):
+        rows = [self.payload(index) for index in range(4)]
+        rows[1]["email"] = "not an email"
+        del rows[3]["address"]
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, rows, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [patient["email"] for patient in response.data["created"]],
+            ["patient0@example.com", "patient2@example.com"],
+        )
+        errors = response.data["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 3])
+        self.assertIn("email", errors[0]["errors"])
+        self.assertIn("address", errors[1]["errors"])
+
+        # NOTE: one bump of the counter for the whole list
+        updates = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "opd_opd"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.doctor.opd.refresh_from_db()
+        self.assertEqual(self.doctor.opd.active_patient, 2)
+        self.assertEqual(Patient.objects.filter(doctor=self.doctor).count(), 2)
+
+    def test_no_valid_row(self):
+        response = self.client.post(self.url, [{"first_name": "x"}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["created"], [])
+        self.assertEqual(response.data["errors"][0]["index"], 0)
+
+    def test_limits(self):
+        response = self.client.post(self.url, self.payload(0), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["error"], "expected a list of patients")
+
+        rows = [{} for _ in range(PatientViewSet.bulk_max_size + 1)]
+        response = self.client.post(self.url, rows, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["error"], "at most 1000 patients per request")
+        self.assertFalse(Patient.objects.exists())
+
+
+class AsyncViewParityTest(APITestCase):
+    """
+    the async views of api/async/ answer byte for byte like their DRF views.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.patients = create_patients(self.doctor, 15)
+        self.appointments = Appointment.objects.bulk_create(
+            Appointment(
+                doctor=self.doctor,
+                name=f"patient {index}",
+                date_time=datetime.datetime(
+                    2026, 3, 2, 9, index, tzinfo=datetime.timezone.utc
+                ),
+                active=index % 2 == 0,
+            )
+            for index in range(15)
+        )
+        self.key = self.doctor.user.auth_token.key
+
+    def assertSameResponse(self, name, args=(), params=None, key=None):
+        key = self.key if key is None else key
+        headers = {"Authorization": f"Token {key}"} if key else {}
+        sync = self.client.get(
+            reverse(f"opd:{name}", args=args), params, headers=headers
+        )
+        response = async_to_sync(self.async_client.get)(
+            reverse(f"opd:async-{name}", args=args), params, headers=headers
+        )
+        self.assertEqual(response.status_code, sync.status_code)
+        # NOTE: the pagination links point to the path that was requested
+        content = response.content.replace(b"/api/async/", b"/api/")
+        self.assertEqual(content, sync.content)
+        return sync
+
+    def test_detail_views(self):
+        self.assertSameResponse("doctor")
+        self.assertSameResponse("opd")
+        self.assertSameResponse("appointment-detail", [self.appointments[0].pk])
+        self.assertSameResponse("patient-detail", [self.patients[0].pk])
+        self.assertSameResponse(
+            "patient-detail", [self.patients[0].pk], {"fields": "id,address"}
+        )
+
+    def test_list_views(self):
+        response = self.assertSameResponse("appointment-list", params={"page_size": 5})
+        self.assertIsNotNone(response.json()["next"])
+        self.assertSameResponse("appointment-list", params={"active": "true"})
+        self.assertSameResponse("patient-list", params={"page_size": 5})
+        self.assertSameResponse(
+            "patient-list", params={"fields": "id,first_name", "ordering": "-id"}
+        )
+
+    def test_errors(self):
+        self.assertSameResponse("patient-detail", [0])
+        self.assertSameResponse("patient-list", key="")
+        self.assertSameResponse("patient-list", key="invalid")
+
+
+class PatientSearchTest(APITestCase):
+    """
+    the FTS5 index follows the patients through the triggers of migration
+    0005, and a doctor only ever finds their own patients.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.other = create_doctor("other")
+        self.kumar = self.add_patient(self.doctor, "Ravi", "Kumar", "-")
+        self.history = self.add_patient(self.doctor, "Anil", "Mehta", "kumar rash")
+        self.add_patient(self.other, "Ravi", "Kumar", "-")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def add_patient(self, doctor, first_name, last_name, medical_history):
+        return Patient.objects.create(
+            doctor=doctor,
+            address=Address.objects.create(
+                street_name="street", city="city", state="state", pincode="123456"
+            ),
+            medical_data=MedicalData.objects.create(
+                blood_group="O+",
+                height="170",
+                weight="70",
+                medical_history=medical_history,
+            ),
+            first_name=first_name,
+            last_name=last_name,
+            date_of_birth=datetime.date(1990, 1, 1),
+            gender="other",
+            contact="+919876543210",
+            email=f"patient{Patient.objects.count()}@example.com",
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse("opd:patient-search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.data["results"]]
+
+    def test_ranking_and_scoping(self):
+        # NOTE: a name outranks the medical history, the other doctor's Kumar is
+        # never returned
+        self.assertEqual(self.search("kumar"), [self.kumar.pk, self.history.pk])
+        self.assertEqual(self.search("ravi kumar"), [self.kumar.pk])
+        self.assertEqual(
+            fallback_search_ids(self.doctor.pk, "kumar", 20),
+            [self.kumar.pk, self.history.pk],
+        )
+
+    def test_prefix_and_operators(self):
+        self.assertEqual(self.search("kum"), [self.kumar.pk, self.history.pk])
+        self.assertEqual(self.search("meh"), [self.history.pk])
+        # NOTE: OR is a plain term, every term must match
+        self.assertEqual(self.search("ravi OR mehta"), [])
+        self.assertEqual(self.search('ravi" OR "d*'), [])
+        self.assertEqual(self.search("!!"), [])
+
+    def test_triggers(self):
+        self.kumar.first_name = "Sunil"
+        self.kumar.save()
+        self.assertEqual(self.search("ravi"), [])
+        self.assertEqual(self.search("sunil"), [self.kumar.pk])
+
+        medical_data = self.history.medical_data
+        medical_data.medical_history = "migraine"
+        medical_data.save()
+        self.assertEqual(self.search("kumar"), [self.kumar.pk])
+        self.assertEqual(self.search("migraine"), [self.history.pk])
+
+        self.kumar.delete()
+        Patient.objects.filter(pk=self.history.pk).delete()
+        self.assertEqual(self.search("sunil"), [])
+        self.assertEqual(self.search("migraine"), [])
+
+
+class SchedulingTest(APITestCase):
+    """
+    bookings re-check the capacities in the database, the availability index
+    follows them after the commit.
+    """
+
+    def setUp(self):
+        scheduling.indexes.clear()
+        self.doctor = create_doctor("doctor")
+        self.opd = self.doctor.opd
+        self.opd.days_of_operation = "daily"
+        # NOTE: a batch left pending here would take the deltas of the tests
+        with self.captureOnCommitCallbacks(execute=True):
+            self.opd.save()
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        self.first_slot = timezone.make_aware(
+            datetime.datetime.combine(tomorrow, datetime.time(9, 0))
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def book(self, start):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("opd:appointment-book"),
+                {"name": "patient", "slot": start.isoformat()},
+                format="json",
+            )
+
+    def test_parse_days_of_operation(self):
+        parse = scheduling.parse_days_of_operation
+        self.assertEqual(parse("Mon-Fri"), {0, 1, 2, 3, 4})
+        self.assertEqual(parse("Monday, Thursday"), {0, 3})
+        self.assertEqual(parse("Sat-Mon"), {5, 6, 0})
+        self.assertEqual(parse("tue to thu and sun"), {1, 2, 3, 6})
+        self.assertEqual(parse("Daily"), set(range(7)))
+        self.assertEqual(parse("Not Specified"), set())
+
+    def test_slot_taken(self):
+        self.assertEqual(self.book(self.first_slot).status_code, 201)
+        response = self.book(self.first_slot)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["error"], "slot is full")
+
+        self.opd.slot_capacity = 2
+        self.opd.save()
+        self.assertEqual(self.book(self.first_slot).status_code, 201)
+
+        # NOTE: not a slot of the opd
+        odd = self.first_slot + datetime.timedelta(minutes=7)
+        self.assertEqual(self.book(odd).status_code, 409)
+
+    def test_daily_booking_limit(self):
+        # NOTE: the beds do not limit the bookings
+        self.opd.max_patient_capacity = 1
+        self.opd.daily_booking_limit = 2
+        self.opd.save()
+        later = self.first_slot + datetime.timedelta(minutes=15)
+        self.assertEqual(self.book(self.first_slot).status_code, 201)
+        self.assertEqual(self.book(later).status_code, 201)
+        response = self.book(later + datetime.timedelta(minutes=15))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["error"], "opd is fully booked that day")
+
+    def test_availability_index(self):
+        url = reverse("opd:appointment-slots")
+        self.client.get(url, {"count": 1})
+
+        # NOTE: the booking updates the cached index, no rebuild query
+        self.book(self.first_slot)
+        index = scheduling.indexes.get(self.doctor.pk)
+        self.assertEqual(index.available(self.first_slot), 0)
+        with self.assertNumQueries(0):
+            slots = scheduling.next_free_slots(self.opd, 1)
+        self.assertNotIn(self.first_slot, [start for start, _ in slots])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.filter(date_time=self.first_slot).delete()
+        self.assertEqual(index.available(self.first_slot), 1)
+
+        # NOTE: a schedule change drops the index
+        with self.captureOnCommitCallbacks(execute=True):
+            self.opd.slot_capacity = 3
+            self.opd.save()
+        self.assertIsNone(scheduling.indexes.get(self.doctor.pk))
+
+    def test_delta_buffer_fast_path(self):
+        class CountingList(list):
+            scans = 0
+
+            def __iter__(self):
+                CountingList.scans += 1
+                return super().__iter__()
+
+        buffer = DeltaBuffer(mock.Mock(), transactional=False)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                buffer.add(1, count=1)
+                for _ in range(500):
+                    transaction.on_commit(lambda: None)
+                run_on_commit = connection.run_on_commit
+                connection.run_on_commit = CountingList(run_on_commit)
+                try:
+                    for _ in range(99):
+                        buffer.add(1, count=1)
+                    # NOTE: the batch of the previous add() is found without a scan
+                    self.assertEqual(CountingList.scans, 0)
+                finally:
+                    connection.run_on_commit = run_on_commit
+
+        # NOTE: one batch for the whole transaction
+        self.assertEqual(len(callbacks), 501)
+        self.assertEqual(callbacks[0].deltas[1]["count"], 100)
+
+
+class OpdStreamTest(APITestCase):
+    """
+    the stream is opened with a short lived ticket and only served under ASGI,
+    its events carry the counters as stored.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+        self.url = reverse("opd:opd-stream")
+
+    def ticket(self):
+        response = self.client.post(reverse("opd:opd-stream-ticket"))
+        self.assertEqual(response.status_code, 200)
+        return response.data["ticket"]
+
+    async def test_stream(self):
+        ticket = await sync_to_async(self.ticket)()
+        response = await self.async_client.get(self.url, {"ticket": ticket})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        try:
+            first = await anext(response.streaming_content)
+            channel = opd_channel(self.doctor.pk)
+            self.assertEqual(broker.subscriber_count(channel), 1)
+        finally:
+            await response.streaming_content.aclose()
+        name, data = first.decode().strip().split("\n")
+        self.assertEqual(name, "event: snapshot")
+        self.assertEqual(
+            json.loads(data.removeprefix("data: ")),
+            {"active_patient": 0, "no_of_appointment": 0, "max_patient_capacity": 0},
+        )
+
+    async def test_refused_credentials(self):
+        ticket = await sync_to_async(self.ticket)()
+        key = self.doctor.user.auth_token.key
+        for query in ({"token": key}, {"ticket": ticket + "x"}, {}):
+            response = await self.async_client.get(self.url, query)
+            self.assertEqual(response.status_code, 401)
+
+        with mock.patch("opd.api.streams.TICKET_MAX_AGE", -1):
+            response = await self.async_client.get(self.url, {"ticket": ticket})
+        self.assertEqual(response.status_code, 401)
+
+        # NOTE: the header keeps working for the clients that can send it
+        response = await self.async_client.get(
+            self.url, headers={"Authorization": "Token " + key}
+        )
+        self.assertEqual(response.status_code, 200)
+        await response.streaming_content.aclose()
+
+    async def test_ticket_follows_the_token(self):
+        ticket = await sync_to_async(self.ticket)()
+        # NOTE: the EventSource reconnects with the same url
+        for _ in range(2):
+            response = await self.async_client.get(self.url, {"ticket": ticket})
+            self.assertEqual(response.status_code, 200)
+            await response.streaming_content.aclose()
+
+        await Token.objects.filter(user_id=self.doctor.user_id).adelete()
+        response = await self.async_client.get(self.url, {"ticket": ticket})
+        self.assertEqual(response.status_code, 401)
+
+        # NOTE: a new login does not bring the ticket of the old token back
+        await sync_to_async(issue_token)(self.doctor.user)
+        response = await self.async_client.get(self.url, {"ticket": ticket})
+        self.assertEqual(response.status_code, 401)
+
+    def test_wsgi_refused(self):
+        response = self.client.get(self.url, {"ticket": self.ticket()})
+        self.assertEqual(response.status_code, 503)
+
+    def test_ticket_not_logged(self):
+        url = replay.redact_url("/api/doctor/opd/stream/?ticket=abc&q=ravi")
+        self.assertNotIn("abc", url)
+        self.assertNotIn("ravi", url)
+
+    def test_publishes_stored_counters(self):
+        with mock.patch.object(broker, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                apply_opd_deltas(self.doctor.pk, {"active_patient": -1})
+        # NOTE: the clamp kept the counter at zero, the screens must not show -1
+        publish.assert_called_once_with(
+            opd_channel(self.doctor.pk),
+            {
+                "type": "snapshot",
+                "active_patient": 0,
+                "no_of_appointment": 0,
+                "max_patient_capacity": 0,
+            },
+        )
+
+
+class ConditionalGetTest(APITestCase):
+    """
+    a re-fetch with the validators of the previous response is a 304 that
+    only costs the auth and the validators queries.
+    """
+
+    def setUp(self):
+        caches[response_cache.ALIAS].clear()
+        self.doctor = create_doctor("doctor")
+        self.patients = create_patients(self.doctor, 3)
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def assertNotModified(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response)
+        # NOTE: the lists are validated by their ETag only
+        self.assertNotIn("Last-Modified", response)
+
+        with self.assertNumQueries(2):
+            cached = self.client.get(
+                url, params, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached["ETag"], response["ETag"])
+
+        return response["ETag"]
+
+    def test_doctor_and_opd(self):
+        # NOTE: the principal is loaded by the auth query, the object costs nothing
+        for name in ("opd:doctor", "opd:opd"):
+            response = self.client.get(reverse(name))
+            with self.assertNumQueries(1):
+                cached = self.client.get(
+                    reverse(name), HTTP_IF_NONE_MATCH=response["ETag"]
+                )
+            self.assertEqual(cached.status_code, 304)
+
+    def test_list_changes(self):
+        url = reverse("opd:patient-list")
+        etag = self.assertNotModified(url)
+
+        self.patients[0].first_name = "changed"
+        self.patients[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        since = http_date(time.time() + 60)
+        Patient.objects.filter(pk=self.patients[1].pk).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # NOTE: the delete leaves MAX(last_updated) where it was
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_object_last_modified(self):
+        url = reverse("opd:patient-detail", args=[self.patients[0].pk])
+        response = self.client.get(url)
+        cached = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(cached.status_code, 304)
+
+    def test_list_parameters(self):
+        url = reverse("opd:patient-list")
+        etag = self.assertNotModified(url, {"page_size": 1})
+        response = self.client.get(url, {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheTest(APITestCase):
+    """
+    the cached doctor/ and doctor/opd/ responses are dropped when the
+    transaction that changed their data commits.
+    """
+
+    def setUp(self):
+        caches[response_cache.ALIAS].clear()
+        response_cache.reset_response_cache_stats()
+        self.doctor = create_doctor("doctor")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def get(self, name, outcome):
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Cache"], outcome)
+        return response
+
+    def test_hit(self):
+        first = self.get("opd:opd", "MISS")
+        second = self.get("opd:opd", "HIT")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+        response = self.client.get(
+            reverse("opd:opd"), HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(
+            response_cache.response_cache_stats(), {"opd": {"hits": 2, "misses": 1}}
+        )
+
+    def test_invalidated_by_counters(self):
+        self.get("opd:opd", "MISS")
+        self.get("opd:doctor", "MISS")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patients(self.doctor, 2)
+        response = self.get("opd:opd", "MISS")
+        self.assertEqual(response.data["active_patient"], 2)
+        # NOTE: the doctor response does not depend on the patients
+        self.get("opd:doctor", "HIT")
+
+    def test_invalidated_by_address(self):
+        self.get("opd:doctor", "MISS")
+        with self.captureOnCommitCallbacks(execute=True):
+            address = self.doctor.address
+            address.city = "Pune"
+            address.save()
+        response = self.get("opd:doctor", "MISS")
+        self.assertEqual(response.data["address"]["city"], "Pune")
+
+    def test_uncommitted_change_keeps_the_entry(self):
+        self.get("opd:doctor", "MISS")
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.doctor.name = "changed"
+            self.doctor.save()
+        self.assertEqual(len(callbacks), 1)
+        self.get("opd:doctor", "HIT")
+
+    def test_disabled(self):
+        with mock.patch.object(response_cache, "DISABLED", {"opd"}):
+            first = self.client.get(reverse("opd:opd"))
+            second = self.client.get(reverse("opd:opd"))
+        self.assertNotIn("X-Cache", first)
+        self.assertNotIn("X-Cache", second)
+
+    @override_settings(ALLOWED_HOSTS=["a.example", "b.example"])
+    def test_per_origin(self):
+        first = self.client.get(reverse("opd:doctor"), HTTP_HOST="a.example")
+        self.assertEqual(first["X-Cache"], "MISS")
+        second = self.client.get(reverse("opd:doctor"), HTTP_HOST="b.example")
+        self.assertEqual(second["X-Cache"], "MISS")
+        self.assertTrue(second.data["profile_image"].startswith("http://b.example/"))
+
+        response = self.client.get(
+            reverse("opd:doctor"), HTTP_HOST="a.example", secure=True
+        )
+        self.assertEqual(response["X-Cache"], "MISS")
+        response = self.client.get(reverse("opd:doctor"), HTTP_HOST="a.example")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.content, first.content)
+
+        # NOTE: one invalidation drops the responses of every origin
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.name = "changed"
+            self.doctor.save()
+        for host in ("a.example", "b.example"):
+            response = self.client.get(reverse("opd:doctor"), HTTP_HOST=host)
+            self.assertEqual(response["X-Cache"], "MISS")
+
+    def test_workers(self):
+        with mock.patch.object(response_cache, "WORKERS", 4):
+            warnings = response_cache.check_response_cache(None)
+            self.assertEqual([warning.id for warning in warnings], ["opd.W001"])
+
+            # NOTE: a backend shared by the workers sees every invalidation
+            backend = "django.core.cache.backends.filebased.FileBasedCache"
+            shared = {
+                **settings.CACHES,
+                response_cache.ALIAS: {"BACKEND": backend, "LOCATION": "responses"},
+            }
+            with override_settings(CACHES=shared):
+                self.assertEqual(response_cache.check_response_cache(None), [])
+
+        with mock.patch.object(response_cache, "ENABLED", False):
+            response = self.client.get(reverse("opd:opd"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Cache", response)
+
+class ProfileImageTest(APITestCase):
+    """
+    uploads are stored once per content and the variants are made on commit.
+    """
+
+    def setUp(self):
+        caches[response_cache.ALIAS].clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        eager = mock.patch.object(images, "EAGER", True)
+        eager.start()
+        self.addCleanup(eager.stop)
+
+    def upload(self, doctor, filename):
+        image = BytesIO()
+        Image.new("RGB", (300, 200), "teal").save(image, "JPEG")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + doctor.user.auth_token.key
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse("opd:doctor"),
+                {"profile_image": SimpleUploadedFile(filename, image.getvalue())},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(reverse("opd:doctor")).data
+
+    def test_variants(self):
+        data = self.upload(create_doctor("doctor"), "john.jpg")
+        variants = data["profile_image_variants"]
+        self.assertEqual(set(variants), set(images.SIZES))
+
+        name = variants["thumbnail_64"].split("/", 3)[-1]
+        with Image.open(os.path.join(self.media_root, name)) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ("WEBP", (64, 64)))
+
+    def test_same_image_stored_once(self):
+        first = self.upload(create_doctor("first"), "john.jpg")
+        second = self.upload(create_doctor("second"), "john_9S43r4T.jpg")
+        self.assertEqual(first["profile_image"], second["profile_image"])
+        self.assertEqual(
+            first["profile_image_variants"], second["profile_image_variants"]
+        )
+
+        originals = [
+            name
+            for _, _, names in os.walk(self.media_root)
+            for name in names
+            if name.endswith(".jpg")
+        ]
+        self.assertEqual(len(originals), 1)
+
+
+class ExportTest(APITestCase):
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.patients = create_patients(self.doctor, 3)
+        create_patients(create_doctor("other"), 2)
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def export(self, params=None, **headers):
+        response = self.client.get(reverse("opd:patient-export"), params, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response, content = self.export()
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(
+            [row["id"] for row in rows], [str(patient.pk) for patient in self.patients]
+        )
+        self.assertEqual(rows[0]["address_city"], "city")
+        self.assertEqual(rows[0]["medical_data_blood_group"], "O+")
+        self.assertEqual(rows[0]["contact"], "+919876543210")
+
+    def test_csv_formulas(self):
+        for value in ("=1+1", "+1", "-1", "@SUM(A1)", "\tx", "\rx"):
+            self.assertEqual(export.to_csv_value(value), "'" + value)
+        self.assertEqual(export.to_csv_value(-1), -1)
+
+        patient = self.patients[0]
+        patient.first_name = '=HYPERLINK("http://example.com")'
+        patient.save()
+        MedicalData.objects.filter(pk=patient.medical_data_id).update(
+            medical_history="@SUM(A1)"
+        )
+        _, content = self.export()
+        row = next(csv.DictReader(StringIO(content, newline="")))
+        self.assertEqual(row["first_name"], "'" + patient.first_name)
+        self.assertEqual(row["medical_data_medical_history"], "'@SUM(A1)")
+        # NOTE: the phone numbers are not user text, they keep their "+"
+        self.assertEqual(row["contact"], "+919876543210")
+
+        # NOTE: ndjson is not opened by spreadsheets, it keeps the values
+        _, content = self.export({"output": "ndjson"})
+        record = json.loads(content.splitlines()[0])
+        self.assertEqual(record["first_name"], patient.first_name)
+
+    def test_ndjson(self):
+        for params, headers in (
+            ({"output": "ndjson"}, {}),
+            (None, {"HTTP_ACCEPT": "application/x-ndjson"}),
+        ):
+            response, content = self.export(params, **headers)
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            records = [json.loads(line) for line in content.splitlines()]
+            self.assertEqual(len(records), 3)
+            self.assertIsNone(records[0]["address_house_number"])
+
+    def test_date_range(self):
+        Patient.objects.filter(pk=self.patients[0].pk).update(
+            created_at=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        _, content = self.export({"until": "2021-01-01", "output": "ndjson"})
+        self.assertEqual(
+            [json.loads(line)["id"] for line in content.splitlines()],
+            [self.patients[0].pk],
+        )
+        _, content = self.export({"since": "2021-01-01T00:00:00Z", "output": "ndjson"})
+        self.assertEqual(len(content.splitlines()), 2)
+
+        response = self.client.get(reverse("opd:patient-export"), {"since": "soon"})
+        self.assertEqual(response.status_code, 400)
+
+
+class FastSerializerTest(APITestCase):
+    """
+    the compiled list path must render exactly what the DRF serializers do.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        patients = create_patients(self.doctor, 5)
+        # NOTE: the edge cases: nulls, unicode, blank choices and phone numbers
+        patient = patients[0]
+        patient.address = None
+        patient.medical_data = None
+        patient.first_name = "Ñandú 患者"
+        patient.gender = ""
+        patient.contact = ""
+        patient.save()
+        Address.objects.filter(pk=patients[1].address_id).update(house_number=None)
+        Patient.objects.filter(pk=patients[2].pk).update(contact="12345")
+
+        Appointment.objects.bulk_create(
+            Appointment(
+                doctor=self.doctor, name=f"appointment {index}", active=index % 2
+            )
+            for index in range(5)
+        )
+        InventoryItem.objects.bulk_create(
+            InventoryItem(
+                inventory=self.doctor.inventory,
+                item_name=f"item {index}",
+                item_quantity=index,
+                item_price=index * 1.1,
+            )
+            for index in range(5)
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def assertSameOutput(self, viewset, url, params=None):
+        fast = self.client.get(url, params)
+        with mock.patch.object(viewset, "fast_list", False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_patients(self):
+        url = reverse("opd:patient-list")
+        response = self.assertSameOutput(PatientViewSet, url, {"page_size": 3})
+        self.assertSameOutput(PatientViewSet, response.data["next"])
+        response = self.assertSameOutput(
+            PatientViewSet, url, {"page_size": 2, "ordering": "name"}
+        )
+        self.assertSameOutput(PatientViewSet, response.data["next"])
+
+    def test_appointments(self):
+        url = reverse("opd:appointment-list")
+        self.assertSameOutput(AppointmentViewSet, url)
+        self.assertSameOutput(AppointmentViewSet, url, {"active": "true"})
+
+    def test_inventory(self):
+        self.assertSameOutput(InventoryItemViewSet, reverse("opd:inventory-item-list"))
+
+
+class SparseFieldsTest(APITestCase):
+    """
+    ?fields= and ?expand= narrow the payload and the sql behind it.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.patients = create_patients(self.doctor, 3)
+        Appointment.objects.create(doctor=self.doctor, name="appointment")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        # NOTE: the last query reads the rows, the ones before are auth and etag
+        return response, queries[-1]["sql"]
+
+    def test_patient_list_fields(self):
+        url = reverse("opd:patient-list")
+        response, sql = self.get(url, {"fields": "id,first_name,last_name"})
+        self.assertEqual(
+            list(response.data["results"][0]), ["id", "first_name", "last_name"]
+        )
+        self.assertNotIn("JOIN", sql)
+        self.assertNotIn("email", sql)
+
+        response, sql = self.get(url, {"fields": "id,address.city"})
+        self.assertEqual(response.data["results"][0]["address"], {"city": "city"})
+        self.assertEqual(sql.count("JOIN"), 1)
+        self.assertNotIn("street_name", sql)
+
+    def test_patient_detail_fields(self):
+        url = reverse("opd:patient-detail", args=[self.patients[0].pk])
+        response, sql = self.get(url, {"fields": "first_name,medical_data"})
+        self.assertEqual(list(response.data), ["first_name", "medical_data"])
+        self.assertEqual(response.data["medical_data"]["blood_group"], "O+")
+        self.assertEqual(sql.count("JOIN"), 1)
+        self.assertNotIn("street_name", sql)
+
+    def test_expand(self):
+        url = reverse("opd:appointment-list")
+        response, sql = self.get(url, {"fields": "name", "expand": "doctor"})
+        doctor = response.data["results"][0]["doctor"]
+        self.assertEqual(doctor["id"], self.doctor.pk)
+        self.assertIn("JOIN", sql)
+
+        with mock.patch.object(AppointmentViewSet, "fast_list", False):
+            slow = self.client.get(url, {"fields": "name", "expand": "doctor"})
+        self.assertEqual(response.content, slow.content)
+
+    def test_unknown_names(self):
+        url = reverse("opd:patient-list")
+        self.assertEqual(self.client.get(url, {"fields": "password"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"expand": "address"}).status_code, 400)
+
+    def test_writes_ignore_fields(self):
+        url = reverse("opd:appointment-list") + "?fields=id"
+        response = self.client.post(url, {"name": "walk in"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["name"], "walk in")
+
+    def test_cached_detail_is_not_sparse(self):
+        url = reverse("opd:doctor")
+        self.client.get(url)
+        response = self.client.get(url, {"fields": "name"})
+        self.assertEqual(list(response.data), ["name"])
+        self.assertNotIn("X-Cache", response)
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        request_metrics.reset()
+        self.doctor = create_doctor("doctor")
+        create_patients(self.doctor, 3)
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def test_histogram_error_bound(self):
+        histogram = Histogram()
+        values = list(range(1, 200001))
+        for value in values:
+            histogram.record(value)
+        for fraction in (0.5, 0.9, 0.99, 0.999):
+            exact = values[int(fraction * len(values)) - 1]
+            self.assertAlmostEqual(
+                histogram.percentile(fraction), exact, delta=exact / 64
+            )
+        self.assertEqual(histogram.percentile(1), 200000)
+
+    def test_server_timing(self):
+        url = reverse("opd:patient-list")
+        # NOTE: the doctors are not staff
+        with mock.patch("opd.middleware.SERVER_TIMING", "staff"):
+            self.assertNotIn("Server-Timing", self.client.get(url))
+        with mock.patch("opd.middleware.SERVER_TIMING", False):
+            self.assertNotIn("Server-Timing", self.client.get(url))
+        with mock.patch("opd.middleware.SERVER_TIMING", True):
+            timing = self.client.get(url)["Server-Timing"]
+        self.assertIn('desc="3 queries"', timing)
+        self.assertRegex(timing, r"serializer;dur=[\d.]+, total;dur=[\d.]+")
+
+        admin = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + admin.auth_token.key)
+        with mock.patch("opd.middleware.SERVER_TIMING", "staff"):
+            response = self.client.get(reverse("opd:metrics"))
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    def test_metrics(self):
+        self.client.get(reverse("opd:patient-list"))
+        url = reverse("opd:metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        admin = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + admin.auth_token.key)
+        metrics = self.client.get(url).data["requests"]
+        patients = metrics["opd:patient-list"]
+        self.assertEqual(patients["statuses"], {"2xx": 1})
+        self.assertEqual(patients["queries"]["max"], 3)
+        self.assertGreater(patients["latency_ms"]["p99"], 0)
+        self.assertEqual(metrics["opd:metrics"]["statuses"], {"4xx": 1})
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertNotIn("opd:patient-list", self.client.get(url).data["requests"])
+
+
+class TrafficRecorderTest(APITestCase):
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "traffic.jsonl")
+
+    def test_record_and_read_back(self):
+        with mock.patch.dict(replay.TRAFFIC_LOG, {"PATH": self.path}):
+            self.client.post(
+                reverse("opd:login"),
+                {"username": "doctor", "password": "password"},
+                format="json",
+            )
+            self.client.credentials(
+                HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+            )
+            self.client.get(reverse("opd:patient-list"), {"page_size": 5})
+            self.client.get(reverse("opd:patient-search"), {"q": "Sharma"})
+            self.client.post(
+                reverse("opd:patient-list"),
+                {
+                    "first_name": "Asha",
+                    "last_name": "Sharma",
+                    "date_of_birth": "1985-04-12",
+                    "gender": "female",
+                    "contact": "+919812345678",
+                    "email": "asha@example.com",
+                    "address": {
+                        "street_name": "MG Road",
+                        "city": "Pune",
+                        "state": "Maharashtra",
+                        "pincode": "411001",
+                    },
+                    "medical_data": {
+                        "blood_group": "O+",
+                        "height": "160",
+                        "weight": "55",
+                        "medical_history": "asthma",
+                    },
+                },
+                format="json",
+            )
+
+        with open(self.path) as file:
+            log = file.read()
+        self.assertIn('"password": "<password>"', log)
+        for secret in ("Asha", "Sharma", "asthma", "Pune", "MG Road", "9812345678"):
+            self.assertNotIn(secret, log)
+
+        login, patients, search, created = replay.read_log(self.path)
+        self.assertEqual(login["method"], "POST")
+        self.assertIsNone(login["token"])
+        # NOTE: the username is the alias of the doctor, seeded by the replay
+        alias = f"user{self.doctor.user.pk}"
+        self.assertEqual(
+            replay.unredact(login["body"], "secret"),
+            {"username": alias, "password": "secret"},
+        )
+        self.assertEqual(replay.log_aliases([login, patients]), [alias])
+        self.assertEqual(patients["url"], "/api/doctor/patient/?page_size=5")
+        self.assertEqual(patients["token"], alias)
+        self.assertIsNone(patients["body"])
+        # NOTE: the login and the requests after it are one client, replayed
+        # in order on one thread
+        for entry in (login, patients, search, created):
+            self.assertEqual(replay.entry_client(entry["token"], entry["body"]), alias)
+        self.assertGreaterEqual(patients["think"], 0)
+        self.assertEqual(
+            search["url"], f"/api/doctor/patient/search/?q={replay.pseudonym('Sharma')}"
+        )
+
+        # NOTE: the pseudonyms still make a valid patient
+        self.assertEqual(created["body"]["last_name"], replay.pseudonym("Sharma"))
+        serializer = PatientSerializer(data=created["body"])
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+
+@override_settings(ALLOWED_HOSTS=["localhost", "testserver"])
+class ReplayTrafficTest(TransactionTestCase):
+    """
+    the sample log replays against a seeded database, the recorded logins
+    included. the command runs on the test database instead of its own.
+    """
+
+    def setUp(self):
+        throttling.buckets.clear()
+
+    def test_replay(self):
+        stdout = StringIO()
+        with mock.patch(
+            "opd.management.commands.replay_traffic.benchmark_database",
+            contextlib.nullcontext,
+        ):
+            call_command(
+                "replay_traffic",
+                os.path.join(os.path.dirname(__file__), "fixtures", "traffic.jsonl"),
+                "--speed=0",
+                "--rows=3",
+                "--concurrency=1",
+                stdout=stdout,
+            )
+
+        report = stdout.getvalue()
+        self.assertIn("14 requests", report)
+        self.assertRegex(report, r"POST opd:login\s+1\s+200:1")
+        self.assertRegex(report, r"GET opd:patient-list\s+2\s+200:2")
+        self.assertNotRegex(report, r"\b5\d\d:")
+
+
+class LoginThrottleTest(APITestCase):
+    def setUp(self):
+        throttling.buckets.clear()
+        self.doctor = create_doctor("doctor")
+        self.url = reverse("opd:login")
+
+    def login(self, username="doctor", password="password"):
+        return self.client.post(
+            self.url, {"username": username, "password": password}, format="json"
+        )
+
+    def test_existing_token_is_returned_without_a_write(self):
+        key = self.doctor.user.auth_token.key
+        self.assertEqual(self.login().data["token"], key)
+        # NOTE: the user of authenticate() and the key, no write
+        with self.assertNumQueries(2):
+            self.assertEqual(self.login().data["token"], key)
+
+    def test_logout_forgets_the_issued_token(self):
+        key = self.login().data["token"]
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + key)
+        self.assertEqual(self.client.post(reverse("opd:logout")).status_code, 200)
+
+        self.client.credentials()
+        new_key = self.login().data["token"]
+        self.assertNotEqual(new_key, key)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + new_key)
+        self.assertEqual(self.client.get(reverse("opd:doctor")).status_code, 200)
+
+    def test_buckets_per_username_and_ip(self):
+        rates = {"login": {"username": "2/minute", "ip": "3/minute"}}
+        with mock.patch.dict(throttling.AUTH_THROTTLE, rates):
+            self.assertEqual(self.login(password="wrong").status_code, 401)
+            self.assertEqual(self.login(password="wrong").status_code, 401)
+            response = self.login("DOCTOR")
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "30")
+
+            self.assertEqual(self.login("other").status_code, 401)
+            self.assertEqual(self.login("someone").status_code, 429)
+
+    def test_forwarded_for_is_not_the_ip(self):
+        rates = {"login": {"ip": "2/minute"}}
+        with mock.patch.dict(throttling.AUTH_THROTTLE, rates):
+            for address in ("10.0.0.1", "10.0.0.2"):
+                self.client.credentials(HTTP_X_FORWARDED_FOR=address)
+                self.assertEqual(self.login(password="wrong").status_code, 401)
+            self.client.credentials(HTTP_X_FORWARDED_FOR="10.0.0.3")
+            self.assertEqual(self.login(password="wrong").status_code, 429)
+
+    def test_rate_without_tokens(self):
+        self.assertEqual(throttling.parse_rate("10/minute"), (10, 10 / 60))
+        for rate in ("0/minute", "-1/hour"):
+            with self.assertRaises(ImproperlyConfigured):
+                throttling.parse_rate(rate)
+
+    def test_bucket_refill(self):
+        buckets = throttling.TokenBuckets(10)
+        limits = [("key", 2, 1 / 30)]
+        with mock.patch.object(throttling.time, "monotonic", return_value=100.0):
+            self.assertEqual(buckets.take(limits), 0)
+            self.assertEqual(buckets.take(limits), 0)
+            self.assertAlmostEqual(buckets.take(limits), 30)
+        with mock.patch.object(throttling.time, "monotonic", return_value=130.0):
+            self.assertEqual(buckets.take(limits), 0)
+
+
+class RollupTest(APITestCase):
+    """
+    the rollups kept by the signals must match a rebuild from the tables.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.day = datetime.datetime(2026, 3, 2, 10, tzinfo=datetime.timezone.utc)
+
+    def rollups(self):
+        # NOTE: a day emptied by the signals keeps its row, a rebuild drops it
+        rollups = DailyRollup.objects.exclude(
+            appointments=0, active_appointments=0, new_patients=0
+        )
+        return sorted(
+            rollups.values_list(
+                "doctor_id",
+                "day",
+                "appointments",
+                "active_appointments",
+                "new_patients",
+            )
+        )
+
+    def assertRebuildMatches(self):
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+        return incremental
+
+    def test_signals_keep_the_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.bulk_create(
+                Appointment(
+                    doctor=self.doctor,
+                    name=f"appointment {index}",
+                    date_time=self.day + datetime.timedelta(days=index % 3),
+                    active=index % 2 == 0,
+                )
+                for index in range(9)
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = Appointment.objects.create(
+                doctor=self.doctor, name="walk in", date_time=self.day
+            )
+        self.assertRebuildMatches()
+
+        # NOTE: a change of state and a move to another day
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.active = True
+            appointment.save()
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.date_time = self.day + datetime.timedelta(days=7)
+            appointment.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.filter(name="appointment 3").delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patients(self.doctor, 3)[0].delete()
+        rows = self.assertRebuildMatches()
+
+        # NOTE: 4 appointments on the first day, one moved and one deleted
+        self.assertEqual(rows[0][1:4], (self.day.date(), 2, 2))
+        self.assertEqual(sum(row[4] for row in rows), 2)
+
+    def test_doctor_change(self):
+        other = create_doctor("other")
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = Appointment.objects.bulk_create(
+                Appointment(doctor=self.doctor, name="patient", date_time=self.day)
+                for _ in range(2)
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            first.doctor = other
+            first.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            second.doctor_id = other.pk
+            second.save(update_fields=["doctor"])
+        rows = self.assertRebuildMatches()
+        self.assertEqual([row[:3] for row in rows], [(other.pk, self.day.date(), 2)])
+
+    def test_analytics(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.bulk_create(
+                Appointment(
+                    doctor=self.doctor,
+                    name="appointment",
+                    date_time=self.day + datetime.timedelta(days=index),
+                    active=index < 2,
+                )
+                for index in range(8)
+            )
+        admin = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.force_authenticate(admin)
+
+        url = reverse("opd:analytics")
+        params = {"since": "2026-03-01", "until": "2026-03-31", "period": "week"}
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params)
+        weeks = response.data["results"]
+        self.assertEqual([week["appointments"] for week in weeks], [7, 1])
+        self.assertEqual(weeks[0]["active_ratio"], round(2 / 7, 4))
+        self.assertEqual(weeks[0]["inactive_appointments"], 5)
+
+        params["period"] = "day"
+        self.assertEqual(len(self.client.get(url, params).data["results"]), 8)
+        self.assertEqual(self.client.get(url, {"period": "year"}).status_code, 400)
+
+
+class InventorySummaryTest(APITestCase):
+    """
+    the summary of an inventory is one aggregate over its items.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def test_empty_inventory(self):
+        response = self.client.get(reverse("opd:inventory-item-summary"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data, {"item_count": 0, "total_quantity": 0, "total_value": 0.0}
+        )
+
+    def test_summary(self):
+        InventoryItem.objects.bulk_create(
+            [
+                InventoryItem(
+                    inventory=self.doctor.inventory,
+                    item_name="gauze",
+                    item_quantity=10,
+                    item_price=2.5,
+                ),
+                InventoryItem(
+                    inventory=self.doctor.inventory,
+                    item_name="saline",
+                    item_quantity=4,
+                    item_price=30,
+                ),
+                InventoryItem(inventory=self.doctor.inventory, item_name="empty"),
+                # NOTE: not of this inventory
+                InventoryItem(
+                    inventory=create_doctor("other").inventory,
+                    item_name="gauze",
+                    item_quantity=100,
+                    item_price=1,
+                ),
+            ]
+        )
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("opd:inventory-item-summary"))
+        self.assertEqual(
+            response.data, {"item_count": 3, "total_quantity": 14, "total_value": 145.0}
+        )
+
+        # NOTE: the items carry the count of their inventory
+        response = self.client.get(reverse("opd:inventory-item-list"))
+        self.assertEqual([item["total_item"] for item in response.data], [3, 3, 3])
+
+
+class StockLedgerTest(APITestCase):
+    """
+    consume/ and restock/ apply a whole batch or nothing, and every change of
+    a quantity lands in the ledger.
+    """
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        self.gauze, self.saline = InventoryItem.objects.bulk_create(
+            InventoryItem(
+                inventory=self.doctor.inventory, item_name=name, item_quantity=10
+            )
+            for name in ("gauze", "saline")
+        )
+        other = create_doctor("other")
+        self.foreign = InventoryItem.objects.create(
+            inventory=other.inventory, item_name="gauze", item_quantity=10
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def quantities(self):
+        return list(
+            InventoryItem.objects.filter(inventory=self.doctor.inventory)
+            .order_by("id")
+            .values_list("item_quantity", flat=True)
+        )
+
+    def post(self, name, *movements):
+        return self.client.post(
+            reverse(f"opd:inventory-item-{name}"),
+            {"movements": [{"item": item.pk, "quantity": n} for item, n in movements]},
+            format="json",
+        )
+
+    def test_consume_and_restock(self):
+        response = self.post(
+            "consume", (self.gauze, 3), (self.saline, 4), (self.gauze, 2)
+        )
+        self.assertEqual(response.status_code, 200)
+        movements = response.data["movements"]
+        self.assertEqual(
+            [(row["item"], row["delta"], row["quantity"]) for row in movements],
+            [(self.gauze.pk, -5, 5), (self.saline.pk, -4, 6)],
+        )
+        self.assertEqual(self.post("restock", (self.saline, 10)).status_code, 200)
+        self.assertEqual(self.quantities(), [5, 16])
+
+        # NOTE: saline has enough, gauze does not, none of them is consumed
+        response = self.post("consume", (self.saline, 1), (self.gauze, 6))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            response.data["shortages"],
+            [{"item": self.gauze.pk, "requested": 6, "available": 5}],
+        )
+        self.assertEqual(self.quantities(), [5, 16])
+        self.assertEqual(StockMovement.objects.count(), 3)
+
+        self.assertEqual(self.post("consume", (self.foreign, 1)).status_code, 400)
+        self.assertEqual(self.post("consume", (self.gauze, 0)).status_code, 400)
+        self.assertEqual(self.post("consume").status_code, 400)
+
+    def test_ledger(self):
+        url = reverse("opd:inventory-item-detail", args=[self.gauze.pk])
+        response = self.client.put(
+            url, {"item_name": "gauze", "item_quantity": 25, "item_price": 1}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.post("consume", (self.gauze, 5))
+
+        response = self.client.get(
+            reverse("opd:inventory-item-movements", args=[self.gauze.pk])
+        )
+        movements = response.data["results"]
+        self.assertEqual(
+            [(row["kind"], row["delta"], row["quantity"]) for row in movements],
+            [("consume", -5, 20), ("adjust", 15, 25)],
+        )
+        self.assertEqual(response.data["results"][0]["user"], self.doctor.user.pk)
+
+        # NOTE: the ledger of another inventory is not reachable
+        response = self.client.get(
+            reverse("opd:inventory-item-movements", args=[self.foreign.pk])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_deleted_item(self):
+        saline = self.saline.pk
+        movements = [(self.gauze.pk, 1), (saline, 1)]
+        self.saline.delete()
+        for kind in (StockMovement.RESTOCK, StockMovement.CONSUME):
+            with self.assertRaises(UnknownItems) as raised:
+                move_stock(self.doctor.inventory, movements, kind)
+            self.assertEqual(raised.exception.items, [saline])
+        self.assertEqual(self.quantities(), [10])
+
+        # NOTE: deleted between the validation of the batch and its update
+        with mock.patch("opd.api.views.move_stock", side_effect=UnknownItems([7])):
+            response = self.post("restock", (self.gauze, 1))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data["items"], [7])
+
+    def test_put_after_consume(self):
+        get_object = InventoryItemViewSet.get_object
+
+        def stale_get_object(view):
+            item = get_object(view)
+            # NOTE: a consume/ lands between the read of the item and its PUT
+            move_stock(
+                self.doctor.inventory, [(self.gauze.pk, 4)], StockMovement.CONSUME
+            )
+            return item
+
+        url = reverse("opd:inventory-item-detail", args=[self.gauze.pk])
+        with mock.patch.object(InventoryItemViewSet, "get_object", stale_get_object):
+            response = self.client.put(
+                url, {"item_name": "gauze", "item_quantity": 10, "item_price": 1}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(self.gauze.movements.order_by("id").values_list("kind", "delta")),
+            [("consume", -4), ("adjust", 4)],
+        )
+
+    def test_admin(self):
+        admin = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse("admin:opd_inventoryitem_change", args=[self.gauze.pk]),
+            {
+                "inventory": self.doctor.inventory.pk,
+                "item_name": "gauze",
+                "item_quantity": 4,
+                "item_price": 1,
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        movement = StockMovement.objects.get()
+        self.assertEqual(
+            (movement.item, movement.kind, movement.delta, movement.user),
+            (self.gauze, StockMovement.ADJUST, -6, admin),
+        )
+
+        # NOTE: the ledger can be read, not written
+        change = reverse("admin:opd_stockmovement_change", args=[movement.pk])
+        self.assertEqual(self.client.get(change).status_code, 200)
+        self.assertEqual(self.client.post(change, {"delta": 0}).status_code, 403)
+        delete = reverse("admin:opd_stockmovement_delete", args=[movement.pk])
+        self.assertEqual(self.client.post(delete, {"post": "yes"}).status_code, 403)
+        add = reverse("admin:opd_stockmovement_add")
+        self.assertEqual(self.client.get(add).status_code, 403)
+        movement.refresh_from_db()
+        self.assertEqual(movement.delta, -6)
+
+
+class EndpointQueryPlanTest(APITestCase):
+    """
+    every SELECT run by the doctor endpoints must use an index: a plain
+    "SCAN <table>" or a temporary b-tree for the ORDER BY is a regression.
+    """
+
+    FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)\S+$|USE TEMP B-TREE")
+
+    def setUp(self):
+        self.doctor = create_doctor("doctor")
+        other = create_doctor("other")
+        for doctor in (self.doctor, other):
+            create_patients(doctor, 20)
+            Appointment.objects.bulk_create(
+                Appointment(doctor=doctor, name=f"appointment {index}")
+                for index in range(20)
+            )
+            InventoryItem.objects.bulk_create(
+                InventoryItem(inventory=doctor.inventory, item_name=f"item {index}")
+                for index in range(20)
+            )
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.doctor.user.auth_token.key
+        )
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+
+        for query in queries.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            plan = self.explain(query["sql"])
+            scans = [line for line in plan if self.FULL_SCAN.search(line)]
+            self.assertEqual(scans, [], f"{url} {params}\n{query['sql']}\n{plan}")
+        return response
+
+    def test_doctor_and_opd(self):
+        self.assertIndexed(reverse("opd:doctor"))
+        self.assertIndexed(reverse("opd:opd"))
+
+    def test_appointments(self):
+        url = reverse("opd:appointment-list")
+        response = self.assertIndexed(url, {"page_size": 5})
+        self.assertIndexed(response.data["next"])
+        self.assertIndexed(url, {"active": "false"})
+        appointment = Appointment.objects.filter(doctor=self.doctor).first()
+        self.assertIndexed(reverse("opd:appointment-detail", args=[appointment.pk]))
+
+    def test_patients(self):
+        url = reverse("opd:patient-list")
+        response = self.assertIndexed(url, {"page_size": 5})
+        self.assertIndexed(response.data["next"])
+        response = self.assertIndexed(url, {"page_size": 5, "ordering": "name"})
+        self.assertIndexed(response.data["next"])
+        patient = Patient.objects.filter(doctor=self.doctor).first()
+        self.assertIndexed(reverse("opd:patient-detail", args=[patient.pk]))
+
+    def test_inventory(self):
+        self.assertIndexed(reverse("opd:inventory-item-list"))
+        self.assertIndexed(reverse("opd:inventory-item-summary"))
+
+    def test_exports(self):
+        for name in (
+            "opd:patient-export",
+            "opd:appointment-export",
+            "opd:inventory-item-export",
+        ):
+            self.assertIndexed(reverse(name))
+            self.assertIndexed(reverse(name), {"since": "2020-01-01"})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # NOTE: first, it times everything below it
+    "opd.middleware.InstrumentationMiddleware",
+    # NOTE: does nothing unless TRAFFIC_LOG["PATH"] is set
+    "opd.middleware.TrafficRecorderMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -77,6 +82,27 @@ WSGI_APPLICATION = "sih_api.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLITE_TUNED=0 falls back to the stock sqlite configuration of Django.
+# tuned mode: WAL lets the readers run while one writer commits, every
+# transaction takes the write lock when it begins (BEGIN IMMEDIATE) so that
+# concurrent writers queue on busy_timeout instead of failing with
+# "database is locked", and connections are kept between requests (WSGI only).
+SQLITE_TUNED = os.environ.get("SQLITE_TUNED", "1") == "1"
+
+# NOTE: set by sih_api/asgi.py. under ASGI every sync part of a request runs in
+# a thread of its own, a persistent connection would be left open per thread,
+# so the connections are closed at the end of each request (CONN_MAX_AGE=0)
+ASGI = os.environ.get("DJANGO_SERVER") == "asgi"
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # durable with WAL, without an fsync per commit
+    "busy_timeout": 5000,  # milliseconds
+    "cache_size": -20000,  # negative value is in KiB, so 20 MB per connection
+    "mmap_size": 134217728,  # 128 MB
+    "temp_store": "MEMORY",
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
@@ -84,6 +110,20 @@ DATABASES = {
     }
 }
 
+if SQLITE_TUNED:
+    DATABASES["default"].update(
+        {
+            "CONN_MAX_AGE": 0 if ASGI else 600,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "init_command": ";".join(
+                    f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+                ),
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
+    )
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -128,7 +168,75 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
-        "rest_framework.authentication.SessionAuthentication",
+        "opd.api.authentication.DoctorTokenAuthentication",
+        "opd.api.authentication.DoctorSessionAuthentication",
     ],
+    # NOTE: the proxies in front of the server. the throttles key on the
+    # client IP, 0 takes REMOTE_ADDR and ignores X-Forwarded-For, which the
+    # client sets. behind N proxies that append to it, set N.
+    "NUM_PROXIES": 0,
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # NOTE: or django.core.cache.backends.filebased.FileBasedCache with a LOCATION
+    "responses": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "opd-responses",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# rendered doctor/ and doctor/opd/ responses (see opd/api/response_cache.py)
+RESPONSE_CACHE = {
+    "ALIAS": "responses",
+    "TIMEOUT": 300,
+    # NOTE: worker processes serving the api, the LocMemCache above is only
+    # used while there is one of them
+    "WORKERS": int(os.environ.get("WEB_CONCURRENCY", 1)),
+    # NOTE: cache_resource names of the views that must not be cached
+    "DISABLED": [],
+}
+
+# profile image variants made by the worker of opd/images.py
+IMAGE_VARIANTS = {
+    "SIZES": {
+        "thumbnail_64": (64, 64),
+        "thumbnail_256": (256, 256),
+        "webp": None,
+    },
+    "MAX_SIZE": (1024, 1024),
+    "QUALITY": 80,
+}
+
+# token buckets of login/ and register/ per client IP and per username, kept in
+# the memory of each process (see opd/api/throttling.py)
+AUTH_THROTTLE = {
+    # NOTE: "<count>/<second|minute|hour|day>", a bucket holds count tokens
+    "login": {"ip": "30/minute", "username": "10/minute"},
+    "register": {"ip": "10/minute", "username": "5/minute"},
+    "MAX_KEYS": 100000,
+}
+
+# cursor pagination of the appointment and patient lists (see opd/api/pagination.py)
+KEYSET_PAGINATION = {
+    "PAGE_SIZE": 50,
+    "MAX_PAGE_SIZE": 500,
+}
+
+# per url name latency histograms, served at api/metrics/ (see opd/metrics.py)
+METRICS = {
+    "ENABLED": True,
+    # NOTE: the db, serializer and total times of every response, for the staff
+    # users only. False for nobody, True for every client
+    "SERVER_TIMING": "staff",
+}
+
+# recording of the api traffic for the replay_traffic command (see opd/replay.py)
+TRAFFIC_LOG = {
+    "PATH": os.environ.get("TRAFFIC_LOG"),
+    "PREFIX": "/api/",
 }